@@ -0,0 +1,451 @@
+# app/cli.py
+"""Headless batch runner and batch worker.
+
+    python -m app.cli batch input.csv -o results.ndjson --workers 4 --resume
+
+Runs every input row (CSV, JSONL or Parquet, optionally gzip/zstd) through the
+same pipeline as the web UI, without the server. The input is read as workers
+free up, never held whole in memory. Results are written as each
+row finishes (NDJSON or CSV, to a file or stdout), so a killed run loses
+nothing; --resume skips rows that already have a successful result in the
+output file.
+
+    python -m app.cli worker --workers 4
+
+Consumes batch rows submitted through the web UI from the shared job table
+(SCHEMAGEN_DB_URL). Run as many as you like, on this host or others; point
+SCHEMAGEN_JOB_BACKEND at the same shared backend so the web UI sees progress.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Set, TextIO, Union
+
+CSV_FIELDS = ["row", "url", "page_type_label", "primary_type", "overall", "valid", "competitor1_overall",
+              "competitor2_overall", "error", "jsonld"]
+
+
+def _format_for(path: Optional[str], fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path and path.lower().endswith(".csv") else "ndjson"
+
+
+def _record(row_no: int, row: Dict[str, str], result: Optional[Dict[str, Any]], error: Optional[str]) -> Dict[str, Any]:
+    if result is None:
+        return {"row": row_no, "url": row.get("url", ""), "error": error}
+    out = {"row": row_no}
+    for k in ("url", "page_type_label", "primary_type", "secondary_types", "overall", "valid", "validation_errors",
+              "jsonld", "comparisons", "comparison_notes", "advice", "timings", "stage_errors", "coalesced_with"):
+        if k in result:
+            out[k] = result[k]
+    return out
+
+
+class _Writer:
+    """Append results to NDJSON or CSV and flush after every row."""
+
+    def __init__(self, stream: TextIO, fmt: str, write_header: bool):
+        self.stream = stream
+        self.fmt = fmt
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.DictWriter(stream, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            if write_header:
+                self._csv.writeheader()
+
+    def write(self, rec: Dict[str, Any]) -> None:
+        if self._csv is not None:
+            comps = rec.get("comparisons") or []
+            self._csv.writerow({
+                **rec,
+                "competitor1_overall": comps[0].get("overall") if len(comps) > 0 and isinstance(comps[0], dict) else "",
+                "competitor2_overall": comps[1].get("overall") if len(comps) > 1 and isinstance(comps[1], dict) else "",
+                "jsonld": json.dumps(rec["jsonld"], ensure_ascii=False) if rec.get("jsonld") is not None else "",
+            })
+        else:
+            self.stream.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+        self.stream.flush()
+
+
+def completed_rows(path: str, fmt: str) -> Set[int]:
+    """Row numbers that already have a result without an error in an existing output.
+    Lines that do not parse (torn by a killed run) are skipped."""
+    done: Set[int] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            records = csv.DictReader(f)
+        else:
+            records = (_json_line(line) for line in f if line.strip())
+        while True:
+            try:
+                rec = next(records)
+            except StopIteration:
+                break
+            except csv.Error:
+                # A quoted field left open at the end of the file
+                break
+            try:
+                if isinstance(rec, dict) and rec.get("row") and not rec.get("error"):
+                    done.add(int(rec["row"]))
+            except (TypeError, ValueError):
+                continue
+    return done
+
+
+def _json_line(line: str) -> Any:
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return None
+
+
+def _whole_records_end(path: str, fmt: str) -> int:
+    """Offset just past the last complete record; a run killed mid-write leaves a torn one after it."""
+    end = 0
+    with open(path, "rb") as f:
+        if fmt != "csv":
+            for line in f:
+                if line.endswith(b"\n"):
+                    end += len(line)
+            return end
+        pos, ended = [0], [True]
+
+        def lines():
+            for line in f:
+                pos[0] += len(line)
+                ended[0] = line.endswith(b"\n")
+                yield line.decode("utf-8", "replace")
+
+        try:
+            for _ in csv.reader(lines()):
+                if ended[0]:
+                    end = pos[0]
+        except csv.Error:
+            pass
+    return end
+
+
+def drop_torn_tail(path: str, fmt: str) -> None:
+    """Cut a half-written last record so resumed output starts on a line of its own."""
+    if not os.path.exists(path):
+        return
+    end = _whole_records_end(path, fmt)
+    if end < os.path.getsize(path):
+        print(f"[batch] dropping a half-written record at the end of {path}", file=sys.stderr)
+        with open(path, "rb+") as f:
+            f.truncate(end)
+
+
+class _Progress:
+    def __init__(self, total: Optional[int], every: float, stream: Optional[TextIO] = None):
+        # total is the rows to run when known up front (see count_rows), else None
+        # until the input has been read; `queued` counts rows so far
+        self.total = total
+        self.queued = 0
+        self.every = every
+        self.stream = stream or sys.stderr
+        self.done = self.failed = 0
+        self.t0 = time.monotonic()
+        self._last = 0.0
+
+    def tick(self, ok: bool) -> None:
+        self.done += 1
+        self.failed += 0 if ok else 1
+        now = time.monotonic()
+        if now - self._last >= self.every or self.done == self.total:
+            self._last = now
+            self.report()
+
+    def report(self) -> None:
+        elapsed = max(1e-6, time.monotonic() - self.t0)
+        rate = self.done / elapsed
+        if self.total is None:
+            # Still reading the input: no ETA yet
+            of, eta = f"{self.queued}+", float("inf")
+        else:
+            of = str(self.total)
+            eta = (self.total - self.done) / rate if rate > 0 else float("inf")
+        eta_s = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "--:--:--"
+        print(f"[batch] {self.done}/{of} done ({self.failed} failed) | {rate * 60:.1f} rows/min | ETA {eta_s}",
+              file=self.stream, flush=True)
+
+
+async def _aiter(rows: Union[Iterable, AsyncIterable]) -> AsyncIterator[Dict[str, str]]:
+    if hasattr(rows, "__aiter__"):
+        async for row in rows:
+            yield row
+    else:
+        for row in rows:
+            yield row
+
+
+async def count_rows(chunks: AsyncIterator[bytes], skip: Set[int] = frozenset()) -> Optional[int]:
+    """Rows a run over this input will process: a parse-only pass, so the
+    progress line has an ETA from the start. None if the input does not parse."""
+    from app.services.batch_input import BatchInput, InputFormatError
+
+    n = 0
+    try:
+        async for _ in BatchInput().rows(chunks):
+            n += 1
+    except InputFormatError:
+        return None
+    return n - sum(1 for r in skip if r <= n)
+
+
+async def run_batch(rows: Union[Iterable, AsyncIterable], writer: _Writer, workers: int = 4,
+                    skip: Set[int] = frozenset(), progress_every: float = 10.0,
+                    save_history: bool = False, total: Optional[int] = None) -> Dict[str, int]:
+    """Process rows (a list or an async stream, read as workers free up) with a
+    bounded pool of workers; rows are numbered from 1. total (rows to run, if
+    already counted) lets progress lines show an ETA before the input is read."""
+    from app.db import AsyncSessionLocal, init_db
+    from app.main_part2 import _process_shared
+    from app.services.fetch import close_browser
+    from app.services import resilience
+    from app.services.history import record_run
+    from app.services.singleflight import SingleFlight
+
+    await init_db()
+    progress = _Progress(total, progress_every)
+    read = [0]
+    competitor_cache = SingleFlight("competitor")
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    retries = [0]
+    failures: Dict[str, int] = {}
+
+    async def worker() -> None:
+        async with AsyncSessionLocal() as session:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                row_no, row = item
+                result, error = None, None
+                with resilience.tracking() as row_retries:
+                    try:
+                        result = await _process_shared(
+                            row.get("url", ""), row.get("topic"), row.get("subject"), row.get("audience"),
+                            row.get("address"), row.get("phone"), row.get("existing") or row.get("compare_existing"),
+                            row.get("competitor1"), row.get("competitor2"), row.get("page_type") or None, session,
+                            competitor_cache=competitor_cache,
+                        )
+                        if save_history:
+                            await record_run(session, result)
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                        kind = resilience.classify(e) or "error"
+                        failures[kind] = failures.get(kind, 0) + 1
+                        print(f"[batch] row {row_no} failed: {error}", file=sys.stderr)
+                        if os.getenv("SCHEMAGEN_DEBUG"):
+                            traceback.print_exc()
+                        await session.rollback()
+                retries[0] += sum(row_retries.values())
+                writer.write(_record(row_no, row, result, error))
+                progress.tick(error is None)
+
+    async def feed() -> None:
+        try:
+            # The queue is bounded, so the input is read only as fast as rows are processed
+            async for row in _aiter(rows):
+                read[0] += 1
+                if read[0] in skip:
+                    continue
+                progress.queued += 1
+                await queue.put((read[0], row))
+            progress.total = progress.queued
+        finally:
+            for _ in range(max(1, workers)):
+                await queue.put(None)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(max(1, workers))]
+    tasks.append(asyncio.create_task(feed()))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await close_browser()
+    if progress.queued:
+        progress.report()
+    return {"total": read[0], "skipped": read[0] - progress.queued, "done": progress.done, "failed": progress.failed,
+            "retries": retries[0], "failures": failures}
+
+
+async def run_worker(workers: int = 4, poll: float = 2.0, exit_when_idle: bool = False) -> int:
+    """Claim and run persisted batch rows until interrupted (or, with exit_when_idle, none are left)."""
+    from app.db import init_db
+    from app.services import jobstore
+    from app.services.batchrun import run_claimed
+    from app.services.fetch import close_browser
+    from app.services.singleflight import SingleFlight
+
+    await init_db()
+    # Competitor scores are shared within a batch, as in the web process
+    caches: Dict[Optional[str], SingleFlight] = {}
+    ran = 0
+
+    async def loop() -> None:
+        nonlocal ran
+        while True:
+            try:
+                rec = await jobstore.claim_next()
+            except Exception as e:
+                print(f"[worker] claim failed: {e}", file=sys.stderr)
+                rec = None
+            if rec is None:
+                if exit_when_idle:
+                    return
+                await asyncio.sleep(poll)
+                continue
+            if rec.batch_id not in caches and len(caches) >= 32:
+                caches.pop(next(iter(caches)))
+            cache = caches.setdefault(rec.batch_id, SingleFlight("competitor"))
+            try:
+                status, _ = await run_claimed(rec, cache)
+                print(f"[worker] {rec.id} (batch {rec.batch_id} row {rec.row_no}): {status}", file=sys.stderr)
+            except Exception as e:
+                # Lease runs out and the row is retried (up to SCHEMAGEN_JOB_ATTEMPTS)
+                print(f"[worker] {rec.id} crashed: {e}", file=sys.stderr)
+            ran += 1
+
+    print(f"[worker] {jobstore.WORKER_ID} polling with {workers} slots", file=sys.stderr)
+    tasks = [asyncio.create_task(loop()) for _ in range(max(1, workers))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await close_browser()
+    return ran
+
+
+def _cmd_worker(args: argparse.Namespace) -> int:
+    try:
+        ran = asyncio.run(run_worker(args.workers, args.poll, args.exit_when_idle))
+    except KeyboardInterrupt:
+        print("[worker] stopped; rows in progress are retried once their lease expires", file=sys.stderr)
+        return 130
+    print(f"[worker] idle after {ran} rows", file=sys.stderr)
+    return 0
+
+
+def _cmd_batch(args: argparse.Namespace) -> int:
+    try:
+        return asyncio.run(_batch(args))
+    except KeyboardInterrupt:
+        print("[batch] interrupted; rerun with --resume to continue", file=sys.stderr)
+        return 130
+
+
+async def _batch(args: argparse.Namespace) -> int:
+    from app.services.batch_input import BatchInput, InputFormatError
+
+    async def chunks():
+        with open(args.input, "rb") as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    return
+                yield chunk
+
+    source = BatchInput()
+    stream_rows = source.rows(chunks())
+
+    def report() -> bool:
+        for w in source.new_warnings():
+            print(f"[batch] {w}", file=sys.stderr)
+        for e in source.errors:
+            print(f"[batch] ERROR: {e}", file=sys.stderr)
+        return not source.errors
+
+    # The first row settles the format and columns before any output is written
+    try:
+        first = await stream_rows.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except InputFormatError as e:
+        print(f"[batch] ERROR: {e}", file=sys.stderr)
+        return 2
+    if first is None:
+        report()
+        return 2
+    report()
+
+    async def rows():
+        yield first
+        async for row in stream_rows:
+            for w in source.new_warnings():
+                print(f"[batch] {w}", file=sys.stderr)
+            yield row
+        report()
+
+    to_stdout = args.output in (None, "-")
+    fmt = _format_for(None if to_stdout else args.output, args.format)
+    skip: Set[int] = set()
+    if args.resume:
+        if to_stdout:
+            print("[batch] --resume needs --output FILE", file=sys.stderr)
+            return 2
+        drop_torn_tail(args.output, fmt)
+        skip = completed_rows(args.output, fmt)
+        print(f"[batch] resuming: {len(skip)} rows already done", file=sys.stderr)
+    total = await count_rows(chunks(), skip)
+
+    if to_stdout:
+        stream, close = sys.stdout, False
+        write_header = True
+    else:
+        write_header = not (args.resume and os.path.exists(args.output) and os.path.getsize(args.output) > 0)
+        stream, close = open(args.output, "a" if args.resume else "w", newline="", encoding="utf-8"), True
+    try:
+        summary = await run_batch(rows(), _Writer(stream, fmt, write_header), workers=args.workers, skip=skip,
+                                  progress_every=args.progress_every, save_history=args.save_history,
+                                  total=total)
+    except InputFormatError as e:
+        print(f"[batch] ERROR: {e}; rerun with --resume once the input is fixed", file=sys.stderr)
+        return 2
+    finally:
+        if close:
+            stream.close()
+    print(f"[batch] finished: {json.dumps(summary)}", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="schema-gen command line")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("batch", help="run a CSV of URLs through the pipeline")
+    b.add_argument("input", help="CSV, JSONL or Parquet (optionally gzip/zstd) with a url column, as for the web batch upload")
+    b.add_argument("-o", "--output", help="output file (.ndjson or .csv); default stdout")
+    b.add_argument("--format", choices=["ndjson", "csv"], help="output format (default: from the file extension, else ndjson)")
+    b.add_argument("-w", "--workers", type=int, default=int(os.getenv("SCHEMAGEN_CLI_WORKERS", "4")),
+                   help="rows processed concurrently (default 4)")
+    b.add_argument("--resume", action="store_true", help="skip rows already written successfully to --output and append")
+    b.add_argument("--progress-every", type=float, default=10.0, help="seconds between progress lines on stderr")
+    b.add_argument("--save-history", action="store_true", help="also record each result in the history database")
+    b.set_defaults(func=_cmd_batch)
+
+    w = sub.add_parser("worker", help="run batch rows queued by the web UI (shared job table)")
+    w.add_argument("-w", "--workers", type=int, default=int(os.getenv("SCHEMAGEN_CLI_WORKERS", "4")),
+                   help="rows processed concurrently (default 4)")
+    w.add_argument("--poll", type=float, default=2.0, help="seconds between polls when there is nothing to do")
+    w.add_argument("--exit-when-idle", action="store_true", help="exit once no claimable rows are left")
+    w.set_defaults(func=_cmd_worker)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,7 @@
 from __future__ import annotations
 from typing import AsyncGenerator
 from sqlmodel import SQLModel
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 import os
@@ -10,6 +11,16 @@ DB_URL = os.getenv("SCHEMAGEN_DB_URL", "sqlite+aiosqlite:///./schema_gen.db")
 engine = create_async_engine(DB_URL, echo=False, future=True)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+if engine.dialect.name == "sqlite":
+    # Several processes (uvicorn workers, `app.cli worker`) share this file:
+    # WAL lets readers run alongside the writer, busy_timeout waits out locks.
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA busy_timeout=5000")
+        cur.close()
+
 async def init_db() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
@@ -1,19 +1,23 @@
 
 from __future__ import annotations
 
+import asyncio
 import importlib
 import os
 import sys
+import time
 from pathlib import Path
 from typing import Optional
 
 from fastapi import Depends, FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse
 
 from app.db import get_session, init_db
 from app.services.settings import get_settings
+from app.services.prewarm import readiness, record_component, run_prewarm
+from app.services import metrics, progress
 
 APP_NAME = "schema-gen"
 app = FastAPI(title=f"{APP_NAME} API")
@@ -75,7 +79,30 @@ print(f"[INFO] Mounted routers: {loaded}", file=sys.stderr)
 
 @app.on_event("startup")
 async def startup_event():
+    t0 = time.perf_counter()
     await init_db()
+    record_component("db", (time.perf_counter() - t0) * 1000)
+    # Persisted batch jobs left unfinished by a previous process go back on the queue
+    batch = _try("app.web.routers.batch")
+    if batch is not None and hasattr(batch, "resume_batches"):
+        app.state.resume_task = asyncio.create_task(batch.resume_batches())
+    # Browser, validators, settings and Ollama models warm in the background; /readyz gates traffic
+    app.state.prewarm_task = asyncio.create_task(run_prewarm(db_ready=True))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    from app.services.fetch import close_browser
+    await close_browser()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    await progress.refresh_store_stats()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/readyz")
+async def readyz():
+    state = readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request, session=Depends(get_session)):
@@ -12,7 +12,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.db import init_db, get_session
 from app.services.settings import get_settings, update_settings
 from app.services.providers import list_ollama_models
-from app.services.page_types import get_map, upsert_type, delete_type
+from app.services.page_types import get_map, upsert_type, delete_type, resolve_types
 from app.services.csv_ingest import parse_csv
 from app.services.fetch import fetch_url
 from app.services.extract import extract_clean_text
@@ -24,8 +24,10 @@ from app.services.signals import extract_signals
 from app.services.normalize import normalize_jsonld
 from app.services.graph import assemble_graph
 from app.services.history import record_run, list_runs, get_run as db_get_run
-from app.services.progress import create_job, update_job, finish_job, get_job
+from app.services.progress import create_job, update_job, finish_job, get_job, set_job_status, subscribe, wait_for_job
 from app.services.enhance import enhance_jsonld
+from app.services.tracing import trace_job
+from app.services.jobqueue import INTERACTIVE, QueueFull, job_queue
 
 app = FastAPI(title="Schema Gen", version="1.7.7")
 templates = Jinja2Templates(directory="app/web/templates")
@@ -48,21 +50,3 @@ def _safe_filename_from_url(url: str, prefix: str, ext: str) -> str:
     host = urlparse(url).netloc.replace(":", "_") or "schema"
     ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
     return f"{prefix}-{host}-{ts}.{ext}"
-
-async def resolve_types(session: AsyncSession, label: str | None):
-    s = await get_settings(session)
-    mapping = s.page_type_map or {}
-    # Case-insensitive matching per requirements
-    effective_label = (label or s.page_type or "WebPage")
-    key = (effective_label or "").strip().lower()
-    map_ci = { (k or "").strip().lower(): v for k, v in (mapping or {}).items() }
-    cfg = map_ci.get(key)
-    if cfg is None:
-        # fall back to exact key if stored with different whitespace
-        cfg = mapping.get(effective_label)
-    if cfg is None:
-        cfg = {"primary": effective_label, "secondary": []}
-    primary = cfg.get("primary") or effective_label
-    secondary = cfg.get("secondary") or []
-    return effective_label, primary, secondary, s
-
@@ -1,60 +1,342 @@
-async def _process_single(url: str, topic, subject, audience, address, phone, compare_existing, competitor1, competitor2, label, session: AsyncSession):
-    raw_html = await fetch_url(url)
-    cleaned_text = extract_clean_text(raw_html)
-    sig = extract_signals(raw_html)
+from __future__ import annotations
+import asyncio
+import copy
+import os
+import sys
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Sequence
 
-    page_label, primary_type, secondary_types, s = await resolve_types(session, label)
-    provider = get_provider(s.provider or "dummy", model=s.provider_model or None)
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app import db
+from app.services.fetch import fetch_url
+from app.services.extract import extract_clean_text
+from app.services.ai import get_provider, GenerationInputs
+from app.services.schemas import load_schema, defaults_for
+from app.services.validate import validate_against_schema
+from app.services.score import score_jsonld
+from app.services.signals import extract_signals
+from app.services.normalize import normalize_jsonld
+from app.services.graph import assemble_graph
+from app.services.enhance import enhance_jsonld
+from app.services.page_types import resolve_types
+from app.services.pipeline import Stage, StageWeights, replace_stage, run_stages
+from app.services.singleflight import SingleFlight
+from app.services import resilience
+from app.services.progress import create_job, finish_job, follow_job, update_job, set_job_detail, link_job, unlink_job
+from app.services.settings import get_settings
+from app.services.coalesce import job_fingerprint
+from app.services.metrics import JOBS_COALESCED
+from app.services.tracing import current_trace_id, trace_job
+
+FETCH_TIMEOUT = 45
+GEN_TIMEOUT = 120
+# Overall time a job may take (0: no limit). Fetch (with its retries),
+# generation and competitor scoring each get a share of it (Stage.budget), so
+# a slow page is cut off at a predictable point instead of holding a worker.
+JOB_DEADLINE = float(os.getenv("SCHEMAGEN_JOB_DEADLINE", "240"))
+
+def _root(jsonld: Any) -> Dict[str, Any]:
+    if isinstance(jsonld, dict) and isinstance(jsonld.get("@graph"), list) and jsonld["@graph"]:
+        return jsonld["@graph"][0]
+    return jsonld if isinstance(jsonld, dict) else {}
+
+# ---- stage functions: keyword arguments are stage inputs ----
+
+async def _stage_fetch(url, progress):
+    # FETCH_TIMEOUT is per attempt; transient failures are retried behind the host's breaker
+    return await resilience.call(lambda: fetch_url(url, on_progress=progress), host=resilience.host_of(url),
+                                 timeout=FETCH_TIMEOUT)
+
+async def _stage_resolve(session, label):
+    return await resolve_types(session, label)
+
+def _stage_extract(raw_html):
+    return extract_clean_text(raw_html) if raw_html else ""
+
+def _stage_signals(raw_html):
+    return extract_signals(raw_html)
+
+async def _stage_generate(url, cleaned_text, sig, topic, subject, audience, address, phone, primary_type, settings, progress):
+    provider = get_provider(settings.provider or "dummy", model=settings.provider_model or None)
     payload = GenerationInputs(
         url=url, cleaned_text=cleaned_text, topic=topic, subject=subject, audience=audience,
         address=address or sig.get("address"), phone=phone or sig.get("phone"), sameAs=sig.get("sameAs"),
-        page_type=primary_type,
+        page_type=primary_type, signals=sig, on_progress=progress,
     )
-    base_jsonld = await provider.generate_jsonld(payload)
+    return await provider.generate_jsonld(payload)
 
-    inputs = {"topic": topic, "subject": subject, "address": address, "phone": phone, "url": url}
-    primary_node = normalize_jsonld(base_jsonld, primary_type, inputs)
-    final_jsonld = assemble_graph(primary_node, secondary_types, url, inputs) if secondary_types else primary_node
-    final_jsonld = enhance_jsonld(final_jsonld, secondary_types, raw_html, url, topic, subject)
+def _stage_normalize(base_jsonld, primary_type, inputs):
+    return normalize_jsonld(base_jsonld, primary_type, inputs)
 
-    schema_json = load_schema(primary_type)
-    effective_required = (s.required_fields or defaults_for(primary_type)["required"])
-    effective_recommended = (s.recommended_fields or defaults_for(primary_type)["recommended"])
+def _stage_assemble(primary_node, secondary_types, url, inputs):
+    return assemble_graph(primary_node, secondary_types, url, inputs) if secondary_types else primary_node
 
-    root_node = final_jsonld["@graph"][0] if isinstance(final_jsonld, dict) and "@graph" in final_jsonld else final_jsonld
-    valid, errors = validate_against_schema(root_node, schema_json)
-    overall, details = score_jsonld(root_node, effective_required, effective_recommended)
+def _stage_enhance(assembled, secondary_types, raw_html, url, topic, subject):
+    final_jsonld = enhance_jsonld(assembled, secondary_types, raw_html, url, topic, subject)
+    return final_jsonld, _root(final_jsonld)
 
+def _stage_unenhanced(assembled):
+    return assembled, _root(assembled)
+
+def _stage_validate(root_node, primary_type):
+    return validate_against_schema(root_node, load_schema(primary_type))
+
+def _stage_score(root_node, primary_type, settings):
+    effective_required = (settings.required_fields or defaults_for(primary_type)["required"])
+    effective_recommended = (settings.recommended_fields or defaults_for(primary_type)["recommended"])
+    overall, details = score_jsonld(root_node, effective_required, effective_recommended)
     missing_recommended = [key for key in effective_recommended if key not in root_node or root_node.get(key) in (None, "", [])]
     tips = [f"Consider adding: {key}" for key in missing_recommended]
+    return overall, details, tips, effective_required, effective_recommended
+
+async def _score_competitor(url: str, primary_type: str, settings) -> Dict[str, Any]:
+    ctx: Dict[str, Any] = {
+        "url": url, "topic": "", "subject": "", "audience": "", "address": None, "phone": None,
+        "primary_type": primary_type, "secondary_types": [], "settings": settings,
+        "progress": lambda detail: None, "inputs": {"url": url},
+    }
+    await run_stages(COMPETITOR_STAGES, ctx)
+    return {"url": url, "overall": ctx["overall"], "valid": bool(ctx["valid"]), "stage_errors": ctx["stage_errors"]}
+
+async def _stage_competitors(competitors, primary_type, settings, competitor_cache):
+    """Score competitor URLs concurrently; each URL is computed once per cache (batch).
+    comparisons[i] is competitor i+1: its scores, {"url", "error"} if scoring it
+    failed, or None if it was left blank."""
+    wanted = [(i, u.strip()) for i, u in enumerate(competitors, 1) if u and u.strip()]
+    if not wanted:
+        return [], []
+    results = await asyncio.gather(*(
+        competitor_cache.do((u, primary_type, settings.provider, settings.provider_model),
+                            lambda u=u: _score_competitor(u, primary_type, settings))
+        for _, u in wanted
+    ), return_exceptions=True)
+    comparisons: List[Any] = [None] * wanted[-1][0]
+    notes = []
+    for (i, u), r in zip(wanted, results):
+        if isinstance(r, BaseException):
+            comparisons[i - 1] = {"url": u, "error": str(r)}
+            notes.append(f"Competitor{i} failed: {r}")
+        else:
+            comparisons[i - 1] = dict(r)
+            notes.extend(f"Competitor{i}: {name} failed ({msg})" for name, msg in (r.get("stage_errors") or {}).items())
+    return comparisons, notes
+
+def _minimal_node(ctx):
+    return {"@context": "https://schema.org", "@type": ctx["primary_type"], "url": ctx["url"],
+            "dateModified": datetime.now(timezone.utc).isoformat()}
+
+# fetch/resolve/generate have no fallback: their failures fail the row (the batch
+# runner builds its own fallback graph). Everything downstream degrades per stage.
+# enhance changes the assembled graph in place (in a thread), so validate and
+# score wait for its root node rather than reading the graph while it changes.
+PIPELINE_STAGES: List[Stage] = [
+    Stage("fetch", _stage_fetch, inputs=("url", "progress"), outputs=("raw_html",), budget=0.4),
+    Stage("resolve_types", _stage_resolve, inputs=("session", "label"),
+          outputs=("page_label", "primary_type", "secondary_types", "settings")),
+    Stage("extract", _stage_extract, inputs=("raw_html",), outputs=("cleaned_text",), thread=True, fallback=""),
+    Stage("signals", _stage_signals, inputs=("raw_html",), outputs=("sig",), thread=True, fallback=lambda ctx: {}),
+    Stage("generate", _stage_generate,
+          inputs=("url", "cleaned_text", "sig", "topic", "subject", "audience", "address", "phone", "primary_type", "settings", "progress"),
+          outputs=("base_jsonld",), timeout=GEN_TIMEOUT, budget=0.55),
+    Stage("normalize", _stage_normalize, inputs=("base_jsonld", "primary_type", "inputs"), outputs=("primary_node",), fallback=_minimal_node),
+    Stage("assemble", _stage_assemble, inputs=("primary_node", "secondary_types", "url", "inputs"), outputs=("assembled",),
+          fallback=lambda ctx: ctx["primary_node"]),
+    Stage("enhance", _stage_enhance, inputs=("assembled", "secondary_types", "raw_html", "url", "topic", "subject"),
+          outputs=("final_jsonld", "root_node"), thread=True, fallback=lambda ctx: _stage_unenhanced(ctx["assembled"])),
+    Stage("validate", _stage_validate, inputs=("root_node", "primary_type"), outputs=("valid", "validation_errors"),
+          fallback=lambda ctx: (False, [f"Validation failed: {ctx['stage_errors'].get('validate')}"])),
+    Stage("score", _stage_score, inputs=("root_node", "primary_type", "settings"),
+          outputs=("overall", "details", "advice", "effective_required", "effective_recommended"),
+          fallback=lambda ctx: (0, {"subscores": {}, "recommendations": []}, [], [], [])),
+    # Starts once the page type is known, so it runs alongside the main page's stages.
+    Stage("competitors", _stage_competitors, inputs=("competitors", "primary_type", "settings", "competitor_cache"),
+          outputs=("comparisons", "comparison_notes"), timeout=FETCH_TIMEOUT + GEN_TIMEOUT, budget=0.9,
+          fallback=lambda ctx: ([], [f"Competitor scoring failed: {ctx['stage_errors'].get('competitors')}"])),
+]
+
+# Competitor pages go through the same stages without the DB-backed type lookup
+# or enhancement; a failed fetch or generation still yields a (low) score.
+COMPETITOR_STAGES: List[Stage] = replace_stage(replace_stage(replace_stage(
+    [s for s in PIPELINE_STAGES if s.name in ("fetch", "extract", "signals", "generate", "normalize", "assemble", "enhance", "validate", "score")],
+    "fetch", fallback=""), "generate", fallback=lambda ctx: {}),
+    "enhance", fn=_stage_unenhanced, inputs=("assembled",), thread=False)
 
+STAGE_LABELS = {
+    "fetch": "Fetching URL", "resolve_types": "Resolving page type", "extract": "Extracting text",
+    "signals": "Scanning signals", "generate": "Generating JSON-LD", "normalize": "Normalizing",
+    "assemble": "Assembling graph", "enhance": "Enhancing", "validate": "Validating", "score": "Scoring & advice",
+    "competitors": "Scoring competitors",
+}
+
+# Priors (ms) until real runs have been observed; progress % follows these weights.
+_weights = StageWeights({
+    "fetch": 4000, "resolve_types": 20, "extract": 300, "signals": 150, "generate": 15000,
+    "normalize": 5, "assemble": 5, "enhance": 150, "validate": 30, "score": 5, "competitors": 0,
+})
+
+# Detail writes in flight, held so they are not garbage-collected mid-write
+_detail_writes: set = set()
+
+def _detail_written(task: asyncio.Task) -> None:
+    _detail_writes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[progress] detail write failed: {task.exception()}", file=sys.stderr)
+
+def _job_reporter(job_id: str | None, stages: Sequence[Stage]):
+    """Build (on_event, progress) callbacks that push real stage progress to the job."""
+    finished: List[str] = []
+    last = [0.0]
+
+    def pct() -> int:
+        # 0-5% is reserved for queueing, 100% for finish_job
+        return 5 + int(90 * _weights.fraction(finished, stages))
+
+    async def on_event(name: str, phase: str, ctx: Dict[str, Any]) -> None:
+        label = STAGE_LABELS.get(name, name)
+        if phase == "start":
+            msg = label
+        else:
+            finished.append(name)
+            ms = ctx["timings"].get(name)
+            msg = f"{label} done ({ms:.0f} ms)" if phase == "done" else f"{label} failed, using fallback"
+        if job_id:
+            await update_job(job_id, pct(), msg)
+
+    def progress(detail: Dict[str, Any]) -> None:
+        # Called from stage internals (responses, token chunks); throttled to ~4/s
+        now = time.monotonic()
+        if not job_id or now - last[0] < 0.25:
+            return
+        last[0] = now
+        task = asyncio.ensure_future(set_job_detail(job_id, detail))
+        _detail_writes.add(task)
+        task.add_done_callback(_detail_written)
+
+    return on_event, progress
+
+async def _process_single(url: str, topic, subject, audience, address, phone, compare_existing, competitor1, competitor2, label, session: AsyncSession,
+                          stages: Sequence[Stage] | None = None, job_id: str | None = None,
+                          competitor_cache: SingleFlight | None = None, deadline: float | None = JOB_DEADLINE,
+                          trace_as: str | None = None):
+    """Run one URL through the stage graph. Pass a shared competitor_cache to
+    reuse competitor scores across the rows of a batch. Progress goes to job_id;
+    the trace is kept under trace_as (default job_id)."""
+    stages = stages or PIPELINE_STAGES
+    on_event, progress = _job_reporter(job_id, stages)
+    ctx: Dict[str, Any] = {
+        "url": url, "topic": topic, "subject": subject, "audience": audience, "address": address, "phone": phone,
+        "label": label, "session": session, "progress": progress,
+        "competitors": [competitor1, competitor2], "competitor_cache": competitor_cache or SingleFlight("competitor"),
+        "inputs": {"topic": topic, "subject": subject, "address": address, "phone": phone, "url": url},
+    }
+    trace_as = trace_as or job_id
+    with (trace_job(trace_as, "process", **{"url.full": url}) if trace_as else nullcontext()):
+        trace_id = current_trace_id()
+        await run_stages(stages, ctx, on_event=on_event, deadline=deadline)
+    _weights.observe(ctx["timings"])
+
+    root_node = ctx["root_node"]
+    cleaned_text = ctx["cleaned_text"]
     return {
-        "url": url, "page_type_label": page_label, "primary_type": primary_type, "secondary_types": secondary_types,
+        "url": url, "page_type_label": ctx["page_label"], "primary_type": ctx["primary_type"], "secondary_types": ctx["secondary_types"],
         "topic": topic, "subject": subject, "audience": audience,
         "address": root_node.get("address"), "phone": root_node.get("telephone"),
         "excerpt": cleaned_text[:2000], "length": len(cleaned_text),
-        "jsonld": final_jsonld, "valid": valid, "validation_errors": errors,
-        "overall": overall, "details": details, "iterations": 0,
-        "comparisons": [], "comparison_notes": [],
-        "advice": tips,
-        "effective_required": effective_required, "effective_recommended": effective_recommended,
+        "jsonld": ctx["final_jsonld"], "valid": ctx["valid"], "validation_errors": ctx["validation_errors"],
+        "overall": ctx["overall"], "details": ctx["details"], "iterations": 0,
+        "comparisons": ctx.get("comparisons", []), "comparison_notes": ctx.get("comparison_notes", []),
+        "advice": ctx["advice"],
+        "effective_required": ctx["effective_required"], "effective_recommended": ctx["effective_recommended"],
+        "timings": ctx["timings"], "stage_errors": ctx["stage_errors"], "trace_id": trace_id,
     }
 
-@app.get("/", response_class=HTMLResponse)
-async def index(request: Request, ok: str | None = None, error: str | None = None, session: AsyncSession = Depends(get_session)):
-    mapping = await get_map(session)
-    return templates.TemplateResponse("index.html", {"request": request, "ok": ok, "error": error, "mapping": mapping})
-
-@app.post("/submit", response_class=HTMLResponse)
-async def submit(request: Request,
-    url: str = Form(""), page_type: str | None = Form(None), topic: str | None = Form(None),
-    subject: str | None = Form(None), audience: str | None = Form(None),
-    address: str | None = Form(None), phone: str | None = Form(None),
-    compare_existing: str | None = Form(None), competitor1: str | None = Form(None), competitor2: str | None = Form(None),
-    session: AsyncSession = Depends(get_session)):
-    if not url:
-        return RedirectResponse(url=str(URL("/").include_query_params(error="Please provide a URL")), status_code=303)
-    result = await _process_single(url, topic, subject, audience, address, phone, compare_existing, competitor1, competitor2, page_type, session)
-    await record_run(session, result)
-    return templates.TemplateResponse("result.html", {"request": request, **result})
+# Identical requests already running (duplicate CSV rows, a submit while a batch
+# has the same URL) attach to that run instead of starting their own.
+_url_jobs = SingleFlight("url_job", memoize=False)
+_leaders: Dict[str, "_Flight"] = {}
+
+
+class _Flight:
+    """One coalesced run: the job that carries its progress, the job that started it."""
+
+    def __init__(self, starter: str | None):
+        self.starter = starter
+        self.job_id = f"flight-{uuid.uuid4().hex}" if starter else None
+        self.ready = asyncio.Event()
+        self.started = False
+
+
+async def _run_flight(key: str, flight: _Flight, url: str, args: tuple, competitor_cache: SingleFlight | None):
+    """The shared computation. It owns its session and progress job, so it outlives
+    any one caller; callers (the starter included) only follow its job."""
+    flight.started = True
+    status = "error"
+    try:
+        if flight.job_id:
+            await create_job(flight.job_id)
+            await follow_job(flight.starter, flight.job_id)
+        flight.ready.set()
+        async with db.AsyncSessionLocal() as session:
+            result = await _process_single(url, *args, session, job_id=flight.job_id,
+                                           competitor_cache=competitor_cache, trace_as=flight.starter)
+        status = "done"
+        return result
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        flight.ready.set()
+        if _leaders.get(key) is flight:
+            del _leaders[key]
+        if flight.job_id:
+            await finish_job(flight.job_id, None, status=status)
+
+async def _process_shared(url: str, topic, subject, audience, address, phone, compare_existing, competitor1, competitor2, label, session: AsyncSession,
+                          job_id: str | None = None, competitor_cache: SingleFlight | None = None):
+    """_process_single, coalesced on normalized URL + inputs + settings fingerprint.
+    Attached jobs mirror the running job's progress and receive a copy of its result."""
+    try:
+        config = (await get_settings(session)).model_dump(exclude={"id"})
+    except Exception:
+        config = {}
+    key = job_fingerprint(url, {
+        "topic": topic, "subject": subject, "audience": audience, "address": address, "phone": phone,
+        "compare_existing": compare_existing, "competitor1": competitor1, "competitor2": competitor2, "label": label,
+    }, config)
+    args = (topic, subject, audience, address, phone, compare_existing, competitor1, competitor2, label)
+
+    # Hold on to the running task itself: if it finishes while we link to it,
+    # we still take its result rather than starting a run of our own
+    running = _url_jobs.running(key)
+    shared = running is not None
+    flight = _leaders.get(key) if shared else None
+    if shared:
+        JOBS_COALESCED.inc()
+        if job_id and flight and flight.job_id:
+            await flight.ready.wait()
+            await link_job(job_id, flight.job_id, coalesced_with=flight.starter)
+        else:
+            flight = None
+    else:
+        # Registered before the task can start, so duplicates arriving meanwhile find it
+        flight = _Flight(job_id)
+        _leaders[key] = flight
+    try:
+        if shared:
+            result = await _url_jobs.join(key, running)
+        else:
+            result = await _url_jobs.do(key, lambda: _run_flight(key, flight, url, args, competitor_cache))
+    finally:
+        if job_id and flight and flight.job_id:
+            await unlink_job(job_id, flight.job_id)
+        if not shared and not flight.started:
+            # Cancelled before the flight task ran at all, so its own cleanup never will
+            flight.ready.set()
+            if _leaders.get(key) is flight:
+                del _leaders[key]
+    # A copy of its own: nothing (jsonld, comparisons) is shared with the leader's result
+    return {**copy.deepcopy(result), "coalesced_with": flight.starter if flight else None} if shared else result
@@ -9,29 +9,36 @@ async def submit_async(request: Request,
     await create_job(job_id)
 
     async def runner():
-        steps = [("Fetching URL",10),("Extracting text",25),("Scanning signals",35),("Generating JSON-LD",55),("Normalizing",70),("Assembling graph",80),("Enhancing",85),("Validating",90),("Scoring & advice",95)]
         try:
-            for msg, pct in steps:
-                await update_job(job_id, pct, msg)
-                await asyncio.sleep(0.12)
-            result = await _process_single(url, topic, subject, audience, address, phone, compare_existing, competitor1, competitor2, page_type, session)
+            # Progress comes from the pipeline stages themselves
+            result = await _process_shared(url, topic, subject, audience, address, phone, compare_existing, competitor1, competitor2, page_type, session, job_id=job_id)
             await finish_job(job_id, result)
         except Exception as e:
             await update_job(job_id, 100, f"Error: {e}")
-    asyncio.create_task(runner())
-    return {"job_id": job_id}
+            await set_job_status(job_id, "failed")
+    # Interactive lane: ahead of every batch row, with workers of its own
+    try:
+        position = job_queue.submit(job_id, runner, group=INTERACTIVE)
+    except QueueFull as e:
+        await finish_job(job_id, {"error": str(e)}, status="failed")
+        return JSONResponse({"error": str(e)}, status_code=503)
+    return {"job_id": job_id, "position": position}
 
 @app.get("/events/{job_id}")
 async def events(job_id: str):
     async def gen():
-        while True:
-            job = await get_job(job_id)
-            if not job: break
-            progress = job["progress"]
-            msg = job["messages"][-1]["msg"] if job["messages"] else "Starting..."
-            yield f"data: {json.dumps({'progress': progress, 'msg': msg})}\n\n"
-            if progress >= 100: break
-            await asyncio.sleep(1)
+        # Pushed by the job itself; a late joiner gets the log so far first
+        async with subscribe(job_id) as sub:
+            if sub.job is None:
+                return
+            if not sub.job["messages"]:
+                yield f"data: {json.dumps({'progress': sub.progress, 'msg': 'Starting...', 'detail': sub.job.get('detail')})}\n\n"
+            async for ev in sub:
+                if ev["type"] == "status":
+                    continue
+                yield f"data: {json.dumps({'progress': ev['progress'], 'msg': ev.get('msg') or 'Starting...', 'detail': ev.get('detail')})}\n\n"
+                if ev["progress"] >= 100:
+                    break
     return StreamingResponse(gen(), media_type="text/event-stream")
 
 @app.get("/progress/{job_id}", response_class=HTMLResponse)
@@ -40,13 +47,8 @@ async def progress_page(request: Request, job_id: str):
 
 @app.get("/result/{job_id}", response_class=HTMLResponse)
 async def result_page(request: Request, job_id: str, session: AsyncSession = Depends(get_session)):
-    timeout_s, interval_s = 25, 0.5
-    waited = 0.0
-    job = await get_job(job_id)
-    while job and not job.get("result") and (job.get("progress", 0) < 100) and waited < timeout_s:
-        await asyncio.sleep(interval_s)
-        waited += interval_s
-        job = await get_job(job_id)
+    # Wait (up to 25s) for the job to finish rather than showing the progress page
+    job = await wait_for_job(job_id, timeout=25)
 
     if not job:
         return templates.TemplateResponse("progress.html", {"request": request, "job_id": job_id, "error": "Unknown or expired job."})
@@ -56,7 +58,8 @@ async def result_page(request: Request, job_id: str, session: AsyncSession = Dep
 
     result = job["result"]
     try:
-        await record_run(session, result)
+        with trace_job(job_id, "save result"):
+            await record_run(session, result)
     except Exception as e:
         print(f"[history write failed] {e}", file=sys.stderr)
     return templates.TemplateResponse("result.html", {"request": request, **result})
@@ -2,11 +2,11 @@
 from __future__ import annotations
 from typing import Optional
 from sqlmodel import SQLModel, Field, Column, JSON
-from datetime import datetime
+from datetime import datetime, timezone
 
 class Run(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True)
     url: str = Field(index=True)
     title: Optional[str] = None
     topic: Optional[str] = None
@@ -22,3 +22,45 @@ class Run(SQLModel, table=True):
     validation_errors: list = Field(sa_column=Column(JSON), default_factory=list)
     comparisons: list = Field(sa_column=Column(JSON), default_factory=list)
     comparison_notes: list = Field(sa_column=Column(JSON), default_factory=list)
+
+class JobRecord(SQLModel, table=True):
+    """Durable batch job: one CSV row, claimed by a worker under a time-limited lease."""
+    __tablename__ = "job"
+    id: str = Field(primary_key=True)
+    batch_id: Optional[str] = Field(default=None, index=True)
+    row_no: Optional[int] = None
+    status: str = Field(default="queued", index=True)  # queued | running | paused | done | failed | cancelled
+    payload: dict = Field(sa_column=Column(JSON), default_factory=dict)
+    attempts: int = 0
+    lease_owner: Optional[str] = None
+    lease_expires: Optional[datetime] = Field(default=None, index=True)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True)
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    # Result pointer: the history Run written on completion. The full result
+    # is kept alongside because Run does not carry everything the result page shows.
+    run_id: Optional[int] = None
+    result: Optional[dict] = Field(sa_column=Column(JSON), default=None)
+
+class JobState(SQLModel, table=True):
+    """Live progress of a job, shared between processes (SCHEMAGEN_JOB_BACKEND=sqlite)."""
+    __tablename__ = "job_state"
+    id: str = Field(primary_key=True)
+    status: str = "queued"
+    progress: int = 0
+    started: float = 0.0
+    coalesced_with: Optional[str] = None
+    detail: Optional[dict] = Field(sa_column=Column(JSON), default=None)
+    result: Optional[dict] = Field(sa_column=Column(JSON), default=None)
+
+class JobMessage(SQLModel, table=True):
+    __tablename__ = "job_message"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: str = Field(index=True)
+    ts: float
+    msg: str
+
+class JobFollower(SQLModel, table=True):
+    __tablename__ = "job_follower"
+    leader_id: str = Field(primary_key=True)
+    job_id: str = Field(primary_key=True)
@@ -1,8 +1,9 @@
 
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Literal, Optional, Dict, Any, List
+from typing import Literal, Optional, Dict, Any, List, Callable
 from app.services.providers import DummyLLM, OllamaLLM, LLMProvider
+from app.services.context import DEFAULT_CONTEXT_TOKENS
 
 PageType = Literal["Hospital","MedicalClinic","Physician","MedicalWebPage"]
 
@@ -18,9 +19,15 @@ class GenerationInputs:
     page_type: str = "Hospital"
     sameAs: Optional[list[str]] = None
     secondary_types: Optional[List[str]] = None
+    signals: Optional[Dict[str, Any]] = None
+    context_budget: int = DEFAULT_CONTEXT_TOKENS
+    # None = automatic (long pages are chunked and extracted concurrently)
+    long_document: Optional[bool] = None
+    # Sub-progress callback, called with e.g. {"stage": "generate", "tokens": 128}
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
 
-def get_provider(provider_name: str = "dummy", model: str | None = None) -> LLMProvider:
+def get_provider(provider_name: str = "dummy", model: str | None = None, structured: bool = True) -> LLMProvider:
     name = (provider_name or "dummy").lower()
     if name == "ollama":
-        return OllamaLLM(model=model or "llama3")
+        return OllamaLLM(model=model or "llama3", structured=structured)
     return DummyLLM()
@@ -0,0 +1,279 @@
+# app/services/batch_input.py
+from __future__ import annotations
+
+import asyncio
+import json
+import tempfile
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.services.csv_ingest import (
+    OPTIONAL_HEADERS, REQUIRED_HEADER, CsvRowParser, _canonicalize_headers, stream_csv_rows,
+)
+
+# Batch input in any of the formats upstream systems export, detected from the
+# first bytes rather than the file name:
+#   gzip (1f 8b) / zstd (28 b5 2f fd) wrapping CSV or JSONL, decompressed as it streams
+#   JSONL         first non-blank byte is "{"
+#   Parquet       "PAR1"; needs pyarrow, read in record batches of the known columns
+#   anything else is parsed as CSV
+# Every format goes through the same header aliases and url checks as CSV.
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+PARQUET_MAGIC = b"PAR1"
+
+# Columns the pipeline reads; Parquet decodes only these
+KNOWN_COLUMNS = {REQUIRED_HEADER, *OPTIONAL_HEADERS, "existing", "compare_existing"}
+PARQUET_BATCH_ROWS = 1024
+# Parquet keeps its index at the end of the file, so a streamed upload is
+# spooled first; in memory up to this size, then on disk.
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+
+class InputFormatError(ValueError):
+    pass
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value).strip()
+
+
+class _RecordChecks:
+    """The url checks and warnings of CsvRowParser, for formats whose rows arrive as mappings."""
+
+    def __init__(self):
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+        self.valid = 0
+        self._reported = 0
+        self._checked_columns = False
+        self._stopped = False
+
+    def new_warnings(self) -> List[str]:
+        out = self.warnings[self._reported:]
+        self._reported = len(self.warnings)
+        return out
+
+    def _columns(self, names: List[str]) -> bool:
+        self._checked_columns = True
+        if REQUIRED_HEADER not in _canonicalize_headers(names):
+            self.errors.append("Input is missing the required 'url' column. Every record needs at least: url")
+            self._stopped = True
+            return False
+        return True
+
+    def _record(self, row_num: int, obj: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        keys = _canonicalize_headers(list(obj))
+        row = {k: _cell(v) for k, v in zip(keys, obj.values())}
+        if not any(row.values()):
+            return None
+        if not row.get(REQUIRED_HEADER):
+            self.warnings.append(f"Row {row_num} missing 'url' value; row skipped.")
+            return None
+        self.valid += 1
+        return row
+
+    def _finish(self) -> None:
+        if not self._checked_columns and not self.errors:
+            self.errors.append("The uploaded file has no records.")
+        elif not self.errors and self.valid == 0:
+            self.errors.append("No valid rows to process. Every row needs a non-empty 'url' value.")
+        self._stopped = True
+
+
+class JsonlRowParser(_RecordChecks):
+    """One JSON object per line; same feed/close interface as CsvRowParser.
+    The first object decides whether a url column exists."""
+
+    def __init__(self):
+        super().__init__()
+        self._buf = ""
+        self._line_num = 0
+
+    def feed(self, text: str) -> List[Dict[str, str]]:
+        if self._stopped:
+            return []
+        self._buf += text
+        lines = self._buf.split("\n")
+        self._buf = lines.pop()
+        return self._lines(lines)
+
+    def close(self) -> List[Dict[str, str]]:
+        rows = [] if self._stopped else self._lines([self._buf])
+        self._buf = ""
+        self._finish()
+        return rows
+
+    def _lines(self, lines: List[str]) -> List[Dict[str, str]]:
+        rows: List[Dict[str, str]] = []
+        for line in lines:
+            self._line_num += 1
+            if self._stopped or not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                self.warnings.append(f"Row {self._line_num} is not valid JSON; row skipped.")
+                continue
+            if not isinstance(obj, dict):
+                self.warnings.append(f"Row {self._line_num} is not a JSON object; row skipped.")
+                continue
+            if not self._checked_columns and not self._columns(list(obj)):
+                continue
+            row = self._record(self._line_num, obj)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+
+class ParquetRowReader(_RecordChecks):
+    def rows(self, path_or_file) -> AsyncIterator[Dict[str, str]]:
+        return self._rows(path_or_file)
+
+    async def _rows(self, source) -> AsyncIterator[Dict[str, str]]:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise InputFormatError("Parquet input needs the optional 'pyarrow' package (pip install pyarrow).") from e
+        pf = await asyncio.to_thread(pq.ParquetFile, source)
+        names = pf.schema_arrow.names
+        if not self._columns(names):
+            return
+        wanted = [n for n, canon in zip(names, _canonicalize_headers(names)) if canon in KNOWN_COLUMNS]
+        batches = pf.iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=wanted)
+        row_num = 0
+        while True:
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            for obj in batch.to_pylist():
+                row_num += 1
+                row = self._record(row_num, obj)
+                if row is not None:
+                    yield row
+        self._finish()
+
+
+async def _peek(chunks: AsyncIterator[bytes], n: int):
+    """First n bytes (or fewer at EOF) and an iterator that replays them."""
+    it = chunks.__aiter__()
+    head = b""
+    while len(head) < n:
+        try:
+            head += await it.__anext__()
+        except StopAsyncIteration:
+            break
+
+    async def replay():
+        if head:
+            yield head
+        async for chunk in it:
+            yield chunk
+
+    return head, replay()
+
+
+async def _gunzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        out = d.decompress(chunk)
+        # Concatenated gzip members (e.g. appended exports)
+        while d.unused_data:
+            rest = d.unused_data
+            out += d.flush()
+            d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            out += d.decompress(rest)
+        if out:
+            yield out
+    tail = d.flush()
+    if tail:
+        yield tail
+
+
+async def _unzstd(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    try:
+        import zstandard
+    except ImportError as e:
+        raise InputFormatError("zstd-compressed input needs the optional 'zstandard' package (pip install zstandard).") from e
+    d = zstandard.ZstdDecompressor().decompressobj()
+    async for chunk in chunks:
+        out = d.decompress(chunk)
+        if out:
+            yield out
+
+
+class BatchInput:
+    """Rows from batch input bytes in any supported format.
+
+        source = BatchInput()
+        async for row in source.rows(chunks): ...
+        source.new_warnings(), source.errors, source.format
+
+    Text formats stream row by row; Parquet is spooled and then read in
+    record batches.
+    """
+
+    def __init__(self):
+        self.format: Optional[str] = None
+        self.compression: Optional[str] = None
+        self.parser: Any = None
+
+    @property
+    def errors(self) -> List[str]:
+        return self.parser.errors if self.parser is not None else []
+
+    @property
+    def warnings(self) -> List[str]:
+        return self.parser.warnings if self.parser is not None else []
+
+    def new_warnings(self) -> List[str]:
+        return self.parser.new_warnings() if self.parser is not None else []
+
+    async def rows(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, str]]:
+        head, chunks = await _peek(chunks, 4)
+        if head.startswith(GZIP_MAGIC):
+            self.compression, chunks = "gzip", _gunzip(chunks)
+        elif head.startswith(ZSTD_MAGIC):
+            self.compression, chunks = "zstd", _unzstd(chunks)
+        if self.compression:
+            head, chunks = await _peek(chunks, 4)
+
+        if head.startswith(PARQUET_MAGIC):
+            self.format = "parquet"
+            self.parser = ParquetRowReader()
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+                size = 0
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > SPOOL_MAX_BYTES:
+                        # On disk from here on (the rollover included): keep the writes off the event loop
+                        await asyncio.to_thread(spool.write, chunk)
+                    else:
+                        spool.write(chunk)
+                await asyncio.to_thread(spool.seek, 0)
+                async for row in self.parser.rows(spool):
+                    yield row
+            return
+
+        head, chunks = await _peek(chunks, 64)
+        if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"{"):
+            self.format, self.parser = "jsonl", JsonlRowParser()
+        else:
+            self.format, self.parser = "csv", CsvRowParser()
+        async for row in stream_csv_rows(chunks, self.parser):
+            yield row
+
+
+async def read_rows(chunks: AsyncIterator[bytes]):
+    """Whole-input convenience: (rows, errors, warnings) like parse_csv3."""
+    source = BatchInput()
+    try:
+        rows = [row async for row in source.rows(chunks)]
+    except InputFormatError as e:
+        return [], [str(e)], source.warnings
+    return rows, source.errors, source.warnings
@@ -0,0 +1,157 @@
+# app/services/batches.py
+from __future__ import annotations
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from app.services import progress
+from app.services.singleflight import SingleFlight
+
+# A batch groups the jobs of one upload so a single stream can follow all of
+# them. Membership is registered here as rows are queued (or reloaded from the
+# job table); changes to member jobs made in this process mark them dirty on
+# every Watch of their batch, so streams wake on events instead of polling.
+
+# Batches kept beyond this are dropped oldest first, but only once finished and
+# no longer streamed; a dropped batch is reloaded from the job table on demand.
+BATCH_KEEP = int(os.getenv("SCHEMAGEN_BATCH_KEEP", "200"))
+# Job statuses that end a row (as in jobstore.FINISHED)
+FINISHED = ("done", "failed", "cancelled")
+
+
+class Watch:
+    """Dirty job ids of one batch stream, with an event to wait on."""
+
+    __slots__ = ("dirty", "event")
+
+    def __init__(self):
+        self.dirty: Set[str] = set()
+        self.event = asyncio.Event()
+
+    def touch(self, job_id: str) -> None:
+        self.dirty.add(job_id)
+        self.event.set()
+
+    def drain(self) -> Set[str]:
+        self.event.clear()
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    async def wait(self, timeout: float) -> Set[str]:
+        """Dirty ids once something changes, or an empty set after timeout seconds."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.drain()
+
+
+class Batch:
+    __slots__ = ("batch_id", "job_ids", "index", "created", "watchers", "state", "limit", "priority", "competitors",
+                 "finished", "ingesting")
+
+    def __init__(self, batch_id: str, created: Optional[float] = None):
+        self.batch_id = batch_id
+        self.job_ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.created = created or time.time()
+        self.watchers: List[Watch] = []
+        # running | paused | cancelled, the cap on its rows running at once here,
+        # and its share of the batch workers (jobqueue.PRIORITIES)
+        self.state = "running"
+        self.limit: Optional[int] = None
+        self.priority = "normal"
+        # Competitor URLs repeat across rows: each is scored once for the whole
+        # batch, through pause/resume and a restart's resume alike
+        self.competitors = SingleFlight("competitor")
+        # Rows seen to finish (here, or on a stream's resync), and whether rows are still being added
+        self.finished: Set[str] = set()
+        self.ingesting = False
+
+    def done(self) -> bool:
+        """Every row has finished (or the batch was cancelled) and no more are coming."""
+        if self.ingesting:
+            return False
+        return self.state == "cancelled" or len(self.finished) >= len(self.job_ids)
+
+    def mark(self, job_id: str, status: Optional[str]) -> None:
+        if status in FINISHED:
+            self.finished.add(job_id)
+        elif status:
+            # Requeued (deferred, resumed): running again
+            self.finished.discard(job_id)
+
+    def touch_all(self) -> None:
+        """Wake every stream of the batch (its state, limit or priority changed)."""
+        for w in self.watchers:
+            w.event.set()
+
+
+_batches: "OrderedDict[str, Batch]" = OrderedDict()
+_job_batch: Dict[str, str] = {}
+
+
+def _evict(keep: str) -> None:
+    """Drop the oldest finished, unwatched batches beyond BATCH_KEEP (never `keep`,
+    the one being registered). Running ones stay however many there are."""
+    over = len(_batches) - BATCH_KEEP
+    idle = [bid for bid, b in _batches.items() if bid != keep and b.done() and not b.watchers]
+    for batch_id in idle[:max(0, over)]:
+        old = _batches.pop(batch_id)
+        for jid in old.job_ids:
+            _job_batch.pop(jid, None)
+
+
+def register(batch_id: str, job_ids: Iterable[str], created: Optional[float] = None) -> Batch:
+    """Add job ids (in row order) to a batch, creating it on first use."""
+    b = _batches.get(batch_id)
+    if b is None:
+        b = _batches[batch_id] = Batch(batch_id, created)
+        _evict(keep=batch_id)
+    for jid in job_ids:
+        if jid in b.index:
+            continue
+        b.index[jid] = len(b.job_ids)
+        b.job_ids.append(jid)
+        _job_batch[jid] = batch_id
+        for w in b.watchers:
+            w.touch(jid)
+    return b
+
+
+def get_batch(batch_id: str) -> Optional[Batch]:
+    return _batches.get(batch_id)
+
+
+def competitor_cache(batch_id: str) -> SingleFlight:
+    b = _batches.get(batch_id)
+    if b is not None:
+        return b.competitors
+    # Batches are loaded before their rows are queued (see resume_batches); this
+    # one could not be, so its rows share nothing rather than leak a cache
+    return SingleFlight("competitor")
+
+
+def watch(batch: Batch) -> Watch:
+    w = Watch()
+    batch.watchers.append(w)
+    return w
+
+
+def unwatch(batch: Batch, w: Watch) -> None:
+    if w in batch.watchers:
+        batch.watchers.remove(w)
+
+
+def _on_job_change(job_id: str, event: Dict[str, Any]) -> None:
+    batch_id = _job_batch.get(job_id)
+    b = _batches.get(batch_id) if batch_id else None
+    if b is not None:
+        b.mark(job_id, event.get("status"))
+        for w in b.watchers:
+            w.touch(job_id)
+
+
+progress.add_listener(_on_job_change)
@@ -0,0 +1,219 @@
+# app/services/batchrun.py
+from __future__ import annotations
+import sys
+import traceback
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from app.db import get_session
+from app.models import JobRecord
+from app.services import jobstore, resilience
+from app.services.history import record_run
+from app.services.jobqueue import BATCH, set_lane
+from app.services.progress import create_job, finish_job, get_job, set_job_status, update_job
+from app.services.settings import get_settings
+from app.services.singleflight import SingleFlight
+from app.services.tracing import trace_job
+
+# Running one durable batch row. Shared by the web process's job queue and
+# standalone workers (`python -m app.cli worker`), which may run on other hosts.
+
+# Lazy import: app.main_part2 pulls in the whole pipeline
+def _get_process_single():
+    # Coalescing wrapper: duplicate rows share one in-flight run
+    from app.main_part2 import _process_shared as _ps
+    return _ps
+
+def _base_url(u: str) -> str:
+    try:
+        p = urlparse(u)
+        return f"{p.scheme}://{p.netloc}"
+    except Exception:
+        return u
+
+def _breadcrumb_from_url(u: str):
+    try:
+        p = urlparse(u)
+        seg = [s for s in p.path.split('/') if s]
+        last = seg[-1] if seg else p.netloc
+        return {"@type": "ListItem","position": 1,"item": {"@id": u, "name": last}}
+    except Exception:
+        return None
+
+def fallback_graph(label: str, url: str, subject: str, phone: str|None, address: str|None, mapping: dict):
+    # Build a best-effort @graph using admin mapping (case-insensitive)
+    key = (label or "WebPage").strip().lower()
+    cfg = None
+    if isinstance(mapping, dict):
+        lower = { (k or "").strip().lower(): v for k, v in mapping.items() }
+        cfg = lower.get(key) or mapping.get(label)
+    primary = (cfg or {}).get("primary") or label or "WebPage"
+    secondary = (cfg or {}).get("secondary") or []
+
+    # Primary
+    primary_node = {
+        "@type": primary,
+        "url": url,
+        "name": subject,
+        "dateModified": datetime.now(timezone.utc).isoformat()
+    }
+    if phone:
+        primary_node["telephone"] = phone
+    if address:
+        primary_node["address"] = {"@type":"PostalAddress","streetAddress": address}
+
+    graph = [primary_node]
+
+    # Secondary
+    site = _base_url(url)
+    for t in secondary:
+        tnorm = (t or "").strip()
+        if tnorm == "JobPosting":
+            # Only when fully populated (we don't have that here)
+            continue
+        if tnorm == "WebSite":
+            graph.append({"@type":"WebSite","url": site, "name": subject})
+        elif tnorm == "WebPage":
+            graph.append({"@type":"WebPage","url": url, "name": subject})
+        elif tnorm == "BreadcrumbList":
+            crumb = _breadcrumb_from_url(url)
+            if crumb:
+                graph.append({"@type":"BreadcrumbList","itemListElement":[crumb]})
+        else:
+            # Generic node with a name if sensible
+            node = {"@type": tnorm}
+            if tnorm.endswith("Organization") or tnorm.endswith("Clinic") or tnorm.endswith("Service") or tnorm.endswith("Specialty"):
+                node["name"] = subject
+            if tnorm.endswith("Organization"):
+                node["url"] = url
+            graph.append(node)
+
+    return {"@context":"https://schema.org", "@graph": graph}
+
+async def run_row(row: dict, job_id: str, competitor_cache: SingleFlight, can_defer: bool = False):
+    """Process one CSV row as job_id and return (status, result); failed rows get a fallback graph.
+    With can_defer, a row whose host has an open circuit breaker comes back as
+    ("deferred", {"retry_after": seconds, ...}) instead of failing."""
+    with resilience.tracking() as retries:
+        status, result = await _run_row(row, job_id, competitor_cache, can_defer)
+    if retries:
+        result["retries"] = dict(retries)
+    return status, result
+
+async def _run_row(row: dict, job_id: str, competitor_cache: SingleFlight, can_defer: bool):
+    try:
+        # Open a fresh DB session for this background task
+        async for task_session in get_session():
+            # log provider/model for quick sanity
+            try:
+                s = await get_settings(task_session)
+                prov = getattr(s, "provider", None)
+                pmodel = getattr(s, "provider_model", None)
+                await update_job(job_id, 5, f"Provider: {prov or 'unset'} | Model: {pmodel or 'unset'}")
+            except Exception:
+                await update_job(job_id, 5, "Provider: <error reading settings>")
+
+            result = await _get_process_single()(
+                row.get("url",""),
+                row.get("topic"),
+                row.get("subject"),
+                row.get("audience"),
+                row.get("address"),
+                row.get("phone"),
+                row.get("existing") or row.get("compare_existing"),
+                row.get("competitor1"),
+                row.get("competitor2"),
+                row.get("page_type") or None,
+                task_session,
+                job_id=job_id,
+                competitor_cache=competitor_cache,
+            )
+            break
+        return "done", result
+    except resilience.CircuitOpen as e:
+        if not can_defer:
+            return "failed", _failed_result(row, e, await _fallback_mapping())
+        await update_job(job_id, 0, f"Deferred: {e}")
+        return "deferred", {"url": row.get("url", ""), "error": str(e), "retry_after": e.retry_after}
+    except Exception as e:
+        await update_job(job_id, 100, f"Error: {e}")
+        return "failed", _failed_result(row, e, await _fallback_mapping())
+
+async def _fallback_mapping() -> dict:
+    # Open a short-lived session to read mapping for fallback
+    try:
+        async for ssession in get_session():
+            settings = await get_settings(ssession)
+            return settings.page_type_map or {}
+    except Exception:
+        # Absolute fallback if settings fetch fails
+        pass
+    return {}
+
+def _failed_result(row: dict, e: Exception, mapping: dict) -> dict:
+    # Build a valid @graph fallback using admin mapping
+    tb = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+    url = row.get("url", "")
+    label = row.get("page_type") or "WebPage"
+    subject = row.get("subject") or row.get("topic") or url
+    phone = row.get("phone")
+    address = row.get("address")
+    jsonld = fallback_graph(label, url, subject, phone, address, mapping)
+    return {"url": url, "error": str(e), "failure": resilience.classify(e) or "error", "traceback": tb,
+            "jsonld": jsonld}
+
+async def run_durable(job_id: str, row: dict, competitor_cache: SingleFlight,
+                      requeue: Optional[Callable[[float], Any]] = None) -> None:
+    """Claim a persisted row and run it; if it cannot be claimed, mirror its stored outcome.
+    A deferred row is handed to requeue(delay_seconds) to be submitted again."""
+    rec = await jobstore.claim(job_id)
+    if rec is None:
+        # Already finished, or a live worker elsewhere holds the lease
+        rec = await jobstore.get(job_id)
+        if rec is not None and rec.status in jobstore.FINISHED:
+            await finish_job(job_id, rec.result, status=rec.status)
+        elif rec is not None and rec.status == "paused":
+            await set_job_status(job_id, "paused")
+        return
+    status, result = await run_claimed(rec, competitor_cache)
+    if status == "deferred" and requeue is not None:
+        requeue(result["retry_after"])
+
+async def run_claimed(rec: JobRecord, competitor_cache: SingleFlight) -> Tuple[str, Dict[str, Any]]:
+    """Run a row this worker holds the lease on; record its history Run and outcome before reporting it done."""
+    job_id = rec.id
+    # Standalone workers do not go through the job queue; rows always queue as batch work
+    set_lane(BATCH)
+    if await get_job(job_id) is None:
+        # Picked up by a worker that did not create it (or the shared state expired)
+        await create_job(job_id)
+    await set_job_status(job_id, "running")
+    try:
+        async with jobstore.leased(job_id):
+            # The last attempt fails fast instead, so a host that stays down cannot hold rows forever
+            status, result = await run_row(rec.payload, job_id, competitor_cache,
+                                           can_defer=rec.attempts < jobstore.MAX_ATTEMPTS)
+            if status == "deferred":
+                await jobstore.defer(job_id, result["retry_after"])
+                await set_job_status(job_id, "queued")
+                return status, result
+            run_id: Optional[int] = None
+            if status == "done":
+                try:
+                    async for session in get_session():
+                        with trace_job(job_id, "save result"):
+                            run_id = (await record_run(session, result)).id
+                        result["run_id"] = run_id
+                except Exception as e:
+                    print(f"[batch] history write for {job_id} failed: {e}", file=sys.stderr)
+            await jobstore.complete(job_id, status, result, run_id=run_id, error=result.get("error"))
+    except jobstore.LeaseLost:
+        # Cancelled (or handed to another worker after the lease ran out) while running
+        rec = await jobstore.get(job_id)
+        status, result = (rec.status, rec.result or {}) if rec is not None else ("cancelled", {})
+        if status in jobstore.FINISHED:
+            await finish_job(job_id, rec.result if rec is not None else None, status=status)
+        return status, result
+    await finish_job(job_id, result, status=status)
+    return status, result
@@ -0,0 +1,45 @@
+# app/services/coalesce.py
+from __future__ import annotations
+import hashlib
+import json
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track the visit and never change the page.
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "mc_cid", "mc_eid", "_ga"}
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form used to spot duplicate jobs: lowercase scheme/host, no
+    default port, fragment or tracking params, sorted query, no trailing slash."""
+    raw = (url or "").strip()
+    if not raw:
+        return ""
+    if "://" not in raw:
+        raw = "https://" + raw
+    parts = urlsplit(raw)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS)
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def _norm(v: Any) -> Any:
+    return " ".join(v.split()).lower() if isinstance(v, str) else v
+
+
+def job_fingerprint(url: str, fields: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> str:
+    """Key for identical jobs: normalized URL + row inputs + generation config."""
+    body = {
+        "url": normalize_url(url),
+        "fields": {k: _norm(v) for k, v in sorted(fields.items()) if v not in (None, "")},
+        "config": config or {},
+    }
+    return hashlib.sha1(json.dumps(body, sort_keys=True, default=str).encode("utf-8")).hexdigest()
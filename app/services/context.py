@@ -0,0 +1,180 @@
+# app/services/context.py
+from __future__ import annotations
+import re
+from typing import Any, Dict, List, Optional
+
+from app.services.signals import PHONE_RE, ADDRESS_HINT_RE, HOURS_RANGE_RE
+
+# Roughly what the old cleaned_text[:1200] slice cost (~4 chars per token).
+DEFAULT_CONTEXT_TOKENS = 300
+
+# Max characters merged into one passage before starting a new one.
+PASSAGE_CHARS = 400
+
+BOILERPLATE_HINTS = (
+    "cookie", "privacy policy", "terms of use", "javascript", "sign in", "log in",
+    "subscribe", "all rights reserved", "skip to", "accept all",
+)
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {"the", "and", "for", "with", "of", "in", "at", "a", "an", "to", "our", "your", "&"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast token estimate (~4 chars/token, never fewer than the word count)."""
+    if not text:
+        return 0
+    return max((len(text) + 3) // 4, len(text.split()))
+
+
+def _is_heading(line: str) -> bool:
+    s = line.strip()
+    if not s or len(s) > 80 or s[-1] in ".,;:!?":
+        return False
+    words = s.split()
+    return len(words) <= 10 and s[0].isupper()
+
+
+def split_passages(cleaned_text: str) -> List[Dict[str, Any]]:
+    """Group cleaned text lines into passages; a heading starts a new passage.
+
+    Each passage is {"text", "heading", "pos"} where heading is the nearest
+    heading above it (or None).
+    """
+    passages: List[Dict[str, Any]] = []
+    heading: Optional[str] = None
+    buf: List[str] = []
+
+    def flush():
+        if buf:
+            passages.append({"text": "\n".join(buf), "heading": heading, "pos": len(passages)})
+            buf.clear()
+
+    for line in (cleaned_text or "").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if _is_heading(line):
+            flush()
+            heading = line
+            buf.append(line)
+            continue
+        if buf and sum(len(b) for b in buf) + len(line) > PASSAGE_CHARS:
+            flush()
+        buf.append(line)
+    flush()
+    return passages
+
+
+def _keywords(*vals: Optional[str]) -> set:
+    out = set()
+    for v in vals:
+        for w in _WORD_RE.findall((v or "").lower()):
+            if len(w) > 2 and w not in _STOPWORDS:
+                out.add(w)
+    return out
+
+
+def score_passage(passage: Dict[str, Any], signals: Dict[str, Any], keywords: set) -> float:
+    text = passage["text"]
+    low = text.lower()
+    score = 0.0
+
+    # Structured facts the model needs (address, phone, hours, known signal values)
+    score += 3.0 * min(len(PHONE_RE.findall(text)), 2)
+    if ADDRESS_HINT_RE.search(text):
+        score += 4.0
+    if HOURS_RANGE_RE.search(text):
+        score += 2.0
+    for key in ("telephone", "address", "openingHours"):
+        vals = signals.get(key) or []
+        if isinstance(vals, str):
+            vals = [vals]
+        for v in vals:
+            if isinstance(v, str) and v and v.lower() in low:
+                score += 2.0
+
+    # Topic / subject overlap, in the passage and in its heading
+    if keywords:
+        words = set(_WORD_RE.findall(low))
+        score += 1.5 * len(keywords & words)
+        heading_words = set(_WORD_RE.findall((passage.get("heading") or "").lower()))
+        score += 2.0 * len(keywords & heading_words)
+
+    # Heading proximity: passages that open a section carry its framing
+    if passage.get("heading") and text.startswith(passage["heading"]):
+        score += 1.0
+
+    # Navigation / consent residue
+    score -= 3.0 * sum(1 for h in BOILERPLATE_HINTS if h in low)
+
+    # Slight preference for earlier passages when otherwise equal
+    score -= 0.01 * passage["pos"]
+    return score
+
+
+def select_context(
+    cleaned_text: str,
+    signals: Optional[Dict[str, Any]] = None,
+    topic: Optional[str] = None,
+    subject: Optional[str] = None,
+    budget_tokens: int = DEFAULT_CONTEXT_TOKENS,
+) -> str:
+    """Pack the most information-dense passages of cleaned_text into budget_tokens.
+
+    Passages are ranked by score density (score over sqrt(tokens)) and emitted
+    in their original order.
+    """
+    text = cleaned_text or ""
+    if estimate_tokens(text) <= budget_tokens:
+        return text
+
+    passages = split_passages(text)
+    keywords = _keywords(topic, subject)
+    scored = [(score_passage(p, signals or {}, keywords), p) for p in passages]
+    ranked = sorted(scored, key=lambda sp: sp[0] / max(1, estimate_tokens(sp[1]["text"])) ** 0.5, reverse=True)
+
+    chosen: List[Dict[str, Any]] = []
+    used = 0
+    for score, p in ranked:
+        if score <= -1.0:
+            # Boilerplate never earns budget, even when there is room left
+            continue
+        cost = estimate_tokens(p["text"])
+        if used + cost > budget_tokens:
+            continue
+        chosen.append(p)
+        used += cost
+
+    if not chosen:
+        # Every passage is larger than the budget; fall back to a plain cut
+        return text[: budget_tokens * 4]
+    chosen.sort(key=lambda p: p["pos"])
+    return "\n".join(p["text"] for p in chosen)
+
+
+def chunk_sections(cleaned_text: str, max_chunks: int, min_chunk_tokens: int = DEFAULT_CONTEXT_TOKENS) -> List[str]:
+    """Split cleaned_text into at most max_chunks chunks, cutting only at passage
+    (section) boundaries. Chunks are roughly equal in tokens and cover all text.
+    """
+    passages = split_passages(cleaned_text)
+    if not passages:
+        return []
+    total = sum(estimate_tokens(p["text"]) for p in passages)
+    target = max(min_chunk_tokens, -(-total // max(1, max_chunks)))
+
+    chunks: List[str] = []
+    buf: List[str] = []
+    used = 0
+    for p in passages:
+        cost = estimate_tokens(p["text"])
+        # Prefer to cut where a new section (heading) begins once the chunk is reasonably full
+        starts_section = bool(p.get("heading")) and p["text"].startswith(p["heading"])
+        if buf and (used + cost > target or (starts_section and used >= target * 0.6)) and len(chunks) < max_chunks - 1:
+            chunks.append("\n".join(buf))
+            buf, used = [], 0
+        buf.append(p["text"])
+        used += cost
+    if buf:
+        chunks.append("\n".join(buf))
+    return chunks
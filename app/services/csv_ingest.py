@@ -1,9 +1,10 @@
 # app/services/csv_ingest.py
 from __future__ import annotations
 
+import codecs
 import csv
-import io
-from typing import Dict, List, Tuple
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
 
 REQUIRED_HEADER = "url"
 
@@ -35,60 +36,165 @@ def _canonicalize_headers(header_row: List[str]) -> List[str]:
     return canonical
 
 
-def parse_csv3(text: str) -> Tuple[List[Dict[str, str]], List[str], List[str]]:
-    """
-    Parse CSV text and return (rows, errors, warnings).
+SNIFF_CHARS = 4096
 
-    rows:     list of dicts with canonical headers
-    errors:   fatal errors (should prevent starting batch)
-    warnings: non-fatal issues (e.g., skipped empty-url rows)
 
-    Required header:
-      - url
+class _Records:
+    """Iterator the csv reader pulls complete records from; only advanced
+    after a record has been pushed, so it never runs dry mid-record."""
 
-    Optional headers (accepted if present):
-      - page_type, topic, subject, audience, address, phone(or telephone), competitor1, competitor2
+    def __init__(self):
+        self.items: Deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.items:
+            raise StopIteration
+        return self.items.popleft()
+
+
+class CsvRowParser:
+    """Incremental parse_csv3: feed() text as it arrives and get back the rows
+    completed so far; close() flushes the tail and sets the final errors.
+
+    The dialect is sniffed from the first SNIFF_CHARS characters and the header
+    canonicalized once. New warnings since the last call come from
+    new_warnings(); all of them stay in .warnings. After a fatal header error
+    (.errors) the rest of the input is ignored.
     """
-    errors: List[str] = []
-    warnings: List[str] = []
-    rows: List[Dict[str, str]] = []
 
-    if not text or not text.strip():
-        return [], ["The uploaded CSV appears to be empty."], []
+    def __init__(self):
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+        self.valid = 0
+        self._reported = 0
+        self._buf = ""
+        self._dialect = None
+        self._records = _Records()
+        self._reader = None
+        self._record = ""        # lines of a record whose quoted field is still open
+        self._in_quotes = False
+        self._header: Optional[List[str]] = None
+        self._url_idx = 0
+        self._line_num = 0
+        self._stopped = False
+
+    def feed(self, text: str) -> List[Dict[str, str]]:
+        if self._stopped:
+            return []
+        self._buf += text
+        if self._dialect is None:
+            if len(self._buf) < SNIFF_CHARS:
+                return []
+            self._sniff()
+        return self._parse(final=False)
+
+    def close(self) -> List[Dict[str, str]]:
+        rows: List[Dict[str, str]] = []
+        if not self._stopped:
+            if self._dialect is None:
+                if not self._buf.strip():
+                    self.errors.append("The uploaded CSV appears to be empty.")
+                    self._stopped = True
+                    return []
+                self._sniff()
+            rows = self._parse(final=True)
+        if self._header is None and not self.errors:
+            self.errors.append("The uploaded CSV has no header row.")
+        elif not self.errors and self.valid == 0:
+            self.errors.append("No valid rows to process. Every row needs a non-empty 'url' value.")
+        self._stopped = True
+        return rows
 
-    # Use csv.Sniffer to handle common delimiters; fall back to default if sniff fails.
-    sample = text[:4096]
-    try:
-        dialect = csv.Sniffer().sniff(sample)
-    except Exception:
-        dialect = csv.excel
+    def new_warnings(self) -> List[str]:
+        out = self.warnings[self._reported:]
+        self._reported = len(self.warnings)
+        return out
 
-    reader = csv.reader(io.StringIO(text), dialect)
-    try:
-        raw_header = next(reader)
-    except StopIteration:
-        return [], ["The uploaded CSV has no header row."], []
+    def _sniff(self) -> None:
+        # Use csv.Sniffer to handle common delimiters; fall back to default if sniff fails.
+        try:
+            self._dialect = csv.Sniffer().sniff(self._buf[:SNIFF_CHARS])
+        except Exception:
+            self._dialect = csv.excel
+        self._reader = csv.reader(self._records, self._dialect)
 
-    header = _canonicalize_headers(raw_header)
+    def _still_quoted(self, line: str) -> bool:
+        """Whether a quoted field is still open after line (as the csv module reads it)."""
+        q, delim = self._dialect.quotechar, self._dialect.delimiter
+        if not q or (q not in line):
+            return self._in_quotes
+        in_q, i, n = self._in_quotes, 0, len(line)
+        field_start = not in_q
+        while i < n:
+            ch = line[i]
+            if in_q:
+                if ch == q:
+                    if i + 1 < n and line[i + 1] == q and self._dialect.doublequote:
+                        i += 1
+                    else:
+                        in_q = False
+            elif ch == q and field_start:
+                in_q = True
+            field_start = ch == delim and not in_q
+            i += 1
+        return in_q
 
-    # Validate required header
-    if REQUIRED_HEADER not in header:
-        return [], [
-            "CSV is missing the required 'url' column. Please include a header row with at least: url"
-        ], []
+    def _parse(self, final: bool) -> List[Dict[str, str]]:
+        rows: List[Dict[str, str]] = []
+        buf, pos = self._buf, 0
+        while True:
+            nl = buf.find("\n", pos)
+            if nl < 0:
+                break
+            line = buf[pos:nl + 1]
+            pos = nl + 1
+            self._in_quotes = self._still_quoted(line)
+            self._record += line
+            if not self._in_quotes:
+                self._take(self._record, rows)
+                self._record = ""
+        self._buf = buf[pos:]
+        if final:
+            tail = self._record + self._buf
+            self._record = self._buf = ""
+            if tail:
+                self._take(tail, rows)
+        return rows
 
-    # Build a mapping from index to canonical header name.
-    idx_to_name: Dict[int, str] = {}
-    for idx, name in enumerate(header):
-        idx_to_name[idx] = name
+    def _take(self, record: str, rows: List[Dict[str, str]]) -> None:
+        if self._stopped:
+            return
+        self._records.items.append(record)
+        try:
+            raw_row = next(self._reader)
+        except StopIteration:
+            return
+        if self._header is None:
+            self._set_header(raw_row)
+            return
+        self._line_num += 1
+        row = self._row(self._line_num, raw_row)
+        if row is not None:
+            rows.append(row)
 
-    url_idx = header.index(REQUIRED_HEADER)
+    def _set_header(self, raw_header: List[str]) -> None:
+        self._line_num = 1  # 1-based header at line 1
+        self._header = _canonicalize_headers(raw_header)
+        # Validate required header
+        if REQUIRED_HEADER not in self._header:
+            self.errors.append("CSV is missing the required 'url' column. Please include a header row with at least: url")
+            self._stopped = True
+            return
+        self._url_idx = self._header.index(REQUIRED_HEADER)
 
-    valid_row_count = 0
-    for line_num, raw_row in enumerate(reader, start=2):  # 1-based header at line 1
+    def _row(self, line_num: int, raw_row: List[str]) -> Optional[Dict[str, str]]:
+        header = self._header
         if all((c or '').strip() == '' for c in raw_row):
             # Entirely blank line—skip silently
-            continue
+            return None
 
         # Normalize row length to header length
         if len(raw_row) < len(header):
@@ -98,28 +204,55 @@ def parse_csv3(text: str) -> Tuple[List[Dict[str, str]], List[str], List[str]]:
             overflow = raw_row[len(header) - 1:]
             raw_row = raw_row[:len(header) - 1] + [','.join(overflow)]
 
-        url_val = (raw_row[url_idx] or '').strip()
+        url_val = (raw_row[self._url_idx] or '').strip()
         if not url_val:
-            warnings.append(f"Row {line_num} missing 'url' value; row skipped.")
-            continue
+            self.warnings.append(f"Row {line_num} missing 'url' value; row skipped.")
+            return None
 
         row_obj: Dict[str, str] = {}
         for idx, raw_val in enumerate(raw_row):
-            key = idx_to_name[idx]
-            val = (raw_val or '').strip()
-            row_obj[key] = val
+            row_obj[header[idx]] = (raw_val or '').strip()
 
         # Ensure canonical phone key if "telephone" was supplied
         if 'telephone' in row_obj and 'phone' not in row_obj:
             row_obj['phone'] = row_obj.get('telephone', '')
 
-        rows.append(row_obj)
-        valid_row_count += 1
+        self.valid += 1
+        return row_obj
 
-    if valid_row_count == 0:
-        errors.append("No valid rows to process. Every row needs a non-empty 'url' value.")
 
-    return rows, errors, warnings
+async def stream_csv_rows(chunks: AsyncIterator[bytes], parser: Optional[CsvRowParser] = None) -> AsyncIterator[Dict[str, str]]:
+    """Decode and parse CSV bytes as they arrive, yielding each valid row as soon
+    as it is complete. Pass a parser to read its warnings/errors along the way
+    (any object with the same feed/close interface works, e.g. for JSONL)."""
+    parser = parser if parser is not None else CsvRowParser()
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="ignore")
+    async for chunk in chunks:
+        for row in parser.feed(decoder.decode(chunk)):
+            yield row
+    for row in parser.feed(decoder.decode(b"", final=True)) + parser.close():
+        yield row
+
+
+def parse_csv3(text: str) -> Tuple[List[Dict[str, str]], List[str], List[str]]:
+    """
+    Parse CSV text and return (rows, errors, warnings).
+
+    rows:     list of dicts with canonical headers
+    errors:   fatal errors (should prevent starting batch)
+    warnings: non-fatal issues (e.g., skipped empty-url rows)
+
+    Required header:
+      - url
+
+    Optional headers (accepted if present):
+      - page_type, topic, subject, audience, address, phone(or telephone), competitor1, competitor2
+    """
+    if not text or not text.strip():
+        return [], ["The uploaded CSV appears to be empty."], []
+    parser = CsvRowParser()
+    rows = parser.feed(text) + parser.close()
+    return rows, parser.errors, parser.warnings
 
 
 def parse_csv(text: str):
@@ -0,0 +1,198 @@
+# app/services/export.py
+from __future__ import annotations
+import csv
+import io
+import json
+import re
+import zipfile
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+
+from app.db import AsyncSessionLocal
+from app.models import JobRecord, Run
+
+# Batch and history results exported as NDJSON, CSV or a zip of one .jsonld
+# file per URL. Rows come off a server-side cursor EXPORT_CHUNK at a time and
+# are encoded as they arrive, so an export never holds the whole result set.
+
+FORMATS = ("ndjson", "csv", "jsonld")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8", "jsonld": "application/zip"}
+EXTENSIONS = {"ndjson": "ndjson", "csv": "csv", "jsonld": "zip"}
+EXPORT_CHUNK = 500
+# Job ids per IN (...) query when exporting an explicit list of jobs
+IDS_PER_QUERY = 500
+
+CSV_FIELDS = ["job_id", "batch_id", "row", "status", "url", "page_type_label", "primary_type", "overall", "valid",
+              "competitor1_overall", "competitor2_overall", "error", "run_id", "finished_at"]
+
+
+def _statuses(status: Optional[str]) -> List[str]:
+    return [s.strip() for s in (status or "").split(",") if s.strip()]
+
+
+def _loads(value: Any) -> Any:
+    # Run rows written by record_run hold JSON-encoded strings
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _job_export(rec: JobRecord) -> Dict[str, Any]:
+    result = rec.result or {}
+    out = {"job_id": rec.id, "batch_id": rec.batch_id, "row": rec.row_no, "status": rec.status,
+           "url": result.get("url") or (rec.payload or {}).get("url", "")}
+    for k in ("page_type_label", "primary_type", "secondary_types", "overall", "valid", "validation_errors",
+              "jsonld", "comparisons", "advice", "stage_errors", "coalesced_with"):
+        if k in result:
+            out[k] = result[k]
+    out["error"] = rec.error or result.get("error")
+    out["run_id"] = rec.run_id
+    out["finished_at"] = rec.finished_at.isoformat() if rec.finished_at else None
+    return out
+
+
+def _run_export(run: Run) -> Dict[str, Any]:
+    return {"run_id": run.id, "status": "done", "url": run.url, "title": run.title, "overall": run.score_overall,
+            "valid": run.valid, "jsonld": _loads(run.jsonld), "validation_errors": _loads(run.validation_errors),
+            "comparisons": _loads(run.comparisons), "finished_at": run.created_at.isoformat() if run.created_at else None}
+
+
+async def _stream(stmt) -> AsyncIterator[Any]:
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(stmt.execution_options(yield_per=EXPORT_CHUNK))
+        async for rows in result.scalars().partitions():
+            for row in rows:
+                yield row
+
+
+async def iter_jobs(batch_id: Optional[str] = None, status: Optional[str] = None, min_score: Optional[float] = None,
+                    max_score: Optional[float] = None, job_ids: Sequence[str] = ()) -> AsyncIterator[Dict[str, Any]]:
+    """Export records of persisted batch jobs, in batch and row order."""
+    stmt = select(JobRecord)
+    if batch_id:
+        stmt = stmt.where(JobRecord.batch_id == batch_id)
+    statuses = _statuses(status)
+    if statuses:
+        stmt = stmt.where(JobRecord.status.in_(statuses))
+    score = JobRecord.result["overall"].as_float()
+    if min_score is not None:
+        stmt = stmt.where(score >= min_score)
+    if max_score is not None:
+        stmt = stmt.where(score <= max_score)
+    stmt = stmt.order_by(JobRecord.batch_id, JobRecord.row_no, JobRecord.id)
+    if not job_ids:
+        async for rec in _stream(stmt):
+            yield _job_export(rec)
+        return
+    for i in range(0, len(job_ids), IDS_PER_QUERY):
+        async for rec in _stream(stmt.where(JobRecord.id.in_(job_ids[i:i + IDS_PER_QUERY]))):
+            yield _job_export(rec)
+
+
+async def iter_runs(q: Optional[str] = None, min_score: Optional[float] = None,
+                    max_score: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Export records of the history (Run table), oldest first."""
+    stmt = select(Run)
+    if q:
+        stmt = stmt.where(Run.url.contains(q))
+    if min_score is not None:
+        stmt = stmt.where(Run.score_overall >= min_score)
+    if max_score is not None:
+        stmt = stmt.where(Run.score_overall <= max_score)
+    async for run in _stream(stmt.order_by(Run.id)):
+        yield _run_export(run)
+
+
+# ---- encoders ----
+
+async def ndjson(records: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    async for rec in records:
+        yield (json.dumps(rec, ensure_ascii=False, default=str) + "\n").encode()
+
+
+def flatten(rec: Dict[str, Any]) -> Dict[str, Any]:
+    comps = rec.get("comparisons") or []
+    return {**rec,
+            "competitor1_overall": comps[0].get("overall") if len(comps) > 0 and isinstance(comps[0], dict) else "",
+            "competitor2_overall": comps[1].get("overall") if len(comps) > 1 and isinstance(comps[1], dict) else ""}
+
+
+async def csv_rows(records: AsyncIterator[Dict[str, Any]], flush_every: int = 200) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    n = 0
+    async for rec in records:
+        writer.writerow(flatten(rec))
+        n += 1
+        if n % flush_every == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
+
+
+class _Sink:
+    """Write-only file for ZipFile; what was written since the last take() is handed out in pieces."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def _slug(url: str) -> str:
+    s = re.sub(r"^https?://", "", url or "").strip("/")
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", s)[:80] or "page"
+
+
+def jsonld_name(rec: Dict[str, Any], seen: set) -> str:
+    prefix = f"{rec['row']:05d}-" if rec.get("row") is not None else ""
+    base = prefix + _slug(rec.get("url", ""))
+    name, n = base, 1
+    while name in seen:
+        n += 1
+        name = f"{base}-{n}"
+    seen.add(name)
+    return name + ".jsonld"
+
+
+async def jsonld_zip(records: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Zip of one pretty-printed .jsonld per record that has markup. The sink
+    is not seekable, so ZipFile writes data descriptors and nothing is buffered
+    beyond the current entry."""
+    sink = _Sink()
+    seen: set = set()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        async for rec in records:
+            jsonld = rec.get("jsonld")
+            if not jsonld:
+                continue
+            zf.writestr(jsonld_name(rec, seen), json.dumps(jsonld, ensure_ascii=False, indent=2))
+            yield sink.take()
+    yield sink.take()
+
+
+def encode(fmt: str, records: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    if fmt == "csv":
+        return csv_rows(records)
+    if fmt == "jsonld":
+        return jsonld_zip(records)
+    return ndjson(records)
+
+
+def split_ids(job_ids: Optional[str]) -> List[str]:
+    return [j.strip() for j in (job_ids or "").split(",") if j.strip()]
@@ -1,15 +1,48 @@
-from typing import Optional
+from typing import Any, Callable, Dict, Optional
 from contextlib import asynccontextmanager
-from playwright.async_api import async_playwright, Browser, BrowserContext
+from playwright.async_api import async_playwright, Browser, BrowserContext, Playwright
 import asyncio
+from urllib.parse import urlparse
+
+from app.services.metrics import BROWSER_PAGES, FETCHES
+from app.services.resilience import ServerError
+from app.services.tracing import span
 
 DEFAULT_UA = (
     "Mozilla/5.0 (Macintosh; Apple Silicon Mac OS X 15_0) "
     "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125 Safari/537.36"
 )
 
+# Shared Chromium for the server process; each fetch gets its own context.
+_pw: Optional[Playwright] = None
+_browser: Optional[Browser] = None
+_browser_lock: Optional[asyncio.Lock] = None
+
+async def get_browser(headless: bool = True) -> Browser:
+    """Return the shared browser, launching (or relaunching after a crash) on demand."""
+    global _pw, _browser, _browser_lock
+    if _browser_lock is None:
+        _browser_lock = asyncio.Lock()
+    async with _browser_lock:
+        if _browser is None or not _browser.is_connected():
+            if _pw is None:
+                _pw = await async_playwright().start()
+            _browser = await _pw.chromium.launch(headless=headless)
+        return _browser
+
+async def close_browser() -> None:
+    global _pw, _browser
+    try:
+        if _browser is not None:
+            await _browser.close()
+        if _pw is not None:
+            await _pw.stop()
+    finally:
+        _browser, _pw = None, None
+
 @asynccontextmanager
 async def _context(headless: bool = True) -> BrowserContext:
+    """Throwaway browser + context, for callers without a long-lived event loop."""
     async with async_playwright() as p:
         browser: Browser = await p.chromium.launch(headless=headless)
         ctx = await browser.new_context(user_agent=DEFAULT_UA)
@@ -19,20 +52,62 @@ async def _context(headless: bool = True) -> BrowserContext:
             await ctx.close()
             await browser.close()
 
-async def fetch_url(url: str, timeout_ms: int = 30000, wait_until: str = "load") -> str:
+async def _render(ctx: BrowserContext, url: str, timeout_ms: int, wait_until: str,
+                  on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> str:
+    page = await ctx.new_page()
+    if on_progress is not None:
+        seen = {"responses": 0, "bytes": 0}
+        def on_response(resp):
+            seen["responses"] += 1
+            try:
+                seen["bytes"] += int(resp.headers.get("content-length") or 0)
+            except ValueError:
+                pass
+            on_progress({"stage": "fetch", **seen})
+        page.on("response", on_response)
+    response = await page.goto(url, wait_until=wait_until, timeout=timeout_ms)
+    if response is not None and response.status >= 500:
+        raise ServerError(url, response.status)
+    # Let lazy content settle a bit without blocking forever
+    try:
+        await page.wait_for_load_state("networkidle", timeout=5000)
+    except Exception:
+        pass
+    return await page.content()
+
+async def fetch_url(url: str, timeout_ms: int = 30000, wait_until: str = "load",
+                    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> str:
     """
-    Fetch a URL with Chromium and return the rendered HTML.
+    Fetch a URL with the shared Chromium and return the rendered HTML.
+    on_progress, if given, receives {"stage": "fetch", "responses", "bytes"} as responses arrive
+    (bytes are summed from Content-Length headers).
     """
-    async with _context(headless=True) as ctx:
-        page = await ctx.new_page()
-        await page.goto(url, wait_until=wait_until, timeout=timeout_ms)
-        # Let lazy content settle a bit without blocking forever
+    seen: Dict[str, Any] = {}
+
+    def progress(d: Dict[str, Any]) -> None:
+        seen.update(d)
+        if on_progress is not None:
+            on_progress(d)
+
+    with span("browser navigate", **{"url.full": url, "server.address": urlparse(url).netloc}) as sp:
+        browser = await get_browser(headless=True)
+        ctx = await browser.new_context(user_agent=DEFAULT_UA)
+        BROWSER_PAGES.inc()
         try:
-            await page.wait_for_load_state("networkidle", timeout=5000)
-        except Exception:
-            pass
-        html = await page.content()
-        return html
+            html = await _render(ctx, url, timeout_ms, wait_until, progress)
+            FETCHES.inc(tier="browser", outcome="ok")
+            sp.set(**{"html.bytes": len(html)})
+            return html
+        except BaseException:
+            FETCHES.inc(tier="browser", outcome="error")
+            raise
+        finally:
+            sp.set(**{"http.responses": seen.get("responses"), "http.bytes": seen.get("bytes")})
+            BROWSER_PAGES.dec()
+            await ctx.close()
 
 def fetch_url_sync(url: str, timeout_ms: int = 30000, wait_until: str = "load") -> str:
-    return asyncio.run(fetch_url(url, timeout_ms=timeout_ms, wait_until=wait_until))
+    async def run():
+        async with _context(headless=True) as ctx:
+            return await _render(ctx, url, timeout_ms, wait_until)
+    return asyncio.run(run())
@@ -2,10 +2,13 @@
 from __future__ import annotations
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from datetime import datetime
+from datetime import datetime, timezone
 import json
+import time
 
 from app.models import Run
+from app.services.metrics import STAGE_SECONDS
+from app.services.tracing import span
 
 async def record_run(session: AsyncSession, result: dict):
     """Persist a run into the database, serializing complex fields."""
@@ -20,7 +23,7 @@ async def record_run(session: AsyncSession, result: dict):
             return str(val)
 
     run = Run(
-        created_at=datetime.utcnow(),
+        created_at=datetime.now(timezone.utc),
         url=result.get("url"),
         title=result.get("subject") or result.get("topic"),
         topic=result.get("topic"),
@@ -36,9 +39,12 @@ async def record_run(session: AsyncSession, result: dict):
         comparisons=_safe(result.get("comparisons")),
         comparison_notes=_safe(result.get("comparison_notes")),
     )
-    session.add(run)
-    await session.commit()
-    await session.refresh(run)
+    t0 = time.perf_counter()
+    with span("db commit run", **{"db.table": "run"}):
+        session.add(run)
+        await session.commit()
+        await session.refresh(run)
+    STAGE_SECONDS.observe(time.perf_counter() - t0, stage="record_run")
     return run
 
 async def list_runs(session: AsyncSession, q: str | None = None, limit: int = 100):
@@ -0,0 +1,403 @@
+# app/services/jobqueue.py
+from __future__ import annotations
+import asyncio
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from app.services.metrics import Gauge, Histogram
+from app.services.progress import finish_job, set_job_status
+
+# Rows processed at once; each one holds a browser context, a DB session and
+# (while generating) an Ollama slot. 0 makes this process enqueue only, leaving
+# the rows to standalone workers (`python -m app.cli worker`).
+WORKERS = int(os.getenv("SCHEMAGEN_WORKERS", "4"))
+# Jobs allowed to wait; beyond this submissions are refused (HTTP 503).
+QUEUE_MAX = int(os.getenv("SCHEMAGEN_QUEUE_MAX", "10000"))
+# Extra workers that only take interactive jobs (single-URL submits), so one
+# always starts at once however busy the batch workers are.
+INTERACTIVE_WORKERS = int(os.getenv("SCHEMAGEN_INTERACTIVE_WORKERS", "1"))
+
+# Lanes: the interactive group is served before any batch; batches share the
+# batch workers by weighted deficit round robin, weight set by their priority.
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = {"low": 1, "normal": 2, "high": 4}
+
+JobFn = Callable[[], Awaitable[Any]]
+
+QUEUE_WAIT = Histogram("schemagen_queue_wait_seconds", "Time jobs waited in the queue, by lane.", ["lane"],
+                       buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+
+# Lane of the job running in this context (read by shared slots such as Ollama's).
+# Work is batch unless it opts in: the queue sets INTERACTIVE for jobs submitted
+# in that group, so CLI rows, prewarm and background tasks never jump the line.
+_lane: ContextVar[str] = ContextVar("schemagen_lane", default=BATCH)
+
+
+def current_lane() -> str:
+    return _lane.get()
+
+
+def set_lane(lane: str) -> None:
+    _lane.set(lane)
+
+
+def lane_of(group: Hashable) -> str:
+    return INTERACTIVE if group == INTERACTIVE else BATCH
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class _Group:
+    __slots__ = ("items", "seq", "taken", "running", "limit", "paused", "weight", "deficit")
+
+    def __init__(self):
+        self.items: Deque[Tuple[str, JobFn, float]] = deque()
+        self.seq = 0
+        self.taken = 0
+        self.running = 0
+        self.limit: Optional[int] = None
+        self.paused = False
+        self.weight = PRIORITIES["normal"]
+        self.deficit = 0
+
+    def ready(self) -> bool:
+        return bool(self.items) and not self.paused and (self.limit is None or self.running < self.limit)
+
+    def idle(self) -> bool:
+        return (not self.items and not self.running and self.limit is None and not self.paused
+                and self.weight == PRIORITIES["normal"])
+
+
+class _Waits:
+    """Recent queue waits of one lane."""
+
+    __slots__ = ("recent", "queued", "running")
+
+    def __init__(self):
+        self.recent: Deque[float] = deque(maxlen=200)
+        self.queued = 0
+        self.running = 0
+
+    def summary(self) -> Dict[str, Any]:
+        waits = sorted(self.recent)
+        pick = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))], 2) if waits else None
+        return {"queued": self.queued, "running": self.running, "wait_p50_s": pick(0.5), "wait_p95_s": pick(0.95),
+                "wait_max_s": round(waits[-1], 2) if waits else None}
+
+
+class JobQueue:
+    """Job callables drained by a pool of worker tasks.
+
+    Jobs are queued FIFO per group (a batch id, INTERACTIVE for single-URL
+    submits, None for loose jobs). Interactive jobs go first and may also use
+    `reserved` workers of their own; the other groups share `workers` by
+    deficit round robin, a group of weight w getting w jobs per round. A group
+    can be paused, capped at a number of running jobs, or cancelled, which
+    drops its queued jobs and cancels its running ones. Job ids get increasing
+    sequence numbers within their group, so a queued job's place in its group
+    is known in O(1).
+    """
+
+    def __init__(self, workers: int = WORKERS, maxsize: int = QUEUE_MAX, reserved: int = INTERACTIVE_WORKERS):
+        self.workers = max(0, workers)
+        self.reserved = max(0, reserved)
+        self.maxsize = maxsize
+        self._groups: "OrderedDict[Hashable, _Group]" = OrderedDict()
+        self._seq: Dict[str, Tuple[Hashable, int]] = {}
+        self._depth = 0
+        self._ready: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, Tuple[Hashable, asyncio.Task]] = {}
+        self.running = 0
+        self._lanes = {INTERACTIVE: _Waits(), BATCH: _Waits()}
+        self._room: Optional[asyncio.Event] = None
+
+    def _ensure_started(self) -> None:
+        if self._ready is None:
+            self._ready, self._idle = asyncio.Event(), asyncio.Event()
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers + self.reserved:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def _group(self, group: Hashable) -> _Group:
+        g = self._groups.get(group)
+        if g is None:
+            g = self._groups[group] = _Group()
+        return g
+
+    def _tidy(self, group: Hashable) -> None:
+        g = self._groups.get(group)
+        if g is not None and g.idle():
+            del self._groups[group]
+
+    def _wake(self) -> None:
+        if self._ready is not None:
+            self._ready.set()
+            if not self._depth and not self.running:
+                self._idle.set()
+
+    def submit(self, job_id: str, fn: JobFn, group: Hashable = None) -> int:
+        """Queue fn for job_id and return its estimated 1-based position; raises QueueFull."""
+        self._ensure_started()
+        if self._depth >= self.maxsize:
+            raise QueueFull(f"job queue is full ({self.maxsize} waiting)")
+        g = self._group(group)
+        g.seq += 1
+        g.items.append((job_id, fn, time.monotonic()))
+        self._seq[job_id] = (group, g.seq)
+        self._depth += 1
+        self._lanes[lane_of(group)].queued += 1
+        self._idle.clear()
+        self._wake()
+        return self.position(job_id)
+
+    def free_slots(self) -> int:
+        return self.maxsize - self.depth()
+
+    async def wait_room(self) -> None:
+        """Wait until a job can be submitted without QueueFull."""
+        while self._depth >= self.maxsize:
+            if self._room is None:
+                self._room = asyncio.Event()
+            self._room.clear()
+            await self._room.wait()
+
+    def _freed(self) -> None:
+        if self._room is not None:
+            self._room.set()
+
+    def position(self, job_id: str) -> Optional[int]:
+        """Estimated 1-based place in line for a queued job, None once it has
+        started: its place in its group, plus what the other groups waiting get
+        served in the meantime (all interactive jobs; batches by weight)."""
+        entry = self._seq.get(job_id)
+        if entry is None:
+            return None
+        group, seq = entry
+        g = self._groups[group]
+        k = seq - g.taken
+        if g.paused or group == INTERACTIVE:
+            return k
+        ahead = 0
+        for name, o in self._groups.items():
+            if name == INTERACTIVE:
+                ahead += len(o.items)
+            elif name != group and o.ready():
+                ahead += min(len(o.items), -(-k * o.weight // g.weight))
+        return k + ahead
+
+    def holds(self, job_id: str) -> bool:
+        """Whether job_id is queued or running in this queue."""
+        return job_id in self._seq or job_id in self._running
+
+    def depth(self) -> int:
+        return self._depth
+
+    def _pop(self, group: Hashable, g: _Group) -> Tuple[str, JobFn, Hashable]:
+        job_id, fn, queued_at = g.items.popleft()
+        g.taken += 1
+        g.running += 1
+        self._depth -= 1
+        self._freed()
+        self._seq.pop(job_id, None)
+        lane = self._lanes[lane_of(group)]
+        lane.queued -= 1
+        lane.running += 1
+        wait = time.monotonic() - queued_at
+        lane.recent.append(wait)
+        QUEUE_WAIT.observe(wait, lane=lane_of(group))
+        return job_id, fn, group
+
+    def _take(self) -> Optional[Tuple[str, JobFn, Hashable]]:
+        g = self._groups.get(INTERACTIVE)
+        if g is not None and g.ready():
+            return self._pop(INTERACTIVE, g)
+        if self._lanes[BATCH].running >= self.workers:
+            # The rest of the pool is reserved for interactive jobs
+            return None
+        for group, g in self._groups.items():
+            if group == INTERACTIVE:
+                continue
+            if not g.ready():
+                if not g.items:
+                    g.deficit = 0
+                continue
+            # Deficit round robin with a cost of one per job: a group's turn
+            # lasts `weight` jobs, then it goes to the back of the line
+            if g.deficit < 1:
+                g.deficit += g.weight
+            g.deficit -= 1
+            if g.deficit < 1:
+                self._groups.move_to_end(group)
+            return self._pop(group, g)
+        return None
+
+    async def _worker(self) -> None:
+        me = asyncio.current_task()
+        while True:
+            if len(self._tasks) > self.workers + self.reserved:
+                # Pool was shrunk; idle workers leave first
+                self._tasks.remove(me)
+                return
+            item = self._take()
+            if item is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            job_id, fn, group = item
+            self.running += 1
+            task = asyncio.ensure_future(self._call(job_id, fn, lane_of(group)))
+            self._running[job_id] = (group, task)
+            try:
+                # wait() rather than await, so a cancelled job does not cancel its worker
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            finally:
+                self._running.pop(job_id, None)
+                self.running -= 1
+                self._lanes[lane_of(group)].running -= 1
+                self._groups[group].running -= 1
+                self._tidy(group)
+                self._wake()
+
+    async def _call(self, job_id: str, fn: JobFn, lane: str) -> None:
+        set_lane(lane)
+        try:
+            await set_job_status(job_id, "running")
+            await fn()
+        except Exception as e:
+            print(f"[queue] job {job_id} crashed: {e}", file=sys.stderr)
+            await finish_job(job_id, {"error": str(e)}, status="failed")
+
+    # ---- group control ----
+
+    def pause(self, group: Hashable) -> None:
+        """Stop starting jobs of group (running ones finish)."""
+        self._group(group).paused = True
+
+    def resume(self, group: Hashable) -> None:
+        g = self._groups.get(group)
+        if g is not None:
+            g.paused = False
+            self._tidy(group)
+            self._wake()
+
+    def set_limit(self, group: Hashable, limit: Optional[int]) -> None:
+        """Run at most limit jobs of group at once (None: no cap beyond the pool)."""
+        self._group(group).limit = limit if limit and limit > 0 else None
+        self._tidy(group)
+        self._wake()
+
+    def set_priority(self, group: Hashable, priority: str) -> None:
+        """Share of the batch workers group gets while others wait: one of PRIORITIES."""
+        self._group(group).weight = PRIORITIES[priority]
+        self._tidy(group)
+
+    def cancel(self, group: Hashable) -> List[str]:
+        """Drop group's queued jobs and cancel its running ones; returns the ids of both."""
+        g = self._groups.pop(group, None)
+        dropped = []
+        if g is not None:
+            for job_id, _, _ in g.items:
+                self._seq.pop(job_id, None)
+                dropped.append(job_id)
+            self._depth -= len(g.items)
+            self._freed()
+            self._lanes[lane_of(group)].queued -= len(g.items)
+            if g.running:
+                # Running jobs still count against it until their workers see them end
+                g.items.clear()
+                self._groups[group] = g
+        for job_id, (grp, task) in list(self._running.items()):
+            if grp == group:
+                task.cancel()
+                dropped.append(job_id)
+        self._wake()
+        return dropped
+
+    def resize(self, workers: int, reserved: Optional[int] = None) -> None:
+        """Change the pool size; extra workers leave once their current job is done."""
+        self.workers = max(0, workers)
+        if reserved is not None:
+            self.reserved = max(0, reserved)
+        if self._ready is not None:
+            self._ensure_started()
+            self._wake()
+
+    def groups(self) -> Dict[Hashable, Dict[str, Any]]:
+        weights = {w: name for name, w in PRIORITIES.items()}
+        return {name: {"queued": len(g.items), "running": g.running, "limit": g.limit, "paused": g.paused,
+                       "priority": weights.get(g.weight, g.weight)}
+                for name, g in self._groups.items()}
+
+    def lanes(self) -> Dict[str, Dict[str, Any]]:
+        """Per lane: jobs queued and running, and recent queue waits in seconds."""
+        out = {name: w.summary() for name, w in self._lanes.items()}
+        out[INTERACTIVE]["workers"] = self.workers + self.reserved
+        out[BATCH]["workers"] = self.workers
+        return out
+
+    async def join(self) -> None:
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
+
+
+class Slots:
+    """Semaphore that hands freed slots to interactive-lane waiters before batch ones."""
+
+    def __init__(self, n: int):
+        self.free = n
+        self._waiters = {INTERACTIVE: deque(), BATCH: deque()}
+
+    async def __aenter__(self):
+        if self.free > 0 and not (self._waiters[INTERACTIVE] or self._waiters[BATCH]):
+            self.free -= 1
+            return self
+        fut = asyncio.get_running_loop().create_future()
+        waiters = self._waiters[current_lane()]
+        waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Handed a slot just as we were cancelled: pass it on
+                self._release()
+            elif fut in waiters:
+                waiters.remove(fut)
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self._release()
+
+    def _release(self) -> None:
+        for lane in (INTERACTIVE, BATCH):
+            waiters = self._waiters[lane]
+            while waiters:
+                fut = waiters.popleft()
+                if not fut.done():
+                    fut.set_result(None)
+                    return
+        self.free += 1
+
+
+job_queue = JobQueue()
+
+Gauge("schemagen_job_queue_depth", "Jobs waiting for a worker.", fn=job_queue.depth)
+Gauge("schemagen_jobs_running", "Jobs currently held by a worker.", fn=lambda: job_queue.running)
+
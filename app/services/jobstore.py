@@ -0,0 +1,236 @@
+# app/services/jobstore.py
+from __future__ import annotations
+import asyncio
+import json
+import os
+import secrets
+import socket
+import sys
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, select, update
+
+from app.db import AsyncSessionLocal
+from app.models import JobRecord
+
+# Durable batch jobs in the `job` table. A worker owns a job only while it
+# holds an unexpired lease, renewed by a heartbeat; a job whose worker died
+# becomes claimable again once its lease runs out. Finished jobs are never
+# claimed again, so a resumed batch only redoes rows that did not finish.
+
+LEASE_SECONDS = float(os.getenv("SCHEMAGEN_JOB_LEASE", "60"))
+MAX_ATTEMPTS = int(os.getenv("SCHEMAGEN_JOB_ATTEMPTS", "3"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+UNFINISHED = ("queued", "running")
+# A paused row is neither: it waits for resume_batch(). Cancelled rows are finished.
+FINISHED = ("done", "failed", "cancelled")
+# Candidates looked at per claim_next(); losing a race for one moves on to the next.
+CLAIM_SCAN = 16
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def lease_remaining(rec: JobRecord) -> float:
+    """Seconds until rec's lease (or deferral) expires (0 if it has none or it has run out)."""
+    if rec.status not in UNFINISHED or rec.lease_expires is None:
+        return 0.0
+    exp = rec.lease_expires if rec.lease_expires.tzinfo else rec.lease_expires.replace(tzinfo=timezone.utc)
+    return max(0.0, (exp - _now()).total_seconds())
+
+
+def _claimable(now: datetime):
+    # A queued job may carry a not-before time in lease_expires (see defer())
+    return or_(and_(JobRecord.status == "queued", or_(JobRecord.lease_expires.is_(None), JobRecord.lease_expires < now)),
+               and_(JobRecord.status == "running", JobRecord.lease_expires < now))
+
+
+def _jsonable(value: Any) -> Any:
+    return json.loads(json.dumps(value, default=str))
+
+
+async def enqueue(batch_id: str, rows: Sequence[Tuple[str, int, Dict[str, Any]]]) -> None:
+    """Persist (job_id, row_no, row) for a batch in one transaction."""
+    async with AsyncSessionLocal() as session:
+        session.add_all([JobRecord(id=job_id, batch_id=batch_id, row_no=row_no, payload=dict(row))
+                         for job_id, row_no, row in rows])
+        await session.commit()
+
+
+async def claim(job_id: str, owner: str = WORKER_ID) -> Optional[JobRecord]:
+    """Take the lease on job_id if it is queued or its lease has expired.
+
+    Returns the record, or None when the job is finished, leased by a live
+    worker, or has used up its attempts (it is then marked failed).
+    """
+    now = _now()
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            update(JobRecord)
+            .where(JobRecord.id == job_id, _claimable(now))
+            .values(status="running", lease_owner=owner, lease_expires=now + timedelta(seconds=LEASE_SECONDS),
+                    attempts=JobRecord.attempts + 1)
+        )
+        await session.commit()
+        if res.rowcount != 1:
+            return None
+        rec = await session.get(JobRecord, job_id)
+    if rec.attempts > MAX_ATTEMPTS:
+        await complete(job_id, "failed", error=f"gave up after {MAX_ATTEMPTS} attempts", owner=owner)
+        return None
+    return rec
+
+
+async def claim_next(owner: str = WORKER_ID) -> Optional[JobRecord]:
+    """Claim the oldest claimable job of any batch (used by standalone workers)."""
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            select(JobRecord.id).where(_claimable(_now()))
+            .order_by(JobRecord.created_at, JobRecord.row_no).limit(CLAIM_SCAN)
+        )
+        ids = list(res.scalars().all())
+    for job_id in ids:
+        rec = await claim(job_id, owner)
+        if rec is not None:
+            return rec
+    return None
+
+
+async def renew(job_id: str, owner: str = WORKER_ID) -> bool:
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            update(JobRecord)
+            .where(JobRecord.id == job_id, JobRecord.lease_owner == owner, JobRecord.status == "running")
+            .values(lease_expires=_now() + timedelta(seconds=LEASE_SECONDS))
+        )
+        await session.commit()
+        return res.rowcount == 1
+
+
+class LeaseLost(RuntimeError):
+    """The job was cancelled, or its lease ran out and passed to another worker, while it ran."""
+
+
+@asynccontextmanager
+async def leased(job_id: str, owner: str = WORKER_ID):
+    """Keep the lease on job_id alive (renewing every third of its length) while the body runs.
+    If the lease is lost the body is cancelled and LeaseLost raised in its place."""
+    body = asyncio.current_task()
+    lost = False
+
+    async def heartbeat():
+        nonlocal lost
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            try:
+                if not await renew(job_id, owner):
+                    print(f"[jobstore] lost lease on {job_id}", file=sys.stderr)
+                    lost = True
+                    body.cancel()
+                    return
+            except Exception as e:
+                print(f"[jobstore] lease renewal for {job_id} failed: {e}", file=sys.stderr)
+
+    task = asyncio.create_task(heartbeat())
+    try:
+        yield
+    except asyncio.CancelledError:
+        if not lost or body.uncancel():
+            raise
+        raise LeaseLost(job_id) from None
+    finally:
+        task.cancel()
+
+
+async def defer(job_id: str, delay: float, owner: str = WORKER_ID) -> bool:
+    """Put a leased job back in the queue, not to be claimed for delay seconds (e.g. its host is down)."""
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            update(JobRecord)
+            .where(JobRecord.id == job_id, JobRecord.lease_owner == owner)
+            .values(status="queued", lease_owner=None, lease_expires=_now() + timedelta(seconds=delay))
+        )
+        await session.commit()
+        return res.rowcount == 1
+
+
+async def complete(job_id: str, status: str, result: Optional[Dict[str, Any]] = None, run_id: Optional[int] = None,
+                   error: Optional[str] = None, owner: str = WORKER_ID) -> bool:
+    """Record the outcome and drop the lease. False if the lease had passed to another worker."""
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            update(JobRecord)
+            .where(JobRecord.id == job_id, JobRecord.lease_owner == owner)
+            .values(status=status, finished_at=_now(), lease_owner=None, lease_expires=None,
+                    result=_jsonable(result) if result is not None else None, run_id=run_id, error=error)
+        )
+        await session.commit()
+        return res.rowcount == 1
+
+
+async def _set_batch_status(batch_id: str, status: str, current: Sequence[str], what=JobRecord.id) -> list:
+    """Move a batch's rows in one of the `current` states to `status`; returns `what` of each row updated.
+
+    One UPDATE ... RETURNING (SQLite >= 3.35), so a worker claiming or finishing
+    a row meanwhile cannot make the result differ from the rows changed."""
+    values: Dict[str, Any] = {"status": status}
+    if status in FINISHED:
+        values.update(finished_at=_now(), lease_owner=None, lease_expires=None)
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            update(JobRecord).where(JobRecord.batch_id == batch_id, JobRecord.status.in_(current))
+            .values(**values).returning(what)
+            .execution_options(synchronize_session=False)
+        )
+        out = list(res.scalars().all())
+        await session.commit()
+    return out
+
+
+async def cancel_batch(batch_id: str) -> List[str]:
+    """Cancel every unfinished row; workers running one lose their lease at the next renewal."""
+    return await _set_batch_status(batch_id, "cancelled", (*UNFINISHED, "paused"))
+
+
+async def pause_batch(batch_id: str) -> List[str]:
+    """Hold queued rows back from every worker; running rows finish."""
+    return await _set_batch_status(batch_id, "paused", ("queued",))
+
+
+async def resume_batch(batch_id: str) -> List[JobRecord]:
+    return await _set_batch_status(batch_id, "queued", ("paused",), what=JobRecord)
+
+
+async def get(job_id: str) -> Optional[JobRecord]:
+    async with AsyncSessionLocal() as session:
+        return await session.get(JobRecord, job_id)
+
+
+async def unfinished() -> List[JobRecord]:
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            select(JobRecord).where(JobRecord.status.in_(UNFINISHED))
+            .order_by(JobRecord.created_at, JobRecord.row_no)
+        )
+        return list(res.scalars().all())
+
+
+async def batch_jobs(batch_id: str) -> List[JobRecord]:
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(select(JobRecord).where(JobRecord.batch_id == batch_id).order_by(JobRecord.row_no))
+        return list(res.scalars().all())
+
+
+async def queued_rows(batch_id: str, after_row: int, limit: int) -> List[JobRecord]:
+    """Up to limit queued rows of a batch numbered above after_row, in row order."""
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            select(JobRecord).where(JobRecord.batch_id == batch_id, JobRecord.status == "queued",
+                                    JobRecord.row_no > after_row)
+            .order_by(JobRecord.row_no).limit(limit)
+        )
+        return list(res.scalars().all())
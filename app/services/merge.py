@@ -0,0 +1,65 @@
+# app/services/merge.py
+from __future__ import annotations
+import json
+from typing import Any, Dict, List
+
+# Properties where partial results are unioned instead of first-seen wins.
+LIST_KEYS = {
+    "sameAs", "medicalSpecialty", "availableService", "department", "member",
+    "openingHours", "areaServed", "hasMap", "knowsAbout", "keywords",
+}
+
+
+def _key(v: Any) -> str:
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, sort_keys=True)
+    return str(v).strip().lower()
+
+
+def _empty(v: Any) -> bool:
+    return v is None or v == "" or v == [] or v == {}
+
+
+def merge_partial_nodes(nodes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge partial JSON-LD nodes from per-chunk extraction, in document order.
+
+    Scalars (and nested objects such as address): first non-empty value wins.
+    LIST_KEYS: deduplicated union, preserving first-seen order (a single value
+    that never arrived as a list stays scalar).
+    """
+    merged: Dict[str, Any] = {}
+    seen: Dict[str, set] = {}
+    was_list: set = set()
+    for node in nodes:
+        if not isinstance(node, dict):
+            continue
+        # A model may still wrap its answer in @graph; take the first node
+        if isinstance(node.get("@graph"), list):
+            first = next((n for n in node["@graph"] if isinstance(n, dict)), None)
+            if first is None:
+                continue
+            node = {**first, "@context": node.get("@context", first.get("@context"))}
+        for k, v in node.items():
+            if _empty(v):
+                continue
+            if k in LIST_KEYS:
+                if isinstance(v, list):
+                    was_list.add(k)
+                bucket = merged.setdefault(k, [])
+                if not isinstance(bucket, list):
+                    bucket = merged[k] = [bucket]
+                keys = seen.setdefault(k, {_key(x) for x in bucket})
+                for item in (v if isinstance(v, list) else [v]):
+                    if _empty(item):
+                        continue
+                    ik = _key(item)
+                    if ik not in keys:
+                        keys.add(ik)
+                        bucket.append(item)
+            elif k not in merged:
+                merged[k] = v
+    # Keep a lone scalar as a scalar (e.g. medicalSpecialty: "Cardiology")
+    for k in LIST_KEYS & merged.keys():
+        if k not in was_list and len(merged[k]) == 1:
+            merged[k] = merged[k][0]
+    return merged
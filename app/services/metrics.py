@@ -0,0 +1,150 @@
+# app/services/metrics.py
+from __future__ import annotations
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# In-process metrics rendered in the Prometheus text format by /metrics.
+# Recording is a dict lookup plus an add: no locks, no allocation after the
+# first observation for a label set. Updates happen on the event loop thread
+# (stage timings are taken by the pipeline, not inside worker threads).
+
+_REGISTRY: List["_Metric"] = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _fmt_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        head = f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+        return head + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        k = self._key(labels)
+        self._values[k] = self._values.get(k, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Settable gauge; or pass fn to compute the value at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.fn = fn
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        k = self._key(labels)
+        self._values[k] = self._values.get(k, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        if self.fn is not None:
+            return self.fn()
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                return []
+            # None: nothing to report (e.g. a figure only some backends have)
+            return [] if value is None else [f"{self.name} {value}"]
+        return [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        k = self._key(labels)
+        row = self._values.get(k)
+        if row is None:
+            row = self._values[k] = [0] * (len(self.buckets) + 2)
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def count(self, **labels: str) -> int:
+        row = self._values.get(self._key(labels))
+        return int(sum(row[:-1])) if row else 0
+
+    def samples(self) -> List[str]:
+        out: List[str] = []
+        for k, row in self._values.items():
+            acc = 0
+            for i, b in enumerate(self.buckets):
+                acc += row[i]
+                le = 'le="%s"' % b
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, le)} {acc}")
+            acc += row[len(self.buckets)]
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {row[-1]}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {acc}")
+        return out
+
+
+def render() -> str:
+    return "".join(m.render() for m in _REGISTRY)
+
+
+# ---- schema-gen metrics ----
+
+STAGE_SECONDS = Histogram("schemagen_stage_seconds", "Pipeline stage latency in seconds.", ["stage"])
+STAGE_ERRORS = Counter("schemagen_stage_errors_total", "Pipeline stage failures (fallback used or run failed).", ["stage"])
+CACHE_EVENTS = Counter("schemagen_cache_events_total", "Cache lookups by cache and result (hit/miss).", ["cache", "result"])
+FETCHES = Counter("schemagen_fetch_total", "Page fetches by tier and outcome.", ["tier", "outcome"])
+LLM_TOKENS = Counter("schemagen_llm_tokens_total", "LLM tokens by kind (prompt/eval) and model.", ["kind", "model"])
+LLM_PARSE_FAILURES = Counter("schemagen_llm_parse_failures_total", "LLM responses that did not parse as a JSON object.", ["mode"])
+JOBS_COALESCED = Counter("schemagen_jobs_coalesced_total", "Job requests attached to an identical in-flight job.")
+BROWSER_PAGES = Gauge("schemagen_browser_pages_in_flight", "Playwright pages currently rendering.")
@@ -83,4 +83,24 @@ async def resolve_for_label(session, label: str | None) -> Tuple[str | None, Lis
     cfg = found[1] or {}
     p = cfg.get("primary")
     s = cfg.get("secondary") or []
-    return p, s
\ No newline at end of file
+    return p, s
+
+async def resolve_types(session, label: str | None):
+    """Return (effective_label, primary, secondary, settings) for a page_type label.
+    Unknown labels map to themselves as primary type with no secondaries.
+    """
+    s = await get_settings(session)
+    mapping = s.page_type_map or {}
+    # Case-insensitive matching per requirements
+    effective_label = (label or s.page_type or "WebPage")
+    key = (effective_label or "").strip().lower()
+    map_ci = { (k or "").strip().lower(): v for k, v in (mapping or {}).items() }
+    cfg = map_ci.get(key)
+    if cfg is None:
+        # fall back to exact key if stored with different whitespace
+        cfg = mapping.get(effective_label)
+    if cfg is None:
+        cfg = {"primary": effective_label, "secondary": []}
+    primary = cfg.get("primary") or effective_label
+    secondary = cfg.get("secondary") or []
+    return effective_label, primary, secondary, s
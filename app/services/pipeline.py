@@ -0,0 +1,187 @@
+# app/services/pipeline.py
+from __future__ import annotations
+import asyncio
+import inspect
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.services.metrics import STAGE_ERRORS, STAGE_SECONDS
+from app.services.tracing import span
+
+
+@dataclass
+class Stage:
+    """One node of the processing graph.
+
+    fn receives the named inputs as keyword arguments and returns one value per
+    output (a tuple when there are several). Sync functions run in a worker
+    thread when thread=True, otherwise inline. On error or timeout the stage
+    falls back to `fallback` (a value/tuple, or a callable taking the context);
+    with no fallback the error propagates and the run fails. Under a run
+    deadline the stage also gets at most `budget` (a fraction) of it, and
+    never more than what is left.
+    """
+    name: str
+    fn: Callable[..., Any]
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    timeout: Optional[float] = None
+    fallback: Any = None
+    thread: bool = False
+    budget: Optional[float] = None
+
+
+class PipelineError(RuntimeError):
+    pass
+
+
+def _check_graph(stages: Sequence[Stage], initial: Dict[str, Any]) -> None:
+    produced = set(initial)
+    names = set()
+    for st in stages:
+        if st.name in names:
+            raise PipelineError(f"duplicate stage name: {st.name}")
+        names.add(st.name)
+        for out in st.outputs:
+            if out in produced and out not in initial:
+                raise PipelineError(f"output '{out}' produced by more than one stage")
+            produced.add(out)
+    for st in stages:
+        missing = [i for i in st.inputs if i not in produced]
+        if missing:
+            raise PipelineError(f"stage '{st.name}' needs inputs nobody produces: {missing}")
+
+
+def _timeout(st: Stage, deadline: Optional[float], ends: float) -> Optional[float]:
+    if deadline is None:
+        return st.timeout
+    limits = [ends - time.monotonic()]
+    if st.budget:
+        limits.append(st.budget * deadline)
+    if st.timeout:
+        limits.append(st.timeout)
+    return max(0.0, min(limits))
+
+
+async def _call(st: Stage, ctx: Dict[str, Any], timings: Dict[str, float], timeout: Optional[float]) -> Any:
+    kwargs = {k: ctx[k] for k in st.inputs}
+    t0 = time.perf_counter()
+    try:
+        with span(f"stage {st.name}", stage=st.name, thread=st.thread or None):
+            if inspect.iscoroutinefunction(st.fn):
+                coro = st.fn(**kwargs)
+            elif st.thread:
+                coro = asyncio.to_thread(st.fn, **kwargs)
+            else:
+                return st.fn(**kwargs)
+            if timeout is not None:
+                return await asyncio.wait_for(coro, timeout=timeout)
+            return await coro
+    finally:
+        elapsed = time.perf_counter() - t0
+        timings[st.name] = round(elapsed * 1000, 1)
+        STAGE_SECONDS.observe(elapsed, stage=st.name)
+
+
+def _assign(st: Stage, ctx: Dict[str, Any], value: Any) -> None:
+    if len(st.outputs) == 1:
+        ctx[st.outputs[0]] = value
+    elif st.outputs:
+        for k, v in zip(st.outputs, value):
+            ctx[k] = v
+
+
+async def run_stages(
+    stages: Sequence[Stage],
+    ctx: Dict[str, Any],
+    on_event: Optional[Callable[[str, str, Dict[str, Any]], Any]] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Run stages as a dependency graph: every stage starts as soon as all of its
+    inputs exist, so independent stages overlap. Mutates and returns ctx, adding
+    ctx["timings"] (ms per stage) and ctx["stage_errors"] (stage -> message).
+
+    deadline (seconds) bounds the whole run: each stage times out at its
+    share of it (Stage.budget) or when the deadline passes, whichever is first.
+
+    on_event(stage_name, "start" | "done" | "fallback", ctx) is called around
+    each stage (sync or async callable).
+    """
+    _check_graph(stages, ctx)
+    timings: Dict[str, float] = ctx.setdefault("timings", {})
+    errors: Dict[str, str] = ctx.setdefault("stage_errors", {})
+    pending: List[Stage] = list(stages)
+    running: Dict[asyncio.Task, Stage] = {}
+    ends = time.monotonic() + deadline if deadline else 0.0
+    deadline = deadline or None
+
+    async def emit(name: str, phase: str) -> None:
+        if on_event is None:
+            return
+        try:
+            r = on_event(name, phase, ctx)
+            if inspect.isawaitable(r):
+                await r
+        except Exception as e:
+            print(f"[pipeline] on_event failed: {e}", file=sys.stderr)
+
+    try:
+        while pending or running:
+            for st in [s for s in pending if all(i in ctx for i in s.inputs)]:
+                pending.remove(st)
+                await emit(st.name, "start")
+                running[asyncio.ensure_future(_call(st, ctx, timings, _timeout(st, deadline, ends)))] = st
+            if not running:
+                raise PipelineError(f"stages can never start: {[s.name for s in pending]}")
+
+            done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                st = running.pop(task)
+                exc = task.exception()
+                if exc is None:
+                    _assign(st, ctx, task.result())
+                    await emit(st.name, "done")
+                    continue
+                msg = "timeout" if isinstance(exc, asyncio.TimeoutError) else f"{type(exc).__name__}: {exc}"
+                STAGE_ERRORS.inc(stage=st.name)
+                if st.fallback is None:
+                    errors[st.name] = msg
+                    raise exc
+                errors[st.name] = msg
+                print(f"[pipeline] {st.name} failed ({msg}); using fallback", file=sys.stderr)
+                _assign(st, ctx, st.fallback(ctx) if callable(st.fallback) else st.fallback)
+                await emit(st.name, "fallback")
+    finally:
+        for task in running:
+            task.cancel()
+    return ctx
+
+
+def replace_stage(stages: Sequence[Stage], name: str, **changes: Any) -> List[Stage]:
+    """Return a copy of stages with stage `name` swapped/adjusted (fn, timeout, fallback, ...)."""
+    from dataclasses import replace
+    out = [replace(s, **changes) if s.name == name else s for s in stages]
+    if not any(s.name == name for s in stages):
+        raise PipelineError(f"unknown stage: {name}")
+    return out
+
+
+class StageWeights:
+    """Exponentially weighted average of stage durations, used to turn finished
+    stages into a progress percentage that tracks where time really goes."""
+
+    def __init__(self, priors_ms: Dict[str, float], alpha: float = 0.2):
+        self.ms: Dict[str, float] = dict(priors_ms)
+        self.alpha = alpha
+
+    def observe(self, timings: Dict[str, float]) -> None:
+        for name, ms in timings.items():
+            prev = self.ms.get(name)
+            self.ms[name] = ms if prev is None else prev + self.alpha * (ms - prev)
+
+    def fraction(self, finished: Sequence[str], stages: Sequence[Stage]) -> float:
+        total = sum(max(1.0, self.ms.get(s.name, 1.0)) for s in stages)
+        done = sum(max(1.0, self.ms.get(s.name, 1.0)) for s in stages if s.name in finished)
+        return done / total if total else 0.0
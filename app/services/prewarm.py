@@ -0,0 +1,91 @@
+# app/services/prewarm.py
+from __future__ import annotations
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from app.db import AsyncSessionLocal, init_db
+
+# Readiness state reported by /readyz. "ready" flips once every component has
+# been attempted; per-component errors are reported but do not block readiness.
+_state: Dict[str, Any] = {"ready": False, "started": None, "finished": None, "components": {}}
+
+
+async def _timed(name: str, fn: Callable[[], Awaitable[Any]]) -> None:
+    t0 = time.perf_counter()
+    entry: Dict[str, Any] = {"ok": True}
+    try:
+        detail = await fn()
+        if detail is not None:
+            entry["detail"] = detail
+    except Exception as e:
+        entry["ok"] = False
+        entry["error"] = str(e)
+        print(f"[prewarm] {name} failed: {e}", file=sys.stderr)
+    entry["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    _state["components"][name] = entry
+
+
+async def _db() -> None:
+    await init_db()
+
+
+async def _settings() -> List[str]:
+    from app.services.settings import get_settings
+    async with AsyncSessionLocal() as session:
+        s = await get_settings(session)
+        # Models to keep resident; only the configured Ollama model today
+        return [s.provider_model or "llama3"] if (s.provider or "").lower() == "ollama" else []
+
+
+async def _browser() -> None:
+    from app.services.fetch import get_browser
+    await get_browser(headless=True)
+
+
+async def _validators() -> List[str]:
+    from app.services.schemas import AVAILABLE_PAGE_TYPES, load_schema
+    from app.services.validate import compile_validator
+    for t in AVAILABLE_PAGE_TYPES:
+        compile_validator(load_schema(t))
+    return list(AVAILABLE_PAGE_TYPES)
+
+
+async def run_prewarm(db_ready: bool = False) -> Dict[str, Any]:
+    """Warm DB, settings, browser, validators and Ollama models; then mark ready."""
+    _state["started"] = time.time()
+    if not db_ready:
+        await _timed("db", _db)
+
+    models: List[str] = []
+
+    async def settings_step():
+        models.extend(await _settings())
+        return {"ollama_models": list(models)}
+
+    await _timed("settings", settings_step)
+    await _timed("validators", _validators)
+    await _timed("browser", _browser)
+
+    from app.services.providers import prewarm_ollama
+    for m in models:
+        await _timed(f"ollama:{m}", lambda m=m: prewarm_ollama(m))
+
+    _state["finished"] = time.time()
+    _state["ready"] = True
+    total = round((_state["finished"] - _state["started"]) * 1000, 1)
+    print(f"[prewarm] ready in {total}ms: " + ", ".join(f"{k}={v['ms']}ms" for k, v in _state["components"].items()), file=sys.stderr)
+    return readiness()
+
+
+def record_component(name: str, ms: float, ok: bool = True) -> None:
+    """Record a step timed outside run_prewarm (e.g. init_db in the startup hook)."""
+    _state["components"][name] = {"ok": ok, "ms": round(ms, 1)}
+
+
+def readiness() -> Dict[str, Any]:
+    return {
+        "ready": _state["ready"],
+        "components": {k: dict(v) for k, v in _state["components"].items()},
+        "total_ms": round((_state["finished"] - _state["started"]) * 1000, 1) if _state["finished"] else None,
+    }
@@ -1,28 +1,929 @@
-
 from __future__ import annotations
-import asyncio, time
-from typing import Dict, Any
+import asyncio, atexit, fnmatch, gzip, json, os, secrets, shutil, sys, tempfile, time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Any, List, Optional, Tuple
+
+from app.services.metrics import Counter, Gauge
+
+# Job state (status, progress log, result) lives behind a backend chosen by
+# SCHEMAGEN_JOB_BACKEND, so every web and worker process sees the same jobs:
+#   memory (default)  this process only; fine for a single uvicorn worker
+#   sqlite            tables in the app database (SCHEMAGEN_DB_URL, WAL mode)
+#   redis://host/0    any Redis-compatible server (needs the `redis` package)
+
+# Job lifecycle: queued -> running -> done | failed (batch rows may also be paused or cancelled)
+FINISHED = ("done", "failed", "cancelled")
+
+# Seconds a finished job is kept (Redis keys expire, and SQLite rows are pruned, this long after creation)
+JOB_TTL = int(os.getenv("SCHEMAGEN_JOB_TTL", str(7 * 24 * 3600)))
+# In-memory backend limits: finished jobs beyond these are evicted, least recently read first
+MEMORY_MAX_JOBS = int(os.getenv("SCHEMAGEN_JOB_MAX", "5000"))
+MEMORY_MAX_BYTES = int(os.getenv("SCHEMAGEN_JOB_MAX_BYTES", str(256 * 1024 * 1024)))
+# Results larger than this (serialized) are kept gzipped on disk instead
+SPILL_BYTES = int(os.getenv("SCHEMAGEN_JOB_SPILL_BYTES", str(64 * 1024)))
+SPILL_DIR = os.getenv("SCHEMAGEN_JOB_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "schemagen-spill")
+# Messages kept per job in memory; older ones are dropped (and counted)
+MAX_MESSAGES = int(os.getenv("SCHEMAGEN_JOB_MESSAGES", "200"))
+# Rough per-record and per-message bookkeeping cost, for the byte estimate
+_JOB_OVERHEAD = 400
+_MSG_OVERHEAD = 80
+# Messages up to this long are interned (stage names); longer ones are usually errors
+_INTERN_MAX = 80
+
+JOB_EVICTIONS = Counter("schemagen_job_evictions_total", "Finished jobs dropped from the job store (memory or SQLite).", ["reason"])
+
+
+def _msg(text: str) -> Dict[str, Any]:
+    return {"ts": time.time(), "msg": text}
+
+
+def _jsonable(value: Any) -> Any:
+    return json.loads(json.dumps(value, default=str))
+
+
+class _Job:
+    """One job in the in-memory store. Messages are (ts, msg) pairs in a ring
+    buffer of MAX_MESSAGES, with a count of those pushed out of it (so the
+    n-th message in the buffer has seq dropped + n). get() hands out an
+    immutable snapshot dict, rebuilt only after a change."""
+
+    __slots__ = ("status", "progress", "messages", "dropped", "result", "detail", "started", "coalesced_with",
+                 "spilled", "size", "lock", "snap")
+
+    def __init__(self, job: Dict[str, Any], max_messages: int):
+        self.status: str = job.get("status", "queued")
+        self.progress: int = job.get("progress", 0)
+        self.messages: Deque[Tuple[float, str]] = deque(maxlen=max_messages)
+        self.dropped = 0
+        self.result: Any = job.get("result")
+        self.detail: Any = job.get("detail")
+        self.started: float = job.get("started") or time.time()
+        self.coalesced_with: Optional[str] = job.get("coalesced_with")
+        self.spilled: Optional[str] = None
+        self.size = _JOB_OVERHEAD
+        self.lock: Optional[asyncio.Lock] = None
+        self.snap: Optional[Dict[str, Any]] = None
+        for m in job.get("messages") or ():
+            self.log(m["ts"], m["msg"])
+
+    def log(self, ts: float, msg: str) -> int:
+        if len(msg) <= _INTERN_MAX:
+            # Stage names repeat across every job; keep one copy of each
+            msg = sys.intern(msg)
+        if len(self.messages) == self.messages.maxlen:
+            self.dropped += 1
+            self.size -= len(self.messages[0][1]) + _MSG_OVERHEAD
+        self.messages.append((ts, msg))
+        grown = len(msg) + _MSG_OVERHEAD
+        self.size += grown
+        self.snap = None
+        return grown
+
+    def snapshot(self) -> Dict[str, Any]:
+        snap = self.snap
+        if snap is None:
+            snap = self.snap = {
+                "status": self.status, "progress": self.progress, "result": self.result, "detail": self.detail,
+                "started": self.started,
+                "messages": [{"ts": ts, "msg": msg, "seq": n}
+                             for n, (ts, msg) in enumerate(self.messages, self.dropped + 1)],
+                "dropped_messages": self.dropped,
+            }
+            if self.coalesced_with:
+                snap["coalesced_with"] = self.coalesced_with
+        return snap
+
+
+class MemoryBackend:
+    """Job records in this process, with bounded retention.
+
+    Changes never await while touching a record, so they are atomic on the
+    event loop and reads need no lock. Every write to a job goes through its
+    lock, so a change made while a result is being spilled to disk waits for
+    it and lands after it, in the order the writes were made.
+
+    Finished jobs are dropped JOB_TTL seconds after they finish, and the
+    least recently read ones go first once there are more than MEMORY_MAX_JOBS
+    or their estimated size passes MEMORY_MAX_BYTES. Results larger than
+    SPILL_BYTES are written gzipped to SPILL_DIR and read back on get().
+    Running jobs are never evicted.
+    """
+
+    # Only this process changes these jobs, so its change listeners see every change
+    shared = False
+
+    def __init__(self, max_jobs: Optional[int] = None, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, spill_bytes: Optional[int] = None, spill_dir: Optional[str] = None,
+                 max_messages: Optional[int] = None):
+        self._jobs: Dict[str, _Job] = {}
+        # leader job id -> jobs attached to it (duplicate requests sharing its run)
+        self._followers: Dict[str, List[str]] = {}
+        self.max_jobs = MEMORY_MAX_JOBS if max_jobs is None else max_jobs
+        self.max_bytes = MEMORY_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttl = JOB_TTL if ttl is None else ttl
+        self.spill_bytes = SPILL_BYTES if spill_bytes is None else spill_bytes
+        self.max_messages = MAX_MESSAGES if max_messages is None else max_messages
+        self._spill_dir = spill_dir
+        self.bytes = 0
+        # Finished jobs: by finish time (for the TTL) and by last read (for the LRU)
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        self._lru: "OrderedDict[str, None]" = OrderedDict()
+        self._spilled = 0
+
+    async def create(self, job_id: str, job: Dict[str, Any]) -> None:
+        if job_id in self._jobs:
+            self._drop(job_id)
+        rec = self._jobs[job_id] = _Job(job, self.max_messages)
+        self.bytes += rec.size
+        self._evict()
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rec = self._jobs.get(job_id)
+        if rec is None:
+            return None
+        if job_id in self._lru:
+            self._lru.move_to_end(job_id)
+        snap = rec.snapshot()
+        if rec.spilled is None:
+            return snap
+        path = rec.spilled
+        try:
+            result = await asyncio.to_thread(_read_spill, path)
+        except OSError as e:
+            print(f"[progress] spilled result of {job_id} is gone: {e}", file=sys.stderr)
+            result = None
+        return {**snap, "result": result}
+
+    @staticmethod
+    def _lock(rec: _Job) -> asyncio.Lock:
+        # Uncontended, taking it does not yield to the loop
+        if rec.lock is None:
+            rec.lock = asyncio.Lock()
+        return rec.lock
+
+    async def set(self, job_id: str, **fields: Any) -> None:
+        rec = self._jobs.get(job_id)
+        if rec is None:
+            return
+        async with self._lock(rec):
+            if fields.get("result") is None:
+                if self._jobs.get(job_id) is rec:
+                    self._apply(job_id, rec, fields)
+                return
+            blob = json.dumps(fields["result"], default=str, separators=(",", ":")).encode()
+            path = None
+            if len(blob) > self.spill_bytes:
+                path = os.path.join(self._spill_root(), job_id + ".json.gz")
+                try:
+                    await asyncio.to_thread(_write_spill, path, blob)
+                    fields["result"] = None
+                except OSError as e:
+                    print(f"[progress] could not spill result of {job_id}: {e}", file=sys.stderr)
+                    path = None
+            if self._jobs.get(job_id) is not rec:
+                # Evicted or replaced while the result was being written
+                if path:
+                    _remove(path)
+                return
+            self._apply(job_id, rec, fields, path, 0 if path else len(blob))
+
+    def _apply(self, job_id: str, rec: _Job, fields: Dict[str, Any], path: Optional[str] = None,
+               result_bytes: int = 0) -> None:
+        for k, v in fields.items():
+            setattr(rec, k, v)
+        rec.snap = None
+        if "result" in fields:
+            if rec.spilled and rec.spilled != path:
+                _remove(rec.spilled)
+                self._spilled -= 1
+            if path and rec.spilled != path:
+                self._spilled += 1
+            rec.spilled = path
+            size = _JOB_OVERHEAD + sum(len(m) + _MSG_OVERHEAD for _, m in rec.messages) + result_bytes
+            self.bytes += size - rec.size
+            rec.size = size
+        if fields.get("status") in FINISHED:
+            self._finished[job_id] = time.time()
+            self._finished.move_to_end(job_id)
+            self._lru[job_id] = None
+            self._lru.move_to_end(job_id)
+            self._evict()
+
+    async def extend(self, job_id: str, messages: List[Dict[str, Any]]) -> None:
+        rec = self._jobs.get(job_id)
+        if rec is None:
+            return
+        async with self._lock(rec):
+            if self._jobs.get(job_id) is not rec:
+                return
+            before = rec.size
+            for m in messages:
+                rec.log(m["ts"], m["msg"])
+            self.bytes += rec.size - before
+
+    async def log(self, job_id: str, message: Dict[str, Any], **fields: Any) -> Optional[int]:
+        """Append one message and set fields (no result) in one step; returns the message's seq."""
+        rec = self._jobs.get(job_id)
+        if rec is None:
+            return None
+        async with self._lock(rec):
+            if self._jobs.get(job_id) is not rec:
+                return None
+            before = rec.size
+            rec.log(message["ts"], message["msg"])
+            self.bytes += rec.size - before
+            for k, v in fields.items():
+                setattr(rec, k, v)
+            return rec.dropped + len(rec.messages)
+
+    async def followers(self, leader_id: str) -> List[str]:
+        return self._followers.get(leader_id) or []
+
+    async def add_follower(self, leader_id: str, job_id: str) -> None:
+        self._followers.setdefault(leader_id, []).append(job_id)
+
+    async def remove_follower(self, leader_id: str, job_id: str) -> None:
+        followers = self._followers.get(leader_id)
+        if followers and job_id in followers:
+            followers.remove(job_id)
+            if not followers:
+                del self._followers[leader_id]
+
+    def _spill_root(self) -> str:
+        if self._spill_dir is None:
+            self._spill_dir = os.path.join(SPILL_DIR, f"{os.getpid()}-{secrets.token_hex(3)}")
+            atexit.register(shutil.rmtree, self._spill_dir, True)
+        os.makedirs(self._spill_dir, exist_ok=True)
+        return self._spill_dir
+
+    def _drop(self, job_id: str) -> None:
+        rec = self._jobs.pop(job_id, None)
+        self._finished.pop(job_id, None)
+        self._lru.pop(job_id, None)
+        if rec is None:
+            return
+        self.bytes -= rec.size
+        if rec.spilled:
+            _remove(rec.spilled)
+            self._spilled -= 1
+
+    def _evict(self) -> None:
+        cutoff = time.time() - self.ttl
+        while self._finished:
+            job_id, finished = next(iter(self._finished.items()))
+            if finished > cutoff:
+                break
+            self._drop(job_id)
+            JOB_EVICTIONS.inc(reason="ttl")
+        while self._lru and (len(self._jobs) > self.max_jobs or self.bytes > self.max_bytes):
+            job_id = next(iter(self._lru))
+            JOB_EVICTIONS.inc(reason="count" if len(self._jobs) > self.max_jobs else "bytes")
+            self._drop(job_id)
+
+    def size(self) -> int:
+        return len(self._jobs)
+
+    def stats(self) -> Dict[str, int]:
+        return {"jobs": len(self._jobs), "finished": len(self._finished), "bytes": self.bytes,
+                "spilled": self._spilled}
+
+    async def refresh_stats(self) -> None:
+        pass  # always current
+
+
+def _write_spill(path: str, blob: bytes) -> None:
+    with gzip.open(path, "wb", compresslevel=5) as f:
+        f.write(blob)
+
+
+def _read_spill(path: str) -> Any:
+    with gzip.open(path, "rb") as f:
+        return json.loads(f.read())
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SQLiteBackend:
+    """Job state in the app database (job_state / job_message / job_follower).
+
+    Shared by every process on the box that points at the same SCHEMAGEN_DB_URL;
+    app.db turns on WAL so readers never block the writer. Finished jobs
+    started more than `ttl` seconds ago are pruned on create (at most every
+    PRUNE_EVERY seconds) and on every refresh_stats().
+    """
+
+    PRUNE_EVERY = 60.0
+    shared = True
+
+    def __init__(self, sessionmaker=None, ttl: Optional[int] = None):
+        self._sessionmaker = sessionmaker
+        self.ttl = JOB_TTL if ttl is None else ttl
+        self._jobs = 0
+        self._pruned_at = 0.0
+
+    def _session(self):
+        if self._sessionmaker is None:
+            from app.db import AsyncSessionLocal
+            self._sessionmaker = AsyncSessionLocal
+        return self._sessionmaker()
+
+    async def create(self, job_id: str, job: Dict[str, Any]) -> None:
+        from app.models import JobState
+        if time.monotonic() - self._pruned_at >= self.PRUNE_EVERY:
+            await self.prune()
+        async with self._session() as session:
+            await session.merge(JobState(id=job_id, status=job["status"], progress=job["progress"],
+                                         started=job["started"]))
+            await session.commit()
+
+    async def prune(self) -> int:
+        """Delete finished jobs past the ttl, with their messages and follower links."""
+        from sqlalchemy import delete, or_, select
+        from app.models import JobFollower, JobMessage, JobState
+        self._pruned_at = time.monotonic()
+        old = select(JobState.id).where(JobState.status.in_(FINISHED), JobState.started < time.time() - self.ttl)
+        async with self._session() as session:
+            ids = list((await session.execute(old)).scalars().all())
+            if not ids:
+                return 0
+            await session.execute(delete(JobMessage).where(JobMessage.job_id.in_(ids)))
+            await session.execute(delete(JobFollower).where(or_(JobFollower.leader_id.in_(ids),
+                                                                JobFollower.job_id.in_(ids))))
+            await session.execute(delete(JobState).where(JobState.id.in_(ids)))
+            await session.commit()
+        JOB_EVICTIONS.inc(len(ids), reason="ttl")
+        return len(ids)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        from sqlalchemy import select
+        from app.models import JobMessage, JobState
+        async with self._session() as session:
+            st = await session.get(JobState, job_id)
+            if st is None:
+                return None
+            res = await session.execute(select(JobMessage).where(JobMessage.job_id == job_id).order_by(JobMessage.id))
+            job = {"status": st.status, "progress": st.progress, "result": st.result, "detail": st.detail,
+                   "started": st.started,
+                   "messages": [{"ts": m.ts, "msg": m.msg, "seq": m.id} for m in res.scalars().all()]}
+        if st.coalesced_with:
+            job["coalesced_with"] = st.coalesced_with
+        return job
+
+    async def set(self, job_id: str, **fields: Any) -> None:
+        from sqlalchemy import update
+        from app.models import JobState
+        for k in ("result", "detail"):
+            if fields.get(k) is not None:
+                fields[k] = _jsonable(fields[k])
+        async with self._session() as session:
+            await session.execute(update(JobState).where(JobState.id == job_id).values(**fields))
+            await session.commit()
+
+    async def extend(self, job_id: str, messages: List[Dict[str, Any]]) -> None:
+        from app.models import JobMessage
+        async with self._session() as session:
+            session.add_all([JobMessage(job_id=job_id, ts=m["ts"], msg=m["msg"]) for m in messages])
+            await session.commit()
+
+    async def log(self, job_id: str, message: Dict[str, Any], **fields: Any) -> Optional[int]:
+        from sqlalchemy import update
+        from app.models import JobMessage, JobState
+        if fields.get("detail") is not None:
+            fields["detail"] = _jsonable(fields["detail"])
+        async with self._session() as session:
+            row = JobMessage(job_id=job_id, ts=message["ts"], msg=message["msg"])
+            session.add(row)
+            await session.flush()
+            # The row id rises with every message, which is all a seq needs
+            seq = row.id
+            await session.execute(update(JobState).where(JobState.id == job_id).values(**fields))
+            await session.commit()
+        return seq
+
+    async def followers(self, leader_id: str) -> List[str]:
+        from sqlalchemy import select
+        from app.models import JobFollower
+        async with self._session() as session:
+            res = await session.execute(select(JobFollower.job_id).where(JobFollower.leader_id == leader_id))
+            return list(res.scalars().all())
+
+    async def add_follower(self, leader_id: str, job_id: str) -> None:
+        from app.models import JobFollower
+        async with self._session() as session:
+            await session.merge(JobFollower(leader_id=leader_id, job_id=job_id))
+            await session.commit()
+
+    async def remove_follower(self, leader_id: str, job_id: str) -> None:
+        from sqlalchemy import delete
+        from app.models import JobFollower
+        async with self._session() as session:
+            await session.execute(delete(JobFollower).where(JobFollower.leader_id == leader_id,
+                                                            JobFollower.job_id == job_id))
+            await session.commit()
+
+    # Gauges read synchronously at scrape time: size() and stats() report the
+    # count taken by the last refresh_stats()
+
+    def size(self) -> int:
+        return self._jobs
+
+    def stats(self) -> Dict[str, int]:
+        return {"jobs": self._jobs}
+
+    async def refresh_stats(self) -> None:
+        from sqlalchemy import func, select
+        from app.models import JobState
+        await self.prune()
+        async with self._session() as session:
+            self._jobs = (await session.execute(select(func.count()).select_from(JobState))).scalar_one()
+
+
+class RedisBackend:
+    """Job state in a Redis-compatible server, one hash + message list per job.
+
+    Keys expire JOB_TTL seconds after the job was created. The message list
+    keeps the last MAX_MESSAGES (LTRIM after each RPUSH), each message carrying
+    its seq from a per-job counter. `client` is a redis.asyncio client with
+    decode_responses=True, or a LocalRedis.
+    """
+
+    def __init__(self, client, prefix: str = "schemagen:job:", max_messages: Optional[int] = None):
+        self.r = client
+        self.prefix = prefix
+        self.max_messages = MAX_MESSAGES if max_messages is None else max_messages
+        self._jobs = 0
+
+    @property
+    def shared(self) -> bool:
+        return not isinstance(self.r, LocalRedis)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("SCHEMAGEN_JOB_BACKEND is a redis:// URL but the `redis` package is not installed") from e
+        return cls(aioredis.Redis.from_url(url, decode_responses=True))
+
+    def _k(self, job_id: str, part: str = "") -> str:
+        return self.prefix + job_id + part
+
+    async def create(self, job_id: str, job: Dict[str, Any]) -> None:
+        key = self._k(job_id)
+        await self.r.hset(key, mapping={"status": job["status"], "progress": str(job["progress"]),
+                                        "started": repr(job["started"]), "result": "null", "detail": "null"})
+        await self.r.expire(key, JOB_TTL)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        h = await self.r.hgetall(self._k(job_id))
+        if not h:
+            return None
+        msgs = [json.loads(m) for m in await self.r.lrange(self._k(job_id, ":msgs"), 0, -1)]
+        job = {"status": h["status"], "progress": int(h["progress"]), "started": float(h["started"]),
+               "result": json.loads(h["result"]), "detail": json.loads(h["detail"]),
+               "messages": msgs, "dropped_messages": msgs[0]["seq"] - 1 if msgs else 0}
+        if h.get("coalesced_with"):
+            job["coalesced_with"] = h["coalesced_with"]
+        return job
+
+    async def set(self, job_id: str, **fields: Any) -> None:
+        key = self._k(job_id)
+        if not await self.r.exists(key):
+            return
+        mapping = {}
+        for k, v in fields.items():
+            if k in ("result", "detail"):
+                mapping[k] = json.dumps(v, default=str)
+            else:
+                mapping[k] = str(v)
+        await self.r.hset(key, mapping=mapping)
+
+    async def extend(self, job_id: str, messages: List[Dict[str, Any]]) -> int:
+        key, counter = self._k(job_id, ":msgs"), self._k(job_id, ":seq")
+        # The list is capped, so a place in it is not a seq: number messages from the counter
+        last = await self.r.incrby(counter, len(messages))
+        await self.r.expire(counter, JOB_TTL)
+        first = last - len(messages) + 1
+        await self.r.rpush(key, *[json.dumps({**m, "seq": n}) for n, m in enumerate(messages, first)])
+        await self.r.ltrim(key, -self.max_messages, -1)
+        await self.r.expire(key, JOB_TTL)
+        return last
+
+    async def log(self, job_id: str, message: Dict[str, Any], **fields: Any) -> int:
+        seq = await self.extend(job_id, [message])
+        await self.set(job_id, **fields)
+        return seq
+
+    async def followers(self, leader_id: str) -> List[str]:
+        return list(await self.r.smembers(self._k(leader_id, ":followers")))
+
+    async def add_follower(self, leader_id: str, job_id: str) -> None:
+        key = self._k(leader_id, ":followers")
+        await self.r.sadd(key, job_id)
+        await self.r.expire(key, JOB_TTL)
+
+    async def remove_follower(self, leader_id: str, job_id: str) -> None:
+        await self.r.srem(self._k(leader_id, ":followers"), job_id)
+
+    def size(self) -> int:
+        return self._jobs
+
+    def stats(self) -> Dict[str, int]:
+        return {"jobs": self._jobs}
+
+    async def refresh_stats(self) -> None:
+        # One hash per job; its :msgs and :followers keys are not counted
+        n = 0
+        async for key in self.r.scan_iter(match=self.prefix + "*"):
+            n += ":" not in key[len(self.prefix):]
+        self._jobs = n
+
+
+class LocalRedis:
+    """In-process stand-in for the handful of Redis commands RedisBackend uses
+    (string values, as with decode_responses=True). Expired keys are dropped
+    when next touched, as Redis does lazily."""
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        # key -> time.monotonic() deadline
+        self._expires: Dict[str, float] = {}
+
+    def _get(self, key: str, default=None):
+        at = self._expires.get(key)
+        if at is not None and at <= time.monotonic():
+            self._data.pop(key, None)
+            del self._expires[key]
+        return self._data.get(key, default)
+
+    def _setdefault(self, key: str, default):
+        v = self._get(key)
+        if v is None:
+            v = self._data[key] = default
+        return v
+
+    async def hset(self, key: str, mapping: Dict[str, str]) -> int:
+        h = self._setdefault(key, {})
+        added = len(set(mapping) - set(h))
+        h.update({k: str(v) for k, v in mapping.items()})
+        return added
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._get(key, {}))
+
+    async def rpush(self, key: str, *values: str) -> int:
+        lst = self._setdefault(key, [])
+        lst.extend(values)
+        return len(lst)
+
+    async def lrange(self, key: str, start: int, end: int) -> List[str]:
+        lst = self._get(key, [])
+        return lst[start:] if end == -1 else lst[start:end + 1]
+
+    async def ltrim(self, key: str, start: int, end: int) -> bool:
+        lst = self._get(key)
+        if lst is not None:
+            lst[:] = lst[start:] if end == -1 else lst[start:end + 1]
+        return True
+
+    async def incrby(self, key: str, amount: int) -> int:
+        value = int(self._get(key, "0")) + amount
+        self._data[key] = str(value)
+        return value
+
+    async def sadd(self, key: str, *members: str) -> int:
+        s = self._setdefault(key, set())
+        before = len(s)
+        s.update(members)
+        return len(s) - before
+
+    async def srem(self, key: str, *members: str) -> int:
+        s = self._get(key, set())
+        before = len(s)
+        s.difference_update(members)
+        return before - len(s)
+
+    async def smembers(self, key: str) -> set:
+        return set(self._get(key, set()))
+
+    async def exists(self, *keys: str) -> int:
+        return sum(1 for k in keys if self._get(k) is not None)
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        if self._get(key) is None:
+            return False
+        self._expires[key] = time.monotonic() + seconds
+        return True
+
+    async def scan_iter(self, match: str = "*"):
+        for key in list(self._data):
+            if fnmatch.fnmatchcase(key, match) and self._get(key) is not None:
+                yield key
+
+
+def make_backend(spec: str):
+    spec = (spec or "memory").strip()
+    if spec == "memory":
+        return MemoryBackend()
+    if spec == "sqlite":
+        return SQLiteBackend()
+    if spec == "local-redis":
+        return RedisBackend(LocalRedis())
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend.from_url(spec)
+    raise ValueError(f"unknown job backend {spec!r} (memory, sqlite, redis://…)")
+
+
+def _default_backend():
+    spec = os.getenv("SCHEMAGEN_JOB_BACKEND", "memory")
+    try:
+        return make_backend(spec)
+    except Exception as e:
+        print(f"[progress] {e}; keeping job state in memory", file=sys.stderr)
+        return MemoryBackend()
+
+
+_backend = _default_backend()
+
+
+def use_backend(backend) -> None:
+    """Swap the job state backend (tests, or a worker process configured at runtime)."""
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    return _backend
+
+
+def backend_shared() -> bool:
+    """Whether other processes change jobs in this backend (which this one's listeners do not see)."""
+    return bool(getattr(_backend, "shared", False))
+
+
+# Shared backends are counted at most every STATS_EVERY seconds (refresh_store_stats, before /metrics)
+STATS_EVERY = 15.0
+_stats_at = [0.0]
+
+
+async def refresh_store_stats() -> None:
+    now = time.monotonic()
+    if now - _stats_at[0] < STATS_EVERY:
+        return
+    _stats_at[0] = now
+    try:
+        await _backend.refresh_stats()
+    except Exception as e:
+        print(f"[progress] could not count jobs in the backend: {e}", file=sys.stderr)
+
+
+Gauge("schemagen_jobs_tracked", "Jobs held in the job state backend.", fn=lambda: _backend.size())
+# Memory backend only; the others report no value and the gauges are left out
+Gauge("schemagen_job_store_bytes", "Estimated memory held by the in-memory job store.",
+      fn=lambda: _backend.stats().get("bytes"))
+Gauge("schemagen_job_store_spilled", "Job results kept on disk by the in-memory job store.",
+      fn=lambda: _backend.stats().get("spilled"))
+
+# Called with the job id after every change made by this process (batch streams use this).
+_listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+# job id -> open subscriptions (this process only; see Subscription)
+_subscribers: Dict[str, List["Subscription"]] = {}
+
+# Subscriptions re-read the job this often when nothing arrives, to pick up
+# changes made by other processes sharing the backend.
+EVENT_RESYNC = float(os.getenv("SCHEMAGEN_EVENT_RESYNC", "5"))
+# Undelivered events a subscriber may hold; past that it catches up from the backend.
+SUBSCRIBER_BUFFER = 256
+
+
+def add_listener(fn: Callable[[str, Dict[str, Any]], None]) -> None:
+    """Call fn(job_id, event) on every change made to a job in this process."""
+    _listeners.append(fn)
+
+
+def _changed(job_id: str, event: Dict[str, Any]) -> None:
+    for sub in _subscribers.get(job_id, ()):
+        sub._push(event)
+    for fn in _listeners:
+        try:
+            fn(job_id, event)
+        except Exception as e:
+            print(f"[progress] listener failed: {e}", file=sys.stderr)
+
+
+class Subscription:
+    """Progress events of one job, pushed as they happen.
+
+        async with subscribe(job_id) as sub:
+            if sub.job is None: ...          # unknown job
+            async for ev in sub: ...         # ends after the "finished" event
+
+    A late joiner first gets the messages logged so far (replay=True), then
+    live events. Messages carry a per-job "seq" that rises with every message
+    logged, which is what tells a replayed message from a live one (timestamps
+    can repeat). Events are dicts with "type" (message | detail | status |
+    finished) and the job's current "progress", plus "msg"/"detail"/"status".
+    next(timeout) returns None when nothing happened within timeout seconds.
+    """
+
+    def __init__(self, job_id: str, replay: bool = True):
+        self.job_id = job_id
+        self.replay = replay
+        self.job: Optional[Dict[str, Any]] = None
+        self.closed = False
+        self.progress = 0
+        self.msg: Optional[str] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        self._lagged = False
+        self._out: Deque[Dict[str, Any]] = deque()
+        self._last_seq = 0
+        self._status: Optional[str] = None
+        self._detail: Any = None
+        self._synced = 0.0
+
+    async def __aenter__(self) -> "Subscription":
+        # Listen before reading, so nothing between the read and now is lost;
+        # messages seen in both are dropped by seq.
+        _subscribers.setdefault(self.job_id, []).append(self)
+        self.job = await _backend.get(self.job_id)
+        if self.job is None:
+            self.closed = True
+            return self
+        if not self.replay:
+            msgs = self.job.get("messages") or []
+            if msgs:
+                self._last_seq, self.msg = msgs[-1]["seq"], msgs[-1]["msg"]
+        self._catch_up(self.job)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        subs = _subscribers.get(self.job_id)
+        if subs and self in subs:
+            subs.remove(self)
+            if not subs:
+                del _subscribers[self.job_id]
+
+    def _push(self, event: Dict[str, Any]) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._lagged = True
+
+    def _emit(self, type_: str, **fields: Any) -> None:
+        self._out.append({"type": type_, "progress": self.progress, **fields})
+
+    def _set_status(self, status: Optional[str]) -> None:
+        if status == self._status or self.closed:
+            return
+        self._status = status
+        if status in FINISHED:
+            self.progress = 100
+            self.closed = True
+            self._emit("finished", status=status, msg=self.msg)
+        else:
+            self._emit("status", status=status)
+
+    def _catch_up(self, job: Dict[str, Any]) -> None:
+        self._synced = time.monotonic()
+        self.progress = int(job.get("progress") or 0)
+        for m in job.get("messages") or []:
+            if m["seq"] > self._last_seq:
+                self._last_seq, self.msg = m["seq"], m["msg"]
+                self._emit("message", msg=m["msg"], detail=job.get("detail"))
+        if job.get("detail") != self._detail:
+            self._detail = job.get("detail")
+            self._emit("detail", msg=self.msg, detail=self._detail)
+        self._set_status(job.get("status"))
+
+    def _accept(self, ev: Dict[str, Any]) -> None:
+        kind = ev["type"]
+        if kind == "message":
+            if ev["seq"] is None or ev["seq"] <= self._last_seq:
+                return
+            self._last_seq, self.msg, self.progress = ev["seq"], ev["msg"], ev["progress"]
+            if ev.get("detail") is not None:
+                self._detail = ev["detail"]
+            self._emit("message", msg=self.msg, detail=self._detail)
+        elif kind == "detail":
+            self._detail = ev["detail"]
+            self._emit("detail", msg=self.msg, detail=self._detail)
+        elif kind == "status":
+            self._set_status(ev["status"])
+        elif kind == "finished":
+            self._set_status(ev["status"])
+
+    async def _resync(self) -> None:
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._lagged = False
+        job = await _backend.get(self.job_id)
+        if job is not None:
+            self._catch_up(job)
+        else:
+            self._synced = time.monotonic()
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._out:
+            if self.closed:
+                raise StopAsyncIteration
+            now = time.monotonic()
+            wait = max(0.0, self._synced + EVENT_RESYNC - now)
+            if deadline is not None:
+                if now >= deadline:
+                    return None
+                wait = min(wait, deadline - now)
+            try:
+                ev = await asyncio.wait_for(self._queue.get(), wait) if wait > 0 else None
+            except asyncio.TimeoutError:
+                ev = None
+            if self._lagged or ev and ev["type"] == "resync" or time.monotonic() >= self._synced + EVENT_RESYNC:
+                await self._resync()
+            elif ev is not None:
+                self._accept(ev)
+        return self._out.popleft()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        return await self.next()
+
+
+def subscribe(job_id: str, replay: bool = True) -> Subscription:
+    return Subscription(job_id, replay)
+
+
+async def wait_for_job(job_id: str, timeout: float) -> Dict[str, Any] | None:
+    """The job once it has finished (or reached 100%), or as it is after timeout seconds."""
+    async with subscribe(job_id, replay=False) as sub:
+        if sub.job is None:
+            return None
+        deadline = time.monotonic() + timeout
+        try:
+            while sub.progress < 100:
+                left = deadline - time.monotonic()
+                if left <= 0 or await sub.next(timeout=left) is None:
+                    break
+        except StopAsyncIteration:
+            pass
+    return await _backend.get(job_id)
 
-_jobs: Dict[str, Dict[str, Any]] = {}
-_lock = asyncio.Lock()
 
 async def create_job(job_id: str):
-    async with _lock:
-        _jobs[job_id] = {"status": "pending", "progress": 0, "messages": [], "result": None, "started": time.time()}
-
-async def update_job(job_id: str, progress: int, message: str):
-    async with _lock:
-        if job_id in _jobs:
-            _jobs[job_id]["progress"] = progress
-            _jobs[job_id]["messages"].append({"ts": time.time(), "msg": message})
-
-async def finish_job(job_id: str, result: Any):
-    async with _lock:
-        if job_id in _jobs:
-            _jobs[job_id]["status"] = "done"
-            _jobs[job_id]["progress"] = 100
-            _jobs[job_id]["result"] = result
+    await _backend.create(job_id, {"status": "queued", "progress": 0, "messages": [], "result": None, "detail": None,
+                                   "started": time.time()})
+
+async def set_job_status(job_id: str, status: str):
+    await _backend.set(job_id, status=status)
+    _changed(job_id, {"type": "status", "status": status})
+
+async def update_job(job_id: str, progress: int, message: str, detail: Dict[str, Any] | None = None):
+    fields: Dict[str, Any] = {"progress": progress}
+    if detail is not None:
+        fields["detail"] = detail
+    m = _msg(message)
+    for jid in [job_id, *await _backend.followers(job_id)]:
+        seq = await _backend.log(jid, m, **fields)
+        _changed(jid, {"type": "message", "progress": progress, "detail": detail, "seq": seq, **m})
+
+async def set_job_detail(job_id: str, detail: Dict[str, Any]):
+    """Sub-progress for the running stage (bytes fetched, tokens generated) without a log message."""
+    for jid in [job_id, *await _backend.followers(job_id)]:
+        await _backend.set(jid, detail=detail)
+        _changed(jid, {"type": "detail", "detail": detail})
+
+async def follow_job(job_id: str, leader_id: str):
+    """Mirror leader_id's progress events onto job_id from now on, until unlink_job."""
+    await _backend.add_follower(leader_id, job_id)
+
+async def link_job(job_id: str, leader_id: str, coalesced_with: str | None = None):
+    """Attach job_id to an in-flight leader: replay the leader's log so far, then
+    mirror its progress events until unlink_job. Results are still set per job.
+    The job records coalesced_with (default: the leader) as the job it duplicates."""
+    job, leader = await _backend.get(job_id), await _backend.get(leader_id)
+    if job is None or leader is None:
+        return
+    # The copies take the follower's own seqs
+    replay = [{"ts": m["ts"], "msg": m["msg"]} for m in leader["messages"]]
+    await _backend.extend(job_id, [*replay, _msg("Duplicate of a running job; sharing its result")])
+    await _backend.set(job_id, coalesced_with=coalesced_with or leader_id, progress=max(job["progress"], leader["progress"]),
+                       detail=leader.get("detail"))
+    await _backend.add_follower(leader_id, job_id)
+    # Subscribers re-read the job to pick up its new progress, detail and log note
+    _changed(job_id, {"type": "resync"})
+
+async def unlink_job(job_id: str, leader_id: str):
+    await _backend.remove_follower(leader_id, job_id)
+
+async def finish_job(job_id: str, result: Any, status: str = "done"):
+    await _backend.set(job_id, status=status, progress=100, result=result)
+    _changed(job_id, {"type": "finished", "status": status})
 
 async def get_job(job_id: str) -> Dict[str, Any] | None:
-    async with _lock:
-        return _jobs.get(job_id)
+    return await _backend.get(job_id)
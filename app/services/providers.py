@@ -1,11 +1,27 @@
 
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
+import asyncio
 import datetime as dt
+import hashlib
 import json
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
 import httpx
 
+from app.services.schemas import load_schema, AVAILABLE_PAGE_TYPES
+from app.services.context import select_context, chunk_sections, estimate_tokens, DEFAULT_CONTEXT_TOKENS
+from app.services.merge import merge_partial_nodes
+from app.services.metrics import CACHE_EVENTS, LLM_PARSE_FAILURES, LLM_TOKENS
+from app.services import resilience
+from app.services.jobqueue import Slots
+from app.services.tracing import span
+
 class LLMProvider:
     name: str = "base"
     async def generate_jsonld(self, inputs) -> Dict[str, Any]:
@@ -51,45 +67,427 @@ class DummyLLM(LLMProvider):
             return {"@context": "https://schema.org", "@graph": graph}
         return main
 
+OLLAMA_URL = "http://localhost:11434"
+
+# Max concurrent requests to the Ollama server from this process.
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("SCHEMAGEN_OLLAMA_CONCURRENCY", "4"))
+
+# Context window every request runs with (options.num_ctx). One value for all
+# requests: Ollama reloads the model when it changes, and a primed prefix
+# context is only valid at the size it was evaluated with.
+OLLAMA_NUM_CTX = int(os.getenv("SCHEMAGEN_OLLAMA_NUM_CTX", "8192"))
+# Room left in the window for the generated JSON
+OUTPUT_RESERVE_TOKENS = 1024
+
+# Long-document mode: pages over LONG_DOC_TOKENS (by default half the context
+# window) are split at section boundaries into LONG_DOC_CHUNKS chunks, or more
+# so that none is over LONG_DOC_CHUNK_TOKENS nor, with the prompt around it,
+# over the window. Each chunk goes to the model whole, and the chunks are
+# extracted concurrently within the Ollama slots. Shorter pages take one call.
+LONG_DOC_TOKENS = int(os.getenv("SCHEMAGEN_LONG_DOC_TOKENS", str(OLLAMA_NUM_CTX // 2)))
+LONG_DOC_CHUNKS = int(os.getenv("SCHEMAGEN_LONG_DOC_CHUNKS", "4"))
+LONG_DOC_CHUNK_TOKENS = int(os.getenv("SCHEMAGEN_LONG_DOC_CHUNK_TOKENS", "2048"))
+
+_ollama_sem: Optional[Slots] = None
+
+def _ollama_slot() -> Slots:
+    # Interactive jobs get the next free slot ahead of waiting batch rows
+    global _ollama_sem
+    if _ollama_sem is None:
+        _ollama_sem = Slots(OLLAMA_MAX_CONCURRENCY)
+    return _ollama_sem
+
+# keep_alive sent with every request so the model (and its KV cache) stays resident between pages.
+OLLAMA_KEEP_ALIVE = os.getenv("SCHEMAGEN_OLLAMA_KEEP_ALIVE", "30m")
+
+class _PrefixCache:
+    """LRU + TTL cache of Ollama `context` arrays for evaluated site-level prompt prefixes.
+
+    Keyed by (host, model, prefix hash). A context is a token array that can be
+    several thousand ints, hence the entry cap.
+    """
+    def __init__(self, max_entries: int, ttl_s: float):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._items: "OrderedDict[tuple, tuple[float, list]]" = OrderedDict()
+        self._pending: Dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[list]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        ts, ctx = item
+        if time.monotonic() - ts > self.ttl_s:
+            self._items.pop(key, None)
+            self.evictions += 1
+            return None
+        self._items.move_to_end(key)
+        return ctx
+
+    def put(self, key: tuple, ctx: list) -> None:
+        self._items[key] = (time.monotonic(), ctx)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._items), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+_prefix_cache = _PrefixCache(
+    max_entries=int(os.getenv("SCHEMAGEN_PREFIX_CACHE_SIZE", "64")),
+    ttl_s=float(os.getenv("SCHEMAGEN_PREFIX_CACHE_TTL", "1800")),
+)
+
+# Prefix reuse sends prompts raw, bypassing the model's chat template, so the
+# template's user turn is written out by hand around them. Per model: the
+# (opening, closing) text of that turn, or None when the template is not one
+# we can reproduce exactly (message loops, tools, whitespace trimming).
+_turn_templates: Dict[tuple, Optional[tuple]] = {}
+
+_TPL_SYSTEM = re.compile(r"\{\{ if \.System \}\}.*?\{\{ end \}\}", re.S)
+_TPL_GUARD = re.compile(r"\{\{ (?:if \.Prompt|end) \}\}")
+_TPL_PROMPT = "{{ .Prompt }}"
+_TPL_RESPONSE = "{{ .Response }}"
+
+def _template_turn(template: str) -> Optional[tuple]:
+    """Split a single-turn Ollama template into the text before and after the
+    user prompt, as it renders with no system message; None if it cannot be."""
+    if "{{-" in template or "-}}" in template:
+        return None
+    t = _TPL_SYSTEM.sub("", template)
+    if _TPL_RESPONSE in t:
+        t = t.split(_TPL_RESPONSE, 1)[0]
+    t = _TPL_GUARD.sub("", t)
+    parts = t.split(_TPL_PROMPT)
+    if len(parts) != 2 or "{{" in parts[0] or "{{" in parts[1]:
+        return None
+    return parts[0], parts[1]
+
+# Running per-mode counters ("structured" vs "freeform") so the effect of the
+# constrained-output mode on wasted generations can be compared side by side.
+_GEN_STATS: Dict[str, Dict[str, int]] = {}
+
+def _record_generation(mode: str, parsed: bool, data: Dict[str, Any], prefix_reused: bool = False) -> None:
+    st = _GEN_STATS.setdefault(mode, {"responses": 0, "parse_failures": 0, "eval_tokens": 0, "prompt_tokens": 0, "prompt_eval_ms": 0,
+                                      "prefix_reused": 0})
+    st["responses"] += 1
+    if prefix_reused:
+        st["prefix_reused"] += 1
+    if not parsed:
+        st["parse_failures"] += 1
+    st["eval_tokens"] += int(data.get("eval_count") or 0)
+    st["prompt_tokens"] += int(data.get("prompt_eval_count") or 0)
+    st["prompt_eval_ms"] += int(data.get("prompt_eval_duration") or 0) // 1_000_000
+    if not parsed:
+        LLM_PARSE_FAILURES.inc(mode=mode)
+
+def generation_stats() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of LLM generation counters per output mode."""
+    out: Dict[str, Dict[str, Any]] = {}
+    for mode, st in _GEN_STATS.items():
+        n = st["responses"] or 1
+        out[mode] = {
+            **st,
+            "parse_failure_rate": round(st["parse_failures"] / n, 4),
+            "avg_eval_tokens": round(st["eval_tokens"] / n, 1),
+            "avg_prompt_eval_ms": round(st["prompt_eval_ms"] / n, 1),
+        }
+    if _prefix_cache.hits or _prefix_cache.misses:
+        out["prefix_cache"] = _prefix_cache.stats()
+    return out
+
+def _parse_json_text(text: str) -> Optional[Dict[str, Any]]:
+    """Parse a model response as a JSON object, slicing to the outer braces if needed."""
+    text = (text or "").strip()
+    try:
+        obj = json.loads(text)
+        if isinstance(obj, dict):
+            return obj
+    except Exception:
+        pass
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        try:
+            obj = json.loads(text[start:end+1])
+            if isinstance(obj, dict):
+                return obj
+        except Exception:
+            pass
+    return None
+
 class OllamaLLM(LLMProvider):
     name = "ollama"
-    def __init__(self, model: str = "llama3"):
+    def __init__(self, model: str = "llama3", structured: bool = True, reuse_prefix: bool = True):
         self.model = model or "llama3"
+        # structured=True sends the primary type's JSON Schema as Ollama's `format`,
+        # so decoding is constrained to a parseable object.
+        self.structured = structured
+        # reuse_prefix=True evaluates the instruction + site prefix once per (host, model)
+        # and continues from Ollama's returned `context` for every page of that site.
+        self.reuse_prefix = reuse_prefix
+        self.last_call: Dict[str, Any] = {}
 
-    async def generate_jsonld(self, inputs) -> Dict[str, Any]:
-        prompt = f"""You are a schema.org assistant. Produce ONLY valid JSON for a single {inputs.page_type} main entity in JSON-LD.
+    def _format_for(self, page_type: str) -> Any:
+        if page_type in AVAILABLE_PAGE_TYPES:
+            return load_schema(page_type)
+        # Unknown types would get the MedicalOrganization schema's @type const; plain JSON mode instead.
+        return "json"
+
+    def _prefix_prompt(self, inputs) -> str:
+        """Instruction preamble + site context; identical for every page of a host."""
+        if self.structured:
+            shape = f"""Produce ONLY a single JSON object for the {inputs.page_type} main entity in JSON-LD (no "@graph")."""
+        else:
+            shape = f"""Produce ONLY valid JSON for a single {inputs.page_type} main entity in JSON-LD.
 If secondary schema types are provided, include them as additional nodes in an "@graph".
-Secondary types: {', '.join(inputs.secondary_types or [])}
+Secondary types: {', '.join(inputs.secondary_types or [])}"""
+        return f"""You are a schema.org assistant. {shape}
 Fields to prioritize on the main entity: @context, @type, name, url, description, telephone, address, audience, sameAs, dateModified.
-Use this page context:
+Site: {urlparse(inputs.url or '').netloc}
+"""
+
+    def _page_prompt(self, inputs, context_text: str, part: Optional[tuple] = None) -> str:
+        excerpt = ""
+        if part:
+            excerpt = f"""This is excerpt {part[0]} of {part[1]} of a long page: include only properties supported by this excerpt.
+"""
+        return f"""{excerpt}Use this page context:
 URL: {inputs.url}
 Topic: {inputs.topic or ''}
 Subject: {inputs.subject or ''}
 Audience: {inputs.audience or ''}
 Address: {inputs.address or ''}
 Phone: {inputs.phone or ''}
-Cleaned text (may be truncated):
-{inputs.cleaned_text[:1200]}
+Most relevant page passages:
+{context_text}
 Return ONLY the JSON object, nothing else.
 """
-        payload = {"model": self.model, "prompt": prompt, "stream": False, "options": {"temperature": 0.2}}
+
+    async def _post(self, payload: Dict[str, Any], on_tokens: Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+        """POST /api/generate. With on_tokens, stream the response and report
+        newly generated token counts as they arrive; the return value has the
+        same shape as a non-streamed response either way."""
+        payload.setdefault("keep_alive", OLLAMA_KEEP_ALIVE)
+        attrs = {"gen_ai.system": "ollama", "gen_ai.request.model": payload.get("model"),
+                 "server.address": urlparse(OLLAMA_URL).netloc, "stream": on_tokens is not None}
+        with span("ollama generate", **attrs) as sp:
+            t0 = time.perf_counter()
+
+            async def attempt() -> Dict[str, Any]:
+                async with _ollama_slot():
+                    sp.set(queue_ms=round((time.perf_counter() - t0) * 1000, 1))
+                    return await self._post_once(dict(payload), on_tokens)
+
+            # 5xx and dropped connections are retried (outside the slot); a dead server trips its breaker
+            data = await resilience.call(attempt, host=resilience.host_of(OLLAMA_URL))
+            sp.set(**{"gen_ai.usage.input_tokens": data.get("prompt_eval_count"),
+                      "gen_ai.usage.output_tokens": data.get("eval_count")})
+            return data
+
+    async def _post_once(self, payload: Dict[str, Any], on_tokens: Optional[Callable[[int], None]]) -> Dict[str, Any]:
         async with httpx.AsyncClient(timeout=60) as client:
-            r = await client.post("http://localhost:11434/api/generate", json=payload); r.raise_for_status()
-            data = r.json()
-        text = (data.get("response") or "").strip()
-        start, end = text.find("{"), text.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            text = text[start:end+1]
+            if on_tokens is None:
+                r = await client.post(f"{OLLAMA_URL}/api/generate", json=payload); r.raise_for_status()
+                return r.json()
+            payload["stream"] = True
+            parts: List[str] = []
+            final: Dict[str, Any] = {}
+            pending = 0
+            async with client.stream("POST", f"{OLLAMA_URL}/api/generate", json=payload) as r:
+                r.raise_for_status()
+                async for line in r.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    parts.append(chunk.get("response") or "")
+                    pending += 1
+                    if chunk.get("done"):
+                        final = chunk
+                        break
+                    if pending >= 16:
+                        on_tokens(pending)
+                        pending = 0
+            if pending:
+                on_tokens(pending)
+            return {**final, "response": "".join(parts)}
+
+    async def _turn(self) -> Optional[tuple]:
+        """(opening, closing) of this model's user turn, from its template (cached per model)."""
+        key = (OLLAMA_URL, self.model)
+        if key in _turn_templates:
+            return _turn_templates[key]
         try:
-            return json.loads(text)
-        except Exception:
-            return {"@context":"https://schema.org","@type":inputs.page_type,"name":inputs.subject or inputs.topic or inputs.page_type,"url":inputs.url}
+            async with httpx.AsyncClient(timeout=10) as client:
+                r = await client.post(f"{OLLAMA_URL}/api/show", json={"model": self.model, "name": self.model})
+                r.raise_for_status()
+                template = r.json().get("template")
+        except Exception as e:
+            # Not cached: asked again next time, the full templated prompt meanwhile
+            print(f"[ollama] template lookup failed: {e}", file=sys.stderr)
+            return None
+        turn = _template_turn(template) if isinstance(template, str) else None
+        if turn is None:
+            print(f"[ollama] {self.model}: chat template not reproducible; prefix reuse off", file=sys.stderr)
+        _turn_templates[key] = turn
+        return turn
+
+    async def _prefix_context(self, inputs, prefix: str) -> Optional[list]:
+        """Return the cached `context` for this site prefix, evaluating it once if needed."""
+        key = (urlparse(inputs.url or "").netloc, self.model, hashlib.sha1(prefix.encode("utf-8")).hexdigest())
+        ctx = _prefix_cache.get(key)
+        if ctx is not None:
+            _prefix_cache.hits += 1
+            CACHE_EVENTS.inc(cache="llm_prefix", result="hit")
+            return ctx
+        pending = _prefix_cache._pending.get(key)
+        if pending is not None:
+            # Another page of the same site is already priming this prefix
+            return await asyncio.shield(pending)
+        _prefix_cache.misses += 1
+        CACHE_EVENTS.inc(cache="llm_prefix", result="miss")
+        fut = asyncio.get_running_loop().create_future()
+        _prefix_cache._pending[key] = fut
+        try:
+            # Raw, so `context` is the prefix tokens themselves rather than a templated
+            # turn; the page is then sent raw after it (see _generate)
+            data = await self._post({
+                "model": self.model,
+                "prompt": prefix,
+                "raw": True,
+                "stream": False,
+                "options": {"temperature": 0, "num_predict": 1, "num_ctx": OLLAMA_NUM_CTX},
+            })
+            ctx = data.get("context") or None
+            generated = int(data.get("eval_count") or 0)
+            if ctx and 0 < generated < len(ctx):
+                # The context ends with the token generated here; it is not part of the prefix
+                ctx = ctx[:-generated]
+            if ctx:
+                _prefix_cache.put(key, ctx)
+            fut.set_result(ctx)
+            return ctx
+        except Exception as e:
+            print(f"[ollama] prefix priming failed: {e}", file=sys.stderr)
+            return None
+        finally:
+            # Also when priming is cancelled (stage timeout, batch cancel): waiters fall back to the full prompt
+            if not fut.done():
+                fut.set_result(None)
+            _prefix_cache._pending.pop(key, None)
+
+    async def _generate(self, inputs, context_text: str, part: Optional[tuple] = None, on_tokens: Optional[Callable[[int], None]] = None) -> Optional[Dict[str, Any]]:
+        prefix = self._prefix_prompt(inputs)
+        page = self._page_prompt(inputs, context_text, part)
+        payload: Dict[str, Any] = {"model": self.model, "stream": False,
+                                   "options": {"temperature": 0.2, "num_ctx": OLLAMA_NUM_CTX}}
+        turn = await self._turn() if self.reuse_prefix else None
+        ctx = None
+        if turn is not None:
+            # Raw, with the template's user turn written out: the primed context
+            # plus the page is the same text Ollama's template would have produced
+            opening, closing = turn
+            prefix, page = opening + prefix, page + closing
+            payload["raw"] = True
+            ctx = await self._prefix_context(inputs, prefix)
+        if ctx:
+            payload["context"] = ctx
+            payload["prompt"] = page
+        else:
+            payload["prompt"] = prefix + page
+        mode = "freeform"
+        if self.structured:
+            payload["format"] = self._format_for(inputs.page_type)
+            mode = "structured"
+        retry = 0
+        while True:
+            data = await self._post(payload, on_tokens)
+            parsed = _parse_json_text(data.get("response") or "")
+            _record_generation(mode, parsed is not None, data, prefix_reused=bool(ctx))
+            retry += 1
+            if parsed is not None or not await resilience.backoff("llm_parse", retry):
+                break
+        LLM_TOKENS.inc(int(data.get("prompt_eval_count") or 0), kind="prompt", model=self.model)
+        LLM_TOKENS.inc(int(data.get("eval_count") or 0), kind="eval", model=self.model)
+        self.last_call = {
+            "prefix_reused": bool(ctx),
+            "prompt_tokens": int(data.get("prompt_eval_count") or 0),
+            "prompt_eval_ms": int(data.get("prompt_eval_duration") or 0) // 1_000_000,
+            "eval_tokens": int(data.get("eval_count") or 0),
+            "eval_ms": int(data.get("eval_duration") or 0) // 1_000_000,
+        }
+        if os.getenv("SCHEMAGEN_DEBUG"):
+            print(f"[ollama] {self.model} prompt_eval={self.last_call['prompt_eval_ms']}ms "
+                  f"({self.last_call['prompt_tokens']} tok, prefix {'reused' if ctx else 'full'}) "
+                  f"eval={self.last_call['eval_ms']}ms ({self.last_call['eval_tokens']} tok)", file=sys.stderr)
+        return parsed
+
+    def _chunk_limit(self, inputs) -> int:
+        """Largest chunk (tokens) that fits the context window with the prompt, schema and output."""
+        overhead = estimate_tokens(self._prefix_prompt(inputs) + self._page_prompt(inputs, "", (1, 1))) + OUTPUT_RESERVE_TOKENS
+        if self.structured:
+            overhead += estimate_tokens(json.dumps(self._format_for(inputs.page_type)))
+        return max(1, min(LONG_DOC_CHUNK_TOKENS, OLLAMA_NUM_CTX - overhead))
+
+    async def _generate_long(self, inputs, budget: int, on_tokens: Optional[Callable[[int], None]] = None) -> Optional[Dict[str, Any]]:
+        """Map-reduce: extract from each section chunk concurrently, then merge."""
+        limit = self._chunk_limit(inputs)
+        total = estimate_tokens(inputs.cleaned_text)
+        n = max(LONG_DOC_CHUNKS, -(-total // limit))
+        chunks = chunk_sections(inputs.cleaned_text, n, min_chunk_tokens=min(budget, limit))
+        # Cuts fall at section starts, which can leave the last chunk oversized
+        while len(chunks) >= n and max(map(estimate_tokens, chunks)) > limit:
+            n *= 2
+            chunks = chunk_sections(inputs.cleaned_text, n, min_chunk_tokens=min(budget, limit))
+        # Each chunk gets a budget of its own size, so all of the page reaches the
+        # model; a section too big to split is packed down to what fits the window
+        results = await asyncio.gather(*(
+            self._generate(inputs, select_context(c, inputs.signals, inputs.topic, inputs.subject, budget_tokens=min(limit, max(budget, estimate_tokens(c)))), part=(i + 1, len(chunks)), on_tokens=on_tokens)
+            for i, c in enumerate(chunks)
+        ), return_exceptions=True)
+        partials = [r for r in results if isinstance(r, dict)]
+        if not partials:
+            errors = [r for r in results if isinstance(r, BaseException)]
+            if errors:
+                raise errors[0]
+            return None
+        return merge_partial_nodes(partials)
+
+    async def generate_jsonld(self, inputs) -> Dict[str, Any]:
+        budget = getattr(inputs, "context_budget", DEFAULT_CONTEXT_TOKENS)
+        long_doc = getattr(inputs, "long_document", None)
+        if long_doc is None:
+            long_doc = estimate_tokens(inputs.cleaned_text) > LONG_DOC_TOKENS
+        on_tokens = None
+        on_progress = getattr(inputs, "on_progress", None)
+        if on_progress is not None:
+            generated = [0]
+            def on_tokens(n: int) -> None:
+                generated[0] += n
+                on_progress({"stage": "generate", "tokens": generated[0]})
+        if long_doc:
+            parsed = await self._generate_long(inputs, budget, on_tokens)
+        else:
+            context_text = select_context(inputs.cleaned_text, getattr(inputs, "signals", None), inputs.topic, inputs.subject, budget_tokens=budget)
+            parsed = await self._generate(inputs, context_text, on_tokens=on_tokens)
+        if parsed is not None:
+            return parsed
+        return {"@context":"https://schema.org","@type":inputs.page_type,"name":inputs.subject or inputs.topic or inputs.page_type,"url":inputs.url}
 
 async def list_ollama_models() -> list[str]:
     try:
         async with httpx.AsyncClient(timeout=5) as client:
-            r = await client.get("http://localhost:11434/api/tags"); r.raise_for_status()
+            r = await client.get(f"{OLLAMA_URL}/api/tags"); r.raise_for_status()
             data = r.json()
         return [m.get("name") for m in data.get("models", []) if m.get("name")]
     except Exception:
         return []
+
+async def prewarm_ollama(model: str) -> None:
+    """Load model into Ollama memory (an empty prompt only loads it) and keep it resident."""
+    async with httpx.AsyncClient(timeout=120) as client:
+        r = await client.post(f"{OLLAMA_URL}/api/generate", json={"model": model, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE})
+        r.raise_for_status()
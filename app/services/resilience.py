@@ -0,0 +1,228 @@
+# app/services/resilience.py
+from __future__ import annotations
+import asyncio
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from app.services.metrics import Counter, Gauge
+
+# Retries for transient failures and a circuit breaker per host.
+#
+# Failures are sorted into classes (classify()); each retryable class has its
+# own policy of attempts and exponential backoff with full jitter. Timeouts,
+# refused connections and 5xx answers also count against the host: after
+# BREAKER_FAILURES of them in a row its breaker opens and calls fail at once
+# with CircuitOpen (batch rows are deferred instead) until a cooldown has
+# passed; then a single probe is let through and its outcome closes or reopens
+# the breaker. Each consecutive trip doubles the cooldown, up to BREAKER_MAX_COOLDOWN.
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int  # retries after the first try
+    base: float  # seconds before the first retry (before jitter)
+    cap: float
+
+    def delay(self, retry: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** (retry - 1)))
+
+
+POLICIES: Dict[str, RetryPolicy] = {
+    "timeout": RetryPolicy(1, 2.0, 10.0),
+    "connection": RetryPolicy(2, 1.0, 10.0),
+    "server_error": RetryPolicy(3, 1.0, 20.0),
+    "llm_parse": RetryPolicy(1, 0.2, 1.0),
+}
+
+# e.g. SCHEMAGEN_RETRY_ATTEMPTS="timeout=0,server_error=5"
+for _item in os.getenv("SCHEMAGEN_RETRY_ATTEMPTS", "").split(","):
+    _kind, _, _n = _item.partition("=")
+    if _kind.strip() in POLICIES and _n.strip().isdigit():
+        _p = POLICIES[_kind.strip()]
+        POLICIES[_kind.strip()] = RetryPolicy(int(_n), _p.base, _p.cap)
+
+# Classes that say the host itself is unwell
+HOST_FAILURES = ("timeout", "connection", "server_error")
+
+BREAKER_FAILURES = int(os.getenv("SCHEMAGEN_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("SCHEMAGEN_BREAKER_COOLDOWN", "30"))
+BREAKER_MAX_COOLDOWN = float(os.getenv("SCHEMAGEN_BREAKER_MAX_COOLDOWN", "600"))
+
+RETRIES = Counter("schemagen_retries_total", "Retried calls by failure class.", ["kind"])
+BREAKER_TRIPS = Counter("schemagen_breaker_trips_total", "Times a host's circuit breaker opened.")
+
+
+class CircuitOpen(RuntimeError):
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"{host} looks down; not retrying it for {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class ServerError(RuntimeError):
+    """A 5xx answer from a page (the browser does not raise on those itself)."""
+
+    def __init__(self, url: str, status: int):
+        super().__init__(f"{url} answered HTTP {status}")
+        self.status = status
+
+
+def classify(exc: BaseException) -> Optional[str]:
+    """Failure class of exc, or None when it is not worth retrying."""
+    if isinstance(exc, CircuitOpen):
+        return "circuit_open"
+    # Playwright's TimeoutError is not a subclass of the builtin one
+    if isinstance(exc, TimeoutError) or type(exc).__name__ == "TimeoutError":
+        return "timeout"
+    status = getattr(exc, "status", None)
+    response = getattr(exc, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return "server_error" if status >= 500 else None
+    name = type(exc).__name__
+    msg = str(exc)
+    if name in ("ConnectError", "ConnectTimeout", "RemoteProtocolError", "ReadError", "ConnectionRefusedError",
+                "ConnectionResetError") or "net::ERR_" in msg:
+        return "timeout" if "TIMED_OUT" in msg else "connection"
+    return None
+
+
+# ---- per-job retry accounting ----
+
+_retries: ContextVar[Optional[Dict[str, int]]] = ContextVar("schemagen_retries", default=None)
+
+
+@contextmanager
+def tracking():
+    """Collect {failure class: retries} for everything run inside (including spawned tasks)."""
+    counts: Dict[str, int] = {}
+    token = _retries.set(counts)
+    try:
+        yield counts
+    finally:
+        _retries.reset(token)
+
+
+async def backoff(kind: str, retry: int) -> bool:
+    """Wait before retry number `retry` of a `kind` failure; False once the policy is used up."""
+    policy = POLICIES.get(kind)
+    if policy is None or retry > policy.attempts:
+        return False
+    RETRIES.inc(kind=kind)
+    counts = _retries.get()
+    if counts is not None:
+        counts[kind] = counts.get(kind, 0) + 1
+    await asyncio.sleep(policy.delay(retry))
+    return True
+
+
+# ---- circuit breakers ----
+
+class Breaker:
+    __slots__ = ("host", "failures", "trips", "opened_until", "probing")
+
+    def __init__(self, host: str):
+        self.host = host
+        self.failures = 0
+        self.trips = 0
+        self.opened_until = 0.0
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if not self.trips:
+            return "closed"
+        return "half_open" if time.monotonic() >= self.opened_until else "open"
+
+    def before(self) -> bool:
+        """Raise CircuitOpen if calls to the host are held back; True if this call is the probe."""
+        if not self.trips:
+            return False
+        now = time.monotonic()
+        if now < self.opened_until:
+            raise CircuitOpen(self.host, self.opened_until - now)
+        if self.probing:
+            # Someone else is finding out whether the host is back
+            raise CircuitOpen(self.host, min(BREAKER_COOLDOWN, 5.0))
+        self.probing = True
+        return True
+
+    def record(self, kind: Optional[str], probe: bool) -> None:
+        if probe:
+            self.probing = False
+        if kind not in HOST_FAILURES:
+            self.failures = 0
+            self.trips = 0
+            return
+        self.failures += 1
+        if probe or self.failures >= BREAKER_FAILURES:
+            cooldown = min(BREAKER_MAX_COOLDOWN, BREAKER_COOLDOWN * 2 ** self.trips)
+            self.trips += 1
+            self.failures = 0
+            self.opened_until = time.monotonic() + cooldown
+            BREAKER_TRIPS.inc()
+
+    def release(self, probe: bool) -> None:
+        if probe:
+            self.probing = False
+
+
+_breakers: Dict[str, Breaker] = {}
+
+Gauge("schemagen_breakers_open", "Hosts whose circuit breaker is open or half-open.",
+      fn=lambda: sum(1 for b in _breakers.values() if b.trips))
+
+
+def host_of(url: str) -> str:
+    try:
+        return (urlparse(url).hostname or "").lower()
+    except ValueError:
+        return ""
+
+
+def breaker(host: str) -> Breaker:
+    b = _breakers.get(host)
+    if b is None:
+        b = _breakers[host] = Breaker(host)
+    return b
+
+
+def breakers() -> Dict[str, Dict[str, Any]]:
+    return {h: {"state": b.state, "trips": b.trips, "failures": b.failures} for h, b in _breakers.items()
+            if b.failures or b.trips}
+
+
+async def call(fn: Callable[[], Awaitable[Any]], host: Optional[str] = None, timeout: Optional[float] = None) -> Any:
+    """Run fn, retrying transient failures per POLICIES, behind host's breaker.
+    timeout (seconds) applies to each attempt."""
+    b = breaker(host) if host else None
+    retry = 0
+    while True:
+        probe = b.before() if b is not None else False
+        try:
+            result = await (asyncio.wait_for(fn(), timeout) if timeout else fn())
+        except Exception as e:
+            kind = classify(e)
+            if b is not None:
+                b.record(kind, probe)
+            retry += 1
+            if kind is None or not await backoff(kind, retry):
+                raise
+            continue
+        except BaseException:
+            if b is not None:
+                b.release(probe)
+            raise
+        if b is not None:
+            b.record(None, probe)
+            if not b.trips and not b.failures:
+                # Only hosts with a failure history are remembered
+                _breakers.pop(host, None)
+        return result
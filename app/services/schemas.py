@@ -50,7 +50,7 @@ MEDICAL_ORGANIZATION_SCHEMA: Dict[str, Any] = {
             }
         },
         "sameAs": {"type": ["array", "null"], "items": {"type": "string"}},
-        "medicalSpecialty": {"type": ["string", "object", "null"]},
+        "medicalSpecialty": {"type": ["string", "object", "array", "null"]},
         "audience": {
             "type": ["object", "null"],
             "properties": {
@@ -73,7 +73,7 @@ HOSPITAL_SCHEMA: Dict[str, Any] = {
         "telephone": {"type": ["string", "null"]},
         "address": {"type": ["object", "null"]},
         "sameAs": {"type": ["array", "null"], "items": {"type": "string"}},
-        "medicalSpecialty": {"type": ["string", "object", "null"]},
+        "medicalSpecialty": {"type": ["string", "object", "array", "null"]},
         "dateModified": {"type": "string"}
     },
     "required": ["@type", "name", "url"]
@@ -96,7 +96,7 @@ PHYSICIAN_SCHEMA: Dict[str, Any] = {
         "@type": {"const": "Physician"},
         "name": {"type": "string"},
         "url": {"type": "string"},
-        "medicalSpecialty": {"type": ["string", "object", "null"]},
+        "medicalSpecialty": {"type": ["string", "object", "array", "null"]},
         "telephone": {"type": ["string", "null"]}
     },
     "required": ["@type", "name", "url"]
@@ -0,0 +1,88 @@
+# app/services/singleflight.py
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.services.metrics import CACHE_EVENTS
+
+
+class SingleFlight:
+    """Memoize async results per key; concurrent callers for a key share one
+    in-flight computation instead of starting their own.
+
+    The computation runs as its own task, so cancelling one caller (e.g. one
+    batch row timing out) does not cancel it for the others; it is cancelled
+    once every caller waiting on it has been. Failures are not
+    memoized: waiters already attached see the error, the next call retries.
+    With memoize=False only in-flight calls are shared.
+    """
+
+    def __init__(self, name: str = "singleflight", memoize: bool = True):
+        self.name = name
+        self.memoize = memoize
+        self._done: Dict[Hashable, Any] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def _count(self, result: str) -> None:
+        CACHE_EVENTS.inc(cache=self.name, result=result)
+
+    def inflight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if key in self._done:
+            self.hits += 1
+            self._count("hit")
+            return self._done[key]
+        task = self._inflight.get(key)
+        if task is not None:
+            return await self.join(key, task)
+        self.misses += 1
+        self._count("miss")
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t, key=key: self._settle(key, t))
+        return await self._wait(key, task)
+
+    def running(self, key: Hashable) -> Optional[asyncio.Task]:
+        """The in-flight computation for key, if any."""
+        return self._inflight.get(key)
+
+    async def join(self, key: Hashable, task: asyncio.Task) -> Any:
+        """Wait on a computation found with running(key), even if it has finished since."""
+        self.shared += 1
+        self._count("shared")
+        return await self._wait(key, task)
+
+    async def _wait(self, key: Hashable, task: asyncio.Task) -> Any:
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(key) == 1:
+                # The last caller gave up (e.g. its job was cancelled): stop the work too
+                task.cancel()
+            raise
+        finally:
+            left = self._waiters.pop(key, 1) - 1
+            if left:
+                self._waiters[key] = left
+
+    def _settle(self, key: Hashable, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if self.memoize and not task.cancelled() and task.exception() is None:
+            self._done[key] = task.result()
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        return self._done.get(key)
+
+    def forget(self, key: Hashable) -> None:
+        self._done.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "shared": self.shared,
+                "cached": len(self._done), "inflight": len(self._inflight)}
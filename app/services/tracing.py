@@ -0,0 +1,242 @@
+# app/services/tracing.py
+from __future__ import annotations
+import asyncio
+import json
+import os
+import secrets
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Lightweight per-job tracing. A job opens a trace with trace_job(job_id); any
+# span() opened underneath it (in the same task, child tasks or to_thread
+# workers, which all inherit the context) is recorded against that trace.
+# Outside a job span() is a no-op, so instrumented helpers cost nothing there.
+#
+# Finished traces are kept in memory for /api/job/{job_id}/trace and, when
+# configured, exported as OTLP/JSON: appended one line per trace to
+# SCHEMAGEN_TRACE_FILE and/or POSTed to SCHEMAGEN_OTLP_ENDPOINT (/v1/traces).
+
+TRACE_FILE = os.getenv("SCHEMAGEN_TRACE_FILE") or None
+OTLP_ENDPOINT = os.getenv("SCHEMAGEN_OTLP_ENDPOINT") or None
+TRACE_KEEP = int(os.getenv("SCHEMAGEN_TRACE_KEEP", "500"))
+SERVICE_NAME = "schema-gen"
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attrs", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, attrs: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update({k: v for k, v in attrs.items() if v is not None})
+
+
+class _NoopSpan:
+    def set(self, **attrs: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+        # spans[:exported] have been exported; a re-entered trace sends only what came after
+        self.exported = 0
+
+
+_traces: "OrderedDict[str, Trace]" = OrderedDict()
+_current: ContextVar[Optional[Tuple[Trace, Span]]] = ContextVar("schemagen_span", default=None)
+
+
+def _remember(trace: Trace) -> None:
+    _traces[trace.job_id] = trace
+    _traces.move_to_end(trace.job_id)
+    while len(_traces) > TRACE_KEEP:
+        _traces.popitem(last=False)
+
+
+@contextmanager
+def _open(trace: Trace, parent: Optional[Span], name: str, attrs: Dict[str, Any]) -> Iterator[Span]:
+    sp = Span(trace.trace_id, parent.span_id if parent else None, name, {k: v for k, v in attrs.items() if v is not None})
+    trace.spans.append(sp)
+    token = _current.set((trace, sp))
+    try:
+        yield sp
+    except BaseException as e:
+        sp.error = "timeout" if isinstance(e, asyncio.TimeoutError) else f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sp.end_ns = time.time_ns()
+        _current.reset(token)
+
+
+@contextmanager
+def trace_job(job_id: str, name: str = "job", **attrs: Any) -> Iterator[Span]:
+    """Open a root span for job_id. Re-entering for the same job (e.g. when its
+    result is saved by a later request) adds another root to the same trace."""
+    trace = _traces.get(job_id) or Trace(job_id)
+    _remember(trace)
+    try:
+        with _open(trace, None, name, {"job.id": job_id, **attrs}) as sp:
+            yield sp
+    finally:
+        _export(trace)
+
+
+def span(name: str, **attrs: Any):
+    """Child span of the current span; a no-op context when no job is traced."""
+    cur = _current.get()
+    if cur is None:
+        return _noop()
+    return _open(cur[0], cur[1], name, attrs)
+
+
+@contextmanager
+def _noop() -> Iterator[_NoopSpan]:
+    yield _NOOP
+
+
+def current_trace_id() -> Optional[str]:
+    cur = _current.get()
+    return cur[0].trace_id if cur else None
+
+
+def get_trace(job_id: str) -> Optional[Trace]:
+    return _traces.get(job_id)
+
+
+# ---- export ----
+
+def _attr(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        v = {"boolValue": value}
+    elif isinstance(value, int):
+        v = {"intValue": str(value)}
+    elif isinstance(value, float):
+        v = {"doubleValue": value}
+    else:
+        v = {"stringValue": str(value)}
+    return {"key": key, "value": v}
+
+
+def to_otlp(trace: Trace, only: Optional[List[Span]] = None) -> Dict[str, Any]:
+    """OTLP/JSON ExportTraceServiceRequest for one trace (or the given spans of it)."""
+    spans = []
+    for sp in trace.spans if only is None else only:
+        spans.append({
+            "traceId": sp.trace_id,
+            "spanId": sp.span_id,
+            "parentSpanId": sp.parent_id or "",
+            "name": sp.name,
+            "kind": 1,
+            "startTimeUnixNano": str(sp.start_ns),
+            "endTimeUnixNano": str(sp.end_ns or time.time_ns()),
+            "attributes": [_attr(k, v) for k, v in sp.attrs.items()],
+            "status": {"code": 2, "message": sp.error} if sp.error else {"code": 1},
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attr("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": "app.services.tracing"}, "spans": spans}],
+    }]}
+
+
+# One writer thread: trace lines stay in order and the event loop never waits on the disk
+_file_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-export")
+
+
+def _append(path: str, line: str) -> None:
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"[tracing] could not write {path}: {e}", file=sys.stderr)
+
+
+# In-flight collector posts, held so the loop cannot drop them half way
+_posts: set = set()
+
+
+def _unexported(trace: Trace) -> List[Span]:
+    """Finished spans not exported yet, up to the first still open one."""
+    spans = trace.spans[trace.exported:]
+    done = next((i for i, sp in enumerate(spans) if sp.end_ns is None), len(spans))
+    trace.exported += done
+    return spans[:done]
+
+
+def _export(trace: Trace) -> None:
+    if not (TRACE_FILE or OTLP_ENDPOINT):
+        return
+    spans = _unexported(trace)
+    if not spans:
+        return
+    body = to_otlp(trace, spans)
+    if TRACE_FILE:
+        line = json.dumps(body) + "\n"
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            _append(TRACE_FILE, line)
+        else:
+            _file_writer.submit(_append, TRACE_FILE, line)
+    if OTLP_ENDPOINT:
+        try:
+            task = asyncio.get_running_loop().create_task(_post(body))
+        except RuntimeError:
+            return
+        _posts.add(task)
+        task.add_done_callback(_posts.discard)
+
+
+async def _post(body: Dict[str, Any]) -> None:
+    import httpx
+    try:
+        async with httpx.AsyncClient(timeout=5) as client:
+            await client.post(OTLP_ENDPOINT.rstrip("/") + "/v1/traces", json=body)
+    except Exception as e:
+        print(f"[tracing] export to {OTLP_ENDPOINT} failed: {e}", file=sys.stderr)
+
+
+def waterfall(trace: Trace) -> List[Dict[str, Any]]:
+    """Spans in start order with depth and offsets (ms) from the first span."""
+    if not trace.spans:
+        return []
+    t0 = min(sp.start_ns for sp in trace.spans)
+    t1 = max((sp.end_ns or time.time_ns()) for sp in trace.spans)
+    total = max(1, t1 - t0)
+    by_id = {sp.span_id: sp for sp in trace.spans}
+
+    def depth(sp: Span) -> int:
+        d = 0
+        while sp.parent_id and sp.parent_id in by_id:
+            sp = by_id[sp.parent_id]
+            d += 1
+        return d
+
+    rows = []
+    for sp in sorted(trace.spans, key=lambda s: s.start_ns):
+        end = sp.end_ns or time.time_ns()
+        rows.append({
+            "name": sp.name, "depth": depth(sp),
+            "offset_ms": round((sp.start_ns - t0) / 1e6, 1), "duration_ms": round((end - sp.start_ns) / 1e6, 1),
+            "left_pct": round(100 * (sp.start_ns - t0) / total, 2), "width_pct": max(0.3, round(100 * (end - sp.start_ns) / total, 2)),
+            "attrs": dict(sp.attrs), "error": sp.error, "open": sp.end_ns is None,
+        })
+    return rows
@@ -3,6 +3,27 @@ from __future__ import annotations
 from typing import Tuple, List, Any, Dict
 import json
 
+from app.services.metrics import CACHE_EVENTS
+
+# Compiled Draft7 validators keyed by schema identity. The schema object is kept
+# alongside so its id() cannot be reused by a different dict.
+_VALIDATORS: Dict[int, Tuple[Dict[str, Any], Any]] = {}
+_MAX_VALIDATORS = 64
+
+def compile_validator(schema: Dict[str, Any]):
+    """Return a cached jsonschema validator for schema (building it on first use)."""
+    hit = _VALIDATORS.get(id(schema))
+    if hit is not None and hit[0] is schema:
+        CACHE_EVENTS.inc(cache="validator", result="hit")
+        return hit[1]
+    CACHE_EVENTS.inc(cache="validator", result="miss")
+    from jsonschema import Draft7Validator  # type: ignore
+    v = Draft7Validator(schema)
+    if len(_VALIDATORS) >= _MAX_VALIDATORS:
+        _VALIDATORS.clear()
+    _VALIDATORS[id(schema)] = (schema, v)
+    return v
+
 def _fallback_validate(instance: Dict[str, Any], schema: Dict[str, Any]) -> Tuple[bool, List[str]]:
     errors: List[str] = []
 
@@ -41,9 +62,7 @@ def validate_against_schema(instance: Dict[str, Any], schema_in: Any) -> Tuple[b
 
     # Try jsonschema library if available
     try:
-        import jsonschema  # type: ignore
-        from jsonschema import Draft7Validator  # type: ignore
-        v = Draft7Validator(schema)
+        v = compile_validator(schema)
         errs = sorted(v.iter_errors(instance), key=lambda e: e.path)
         if errs:
             def fmt(e):
@@ -3,10 +3,11 @@ from __future__ import annotations
 
 import uuid
 import asyncio
-import traceback
 import json
-from urllib.parse import urlparse
-from datetime import datetime, timezone
+import sys
+import time
+from datetime import timezone
+from typing import Optional
 
 from fastapi import APIRouter, Request, Depends, Form, UploadFile, File, HTTPException
 from fastapi.templating import Jinja2Templates
@@ -16,282 +17,559 @@ import httpx
 
 from app.db import get_session
 from app.services.settings import get_settings
-from app.services.csv_ingest import parse_csv
-from app.services.progress import create_job, update_job, finish_job
+from app.services.batch_input import BatchInput
+from app.services.progress import create_job, finish_job, get_job, set_job_status, subscribe, wait_for_job, FINISHED, backend_shared
+from app.services.jobqueue import INTERACTIVE, PRIORITIES, QueueFull, job_queue
+from app.services.history import record_run
+from app.services import batches, export, jobstore
+from app.services.batchrun import run_durable, run_row
+from app.services.singleflight import SingleFlight
+from app.services.tracing import get_trace, to_otlp, trace_job, waterfall
 
 templates = Jinja2Templates(directory="app/web/templates")
 router = APIRouter()
 
-# Lazy import to avoid circular/import-time errors during router discovery
-def _get_process_single():
-    from app.main_part2 import _process_single as _ps
-    return _ps
-
-def _base_url(u: str) -> str:
-    try:
-        p = urlparse(u)
-        return f"{p.scheme}://{p.netloc}"
-    except Exception:
-        return u
-
-def _breadcrumb_from_url(u: str):
-    try:
-        p = urlparse(u)
-        seg = [s for s in p.path.split('/') if s]
-        last = seg[-1] if seg else p.netloc
-        return {"@type": "ListItem","position": 1,"item": {"@id": u, "name": last}}
-    except Exception:
-        return None
-
-def _fallback_graph(label: str, url: str, subject: str, phone: str|None, address: str|None, mapping: dict):
-    # Build a best-effort @graph using admin mapping (case-insensitive)
-    key = (label or "WebPage").strip().lower()
-    cfg = None
-    if isinstance(mapping, dict):
-        lower = { (k or "").strip().lower(): v for k, v in mapping.items() }
-        cfg = lower.get(key) or mapping.get(label)
-    primary = (cfg or {}).get("primary") or label or "WebPage"
-    secondary = (cfg or {}).get("secondary") or []
-
-    # Primary
-    primary_node = {
-        "@type": primary,
-        "url": url,
-        "name": subject,
-        "dateModified": datetime.now(timezone.utc).isoformat()
-    }
-    if phone:
-        primary_node["telephone"] = phone
-    if address:
-        primary_node["address"] = {"@type":"PostalAddress","streetAddress": address}
-
-    graph = [primary_node]
-
-    # Secondary
-    site = _base_url(url)
-    for t in secondary:
-        tnorm = (t or "").strip()
-        if tnorm == "JobPosting":
-            # Only when fully populated (we don't have that here)
-            continue
-        if tnorm == "WebSite":
-            graph.append({"@type":"WebSite","url": site, "name": subject})
-        elif tnorm == "WebPage":
-            graph.append({"@type":"WebPage","url": url, "name": subject})
-        elif tnorm == "BreadcrumbList":
-            crumb = _breadcrumb_from_url(url)
-            if crumb:
-                graph.append({"@type":"BreadcrumbList","itemListElement":[crumb]})
-        else:
-            # Generic node with a name if sensible
-            node = {"@type": tnorm}
-            if tnorm.endswith("Organization") or tnorm.endswith("Clinic") or tnorm.endswith("Service") or tnorm.endswith("Specialty"):
-                node["name"] = subject
-            if tnorm.endswith("Organization"):
-                node["url"] = url
-            graph.append(node)
-
-    return {"@context":"https://schema.org", "@graph": graph}
-
 @router.get("/batch", response_class=HTMLResponse)
 async def batch_page(request: Request, session: AsyncSession = Depends(get_session)):
     settings = await get_settings(session)
     return templates.TemplateResponse("batch.html", {"request": request, "settings": settings})
 
-@router.post("/batch/fetch_async", response_class=HTMLResponse)
-async def batch_fetch_async(request: Request, csv_url: str = Form(...), session: AsyncSession = Depends(get_session)):
+def _submit(job_id: str, row: dict, batch_id: str | None = None):
+    """Queue a persisted row locally; with no local workers it waits for `app.cli worker`."""
+    if not job_queue.workers:
+        return None
+    cache = batches.competitor_cache(batch_id) if batch_id else SingleFlight("competitor")
+    def requeue(delay: float):
+        # Deferred (its host looks down): back on the queue once the deferral runs out
+        asyncio.get_running_loop().call_later(delay + 1, _submit_later, job_id, row, batch_id)
+    return job_queue.submit(job_id, lambda: run_durable(job_id, row, cache, requeue), group=batch_id)
+
+async def resume_batches():
+    """Re-queue persisted jobs left unfinished by a previous process (called at startup)."""
+    records = await jobstore.unfinished()
+    loop = asyncio.get_running_loop()
+    # Load each batch first, so its rows share the batch's competitor cache and
+    # the batch is not evicted while they run
+    for batch_id in dict.fromkeys(r.batch_id for r in records if r.batch_id):
+        await _load_batch(batch_id)
+    for rec in records:
+        if await get_job(rec.id) is None:
+            await create_job(rec.id)
+        wait = jobstore.lease_remaining(rec)
+        if wait > 0:
+            # Its previous owner may still be alive; retry once the lease has run out
+            loop.call_later(wait + 1, _submit_later, rec.id, rec.payload, rec.batch_id)
+        elif job_queue.free_slots() > 0:
+            _submit(rec.id, rec.payload, rec.batch_id)
+        else:
+            # The rest reach the queue as it drains
+            _start_pump(rec.batch_id)
+    if records:
+        print(f"[batch] resumed {len(records)} unfinished jobs from {len({r.batch_id for r in records})} batches",
+              file=sys.stderr)
+
+def _submit_later(job_id: str, row: dict, batch_id: str | None = None):
+    b = batches.get_batch(batch_id) if batch_id else None
+    if b is not None and b.state != "running":
+        # Paused rows are resubmitted by resume; cancelled ones never
+        return
     try:
-        async with httpx.AsyncClient(follow_redirects=True, timeout=30) as client:
-            r = await client.get(csv_url)
-            r.raise_for_status()
-            content = r.text
-    except Exception as e:
-        return templates.TemplateResponse("batch.html", {"request": request, "error": str(e), "warnings": []})
+        _submit(job_id, row, batch_id)
+    except QueueFull:
+        if batch_id:
+            _start_pump(batch_id)
+        else:
+            print(f"[batch] queue full; job {job_id} stays queued until the next restart", file=sys.stderr)
+
+# Rows persisted and queued per step while the input is still being read; the
+# first row is queued on its own so work starts before the file is parsed.
+INGEST_STEP = 200
+# Warnings kept for the run page (all of them are logged)
+MAX_PAGE_WARNINGS = 100
+
+async def _queue_rows(batch_id: str, start: int, rows: list, jobs: list, local: list):
+    planned = [(str(uuid.uuid4()), n, row) for n, row in enumerate(rows, start)]
+    # Persist first: from here on these rows survive a restart
+    await jobstore.enqueue(batch_id, planned)
+    batches.register(batch_id, [job_id for job_id, _, _ in planned])
+    for job_id, _, row in planned:
+        await create_job(job_id)
+        position = None
+        if local[0] and job_queue.free_slots() > 0:
+            position = _submit(job_id, row, batch_id)
+        else:
+            # No room in this process's queue: the row waits in the job table for
+            # _pump (or a standalone worker), keeping the batch in row order
+            local[0] = False
+        jobs.append({"job_id": job_id, "url": row.get("url",""), "position": position})
 
-    rows, warnings = parse_csv(content)
-    if not rows:
-        return templates.TemplateResponse("batch.html", {"request": request, "error": "No data rows found", "warnings": warnings or []})
+# batch id -> task handing its persisted rows to the local queue as room frees up
+_pumps: dict = {}
 
-    jobs = []
-    for row in rows:
-        job_id = str(uuid.uuid4())
-        await create_job(job_id)
+async def _pump(batch_id: str):
+    """Submit the batch's queued rows that are not in the local queue yet, waiting for room each time."""
+    after = 0
+    try:
+        while True:
+            recs = await jobstore.queued_rows(batch_id, after, INGEST_STEP)
+            if not recs:
+                return
+            for rec in recs:
+                after = rec.row_no
+                if job_queue.holds(rec.id):
+                    continue
+                await job_queue.wait_room()
+                b = batches.get_batch(batch_id)
+                if b is not None and b.state != "running":
+                    # Resume hands over paused rows; cancelled ones never run
+                    return
+                if not job_queue.holds(rec.id):
+                    _submit(rec.id, rec.payload, batch_id)
+    except Exception as e:
+        print(f"[batch] feeding {batch_id[:8]} to the queue stopped: {e}", file=sys.stderr)
+    finally:
+        _pumps.pop(batch_id, None)
+
+def _start_pump(batch_id: str):
+    if job_queue.workers and batch_id not in _pumps:
+        _pumps[batch_id] = asyncio.create_task(_pump(batch_id))
+
+async def _ingest(batch_id: str, source: BatchInput, chunks, jobs: list, warnings: list) -> Optional[str]:
+    """Persist every row of the input, a step at a time as it is parsed. Rows go
+    straight onto the local queue while it has room; the rest are fed to it by
+    _pump as it drains. Returns the error that stopped ingest, if any."""
+    pending: list = []
+    local = [True]
+    # Not finished (nor evictable) while rows are still being added
+    b = batches.register(batch_id, [])
+    b.ingesting = True
+
+    def report():
+        for w in source.new_warnings():
+            print(f"[batch] {batch_id[:8]}: {w}", file=sys.stderr)
+            if len(warnings) < MAX_PAGE_WARNINGS:
+                warnings.append(w)
+
+    async def flush():
+        report()
+        await _queue_rows(batch_id, len(jobs) + 1, pending, jobs, local)
+        pending.clear()
+
+    error = None
+    try:
+        try:
+            async for row in source.rows(chunks):
+                pending.append(row)
+                if len(pending) >= INGEST_STEP or not jobs:
+                    await flush()
+        except Exception as e:
+            error = str(e)
+            pending.clear()
+        if pending:
+            await flush()
+    finally:
+        b.ingesting = False
+    report()
+    if not local[0]:
+        _start_pump(batch_id)
+    return error
+
+async def _start_batch(request: Request, chunks):
+    """Parse batch input (CSV, JSONL, Parquet; optionally gzip/zstd) as it arrives
+    and queue each step of rows on the shared worker pool immediately, then
+    render the run page."""
+    source = BatchInput()
+    jobs: list = []
+    warnings: list = []
+    batch_id = str(uuid.uuid4())
+    error = await _ingest(batch_id, source, chunks, jobs, warnings)
+    if error and not jobs:
+        return templates.TemplateResponse("batch.html", {"request": request, "error": error, "warnings": warnings})
+    if error:
+        warnings.append(f"Ingest stopped after {len(jobs)} rows ({error}); the rest of the file was not queued.")
+    if not jobs:
+        return templates.TemplateResponse("batch.html", {"request": request, "warnings": warnings,
+                                                         "error": "; ".join(source.errors) or "No data rows found"})
+    return templates.TemplateResponse("batch_run.html", {"request": request, "jobs": jobs, "warnings": warnings,
+                                                         "batch_id": batch_id})
+
+async def _upload_chunks(file: UploadFile, size: int = 64 * 1024):
+    while True:
+        chunk = await file.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+async def _remote_chunks(csv_url: str):
+    async with httpx.AsyncClient(follow_redirects=True, timeout=30) as client:
+        async with client.stream("GET", csv_url) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_bytes():
+                yield chunk
 
-        async def runner(row=row, job_id=job_id):
-            try:
-                await update_job(job_id, 3, "Queued")
-                # Open a fresh DB session for this background task
-                async for task_session in get_session():
-                    # log provider/model for quick sanity
-                    try:
-                        s = await get_settings(task_session)
-                        prov = getattr(s, "provider", None)
-                        pmodel = getattr(s, "provider_model", None)
-                        await update_job(job_id, 5, f"Provider: {prov or 'unset'} | Model: {pmodel or 'unset'}")
-                    except Exception:
-                        await update_job(job_id, 5, "Provider: <error reading settings>")
-
-                    result = await _get_process_single()(
-                        row.get("url",""),
-                        row.get("topic"),
-                        row.get("subject"),
-                        row.get("audience"),
-                        row.get("address"),
-                        row.get("phone"),
-                        row.get("existing") or row.get("compare_existing"),
-                        row.get("competitor1"),
-                        row.get("competitor2"),
-                        row.get("page_type") or None,
-                        task_session,
-                    )
-                    await finish_job(job_id, result)
-                    break
-            except Exception as e:
-                tb = traceback.format_exc()
-                await update_job(job_id, 100, f"Error: {e}")
-                # Build a valid @graph fallback using admin mapping
-                url = row.get("url", "")
-                label = row.get("page_type") or "WebPage"
-                subject = row.get("subject") or row.get("topic") or url
-                phone = row.get("phone")
-                address = row.get("address")
-                # Open a short-lived session to read mapping for fallback
-                try:
-                    async for ssession in get_session():
-                        settings = await get_settings(ssession)
-                        mapping = settings.page_type_map or {}
-                        jsonld = _fallback_graph(label, url, subject, phone, address, mapping)
-                        await finish_job(job_id, {"url": url, "error": str(e), "traceback": tb, "jsonld": jsonld})
-                        break
-                except Exception:
-                    # Absolute fallback if settings fetch fails
-                    jsonld = _fallback_graph(label, url, subject, phone, address, {})
-                    await finish_job(job_id, {"url": url, "error": str(e), "traceback": tb, "jsonld": jsonld})
-
-        asyncio.create_task(runner())
-        jobs.append({"job_id": job_id, "url": row.get("url","")})
-
-    return templates.TemplateResponse("batch_run.html", {"request": request, "jobs": jobs})
+@router.post("/batch/fetch_async", response_class=HTMLResponse)
+async def batch_fetch_async(request: Request, csv_url: str = Form(...), session: AsyncSession = Depends(get_session)):
+    return await _start_batch(request, _remote_chunks(csv_url))
 
 @router.post("/batch/upload_async", response_class=HTMLResponse)
 async def batch_upload_async(request: Request, file: UploadFile = File(...), session: AsyncSession = Depends(get_session)):
-    text = (await file.read()).decode("utf-8", errors="ignore")
-    rows, warnings = parse_csv(text)
-    if not rows:
-        return templates.TemplateResponse("batch.html", {"request": request, "error": "No data rows found", "warnings": warnings or []})
-
-    jobs = []
-    for row in rows:
-        job_id = str(uuid.uuid4())
-        await create_job(job_id)
+    return await _start_batch(request, _upload_chunks(file))
+
+@router.post("/submit_async")
+async def submit_async(url: str = Form(""), page_type: str | None = Form(None), topic: str | None = Form(None),
+                       subject: str | None = Form(None), audience: str | None = Form(None),
+                       address: str | None = Form(None), phone: str | None = Form(None),
+                       compare_existing: str | None = Form(None), competitor1: str | None = Form(None),
+                       competitor2: str | None = Form(None)):
+    """Single-URL job from the index page. It goes in the interactive lane:
+    ahead of every batch row, with workers of its own."""
+    job_id = str(uuid.uuid4())
+    await create_job(job_id)
+    row = {"url": url, "page_type": page_type, "topic": topic, "subject": subject, "audience": audience,
+           "address": address, "phone": phone, "compare_existing": compare_existing,
+           "competitor1": competitor1, "competitor2": competitor2}
+
+    async def runner():
+        status, result = await run_row(row, job_id, SingleFlight("competitor"))
+        await finish_job(job_id, result, status=status)
 
-        async def runner(row=row, job_id=job_id):
-            try:
-                await update_job(job_id, 3, "Queued")
-                async for task_session in get_session():
-                    try:
-                        s = await get_settings(task_session)
-                        prov = getattr(s, "provider", None)
-                        pmodel = getattr(s, "provider_model", None)
-                        await update_job(job_id, 5, f"Provider: {prov or 'unset'} | Model: {pmodel or 'unset'}")
-                    except Exception:
-                        await update_job(job_id, 5, "Provider: <error reading settings>")
-
-                    result = await _get_process_single()(
-                        row.get("url",""),
-                        row.get("topic"),
-                        row.get("subject"),
-                        row.get("audience"),
-                        row.get("address"),
-                        row.get("phone"),
-                        row.get("existing") or row.get("compare_existing"),
-                        row.get("competitor1"),
-                        row.get("competitor2"),
-                        row.get("page_type") or None,
-                        task_session,
-                    )
-                    await finish_job(job_id, result)
-                    break
-            except Exception as e:
-                tb = traceback.format_exc()
-                await update_job(job_id, 100, f"Error: {e}")
-                url = row.get("url", "")
-                label = row.get("page_type") or "WebPage"
-                subject = row.get("subject") or row.get("topic") or url
-                phone = row.get("phone")
-                address = row.get("address")
-                try:
-                    async for ssession in get_session():
-                        settings = await get_settings(ssession)
-                        mapping = settings.page_type_map or {}
-                        jsonld = _fallback_graph(label, url, subject, phone, address, mapping)
-                        await finish_job(job_id, {"url": url, "error": str(e), "traceback": tb, "jsonld": jsonld})
-                        break
-                except Exception:
-                    jsonld = _fallback_graph(label, url, subject, phone, address, {})
-                    await finish_job(job_id, {"url": url, "error": str(e), "traceback": tb, "jsonld": jsonld})
+    try:
+        position = job_queue.submit(job_id, runner, group=INTERACTIVE)
+    except QueueFull as e:
+        await finish_job(job_id, {"error": str(e)}, status="failed")
+        return JSONResponse({"error": str(e)}, status_code=503)
+    return JSONResponse({"job_id": job_id, "position": position})
 
-        asyncio.create_task(runner())
-        jobs.append({"job_id": job_id, "url": row.get("url","")})
+@router.get("/progress/{job_id}", response_class=HTMLResponse)
+async def progress_page(request: Request, job_id: str):
+    return templates.TemplateResponse("progress.html", {"request": request, "job_id": job_id})
 
-    return templates.TemplateResponse("batch_run.html", {"request": request, "jobs": jobs})
+# Queued jobs re-check their place in line this often; otherwise an idle
+# stream only sends a keepalive comment.
+POSITION_REFRESH = 1.0
+SSE_KEEPALIVE = 15.0
 
 @router.get("/events/{job_id}")
 async def events(job_id: str):
-    from app.services.progress import get_job
     async def event_stream():
-        last_len = 0
-        for _ in range(900):
-            job = await get_job(job_id)
-            if not job:
+        async with subscribe(job_id) as sub:
+            if sub.job is None:
                 yield "event: error\n"
                 yield "data: {\"msg\": \"unknown job\", \"progress\": 100}\n\n"
                 return
-            msgs = job.get("messages") or []
-            for i in range(last_len, len(msgs)):
-                payload = {"msg": msgs[i]["msg"], "progress": int(job.get("progress", 0))}
+            last_position = None
+            status = sub.job.get("status")
+            while True:
+                position = job_queue.position(job_id) if status == "queued" else None
+                if position != last_position:
+                    last_position = position
+                    if position is not None:
+                        yield "data: " + json.dumps({"msg": f"Queued (#{position})", "progress": 0, "status": "queued", "position": position}) + "\n\n"
+                try:
+                    ev = await sub.next(timeout=POSITION_REFRESH if status == "queued" else SSE_KEEPALIVE)
+                except StopAsyncIteration:
+                    ev = {"type": "finished"}
+                if ev is None:
+                    if status != "queued":
+                        yield ": keepalive\n\n"
+                    continue
+                if ev["type"] == "status":
+                    status = ev["status"]
+                    continue
+                if ev["type"] == "finished" or ev["progress"] >= 100:
+                    yield "data: " + json.dumps({"msg": "done", "progress": 100}) + "\n\n"
+                    return
+                status = "running" if status == "queued" else status
+                payload = {"msg": ev.get("msg") or "", "progress": ev["progress"]}
+                if ev["type"] == "detail":
+                    payload["detail"] = ev.get("detail")
                 yield "data: " + json.dumps(payload) + "\n\n"
-            last_len = len(msgs)
-            if job.get("status") == "done" or int(job.get("progress", 0)) >= 100:
-                yield "data: " + json.dumps({"msg": "done", "progress": 100}) + "\n\n"
-                return
-            await asyncio.sleep(1)
     return StreamingResponse(event_stream(), media_type="text/event-stream")
 
-@router.get("/result/{job_id}", response_class=HTMLResponse)
-async def batch_result(request: Request, job_id: str, session: AsyncSession = Depends(get_session)):
-    from app.services.progress import get_job
-    from app.services.history import record_run
+# Batch streams coalesce bursts of changes into one frame per interval. With a
+# shared job backend they also re-read unfinished jobs every BATCH_RESYNC
+# seconds to pick up changes made by other processes (which do not wake this
+# one); in memory every change comes through the Watch, so nothing is re-read.
+BATCH_STREAM_INTERVAL = 0.25
+BATCH_RESYNC = 5.0
+
+async def _load_batch(batch_id: str):
+    b = batches.get_batch(batch_id)
+    if b is not None:
+        return b
+    try:
+        recs = await jobstore.batch_jobs(batch_id)
+    except Exception:
+        return None
+    if not recs:
+        return None
+    created = min(r.created_at for r in recs)
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    b = batches.register(batch_id, [r.id for r in recs], created=created.timestamp())
+    for r in recs:
+        b.mark(r.id, r.status)
+    statuses = {r.status for r in recs}
+    if "paused" in statuses:
+        b.state = "paused"
+    elif "cancelled" in statuses and not statuses & {"queued", "running"}:
+        b.state = "cancelled"
+    return b
+
+@router.post("/batch/{batch_id}/cancel")
+async def batch_cancel(batch_id: str):
+    """Cancel the batch: queued rows are dropped and running ones stopped mid-fetch/generation
+    (here at once; on other workers when they next renew their lease)."""
+    b = await _load_batch(batch_id)
+    if b is None:
+        raise HTTPException(status_code=404, detail="batch not found")
+    # Persist first, so no worker claims a row in between
+    ids = await jobstore.cancel_batch(batch_id)
+    b.state = "cancelled"
+    job_queue.cancel(batch_id)
+    for job_id in ids:
+        await finish_job(job_id, None, status="cancelled")
+    b.touch_all()
+    return JSONResponse({"ok": True, "state": b.state, "cancelled": len(ids)})
+
+@router.post("/batch/{batch_id}/pause")
+async def batch_pause(batch_id: str):
+    """Stop starting rows of the batch; rows already running finish."""
+    b = await _load_batch(batch_id)
+    if b is None:
+        raise HTTPException(status_code=404, detail="batch not found")
+    if b.state == "cancelled":
+        raise HTTPException(status_code=409, detail="batch was cancelled")
+    job_queue.pause(batch_id)
+    ids = await jobstore.pause_batch(batch_id)
+    b.state = "paused"
+    for job_id in ids:
+        await set_job_status(job_id, "paused")
+    b.touch_all()
+    return JSONResponse({"ok": True, "state": b.state, "paused": len(ids)})
+
+@router.post("/batch/{batch_id}/resume")
+async def batch_resume(batch_id: str):
+    b = await _load_batch(batch_id)
+    if b is None:
+        raise HTTPException(status_code=404, detail="batch not found")
+    if b.state == "cancelled":
+        raise HTTPException(status_code=409, detail="batch was cancelled")
+    recs = await jobstore.resume_batch(batch_id)
+    b.state = "running"
+    job_queue.resume(batch_id)
+    for rec in recs:
+        await set_job_status(rec.id, "queued")
+    # Rows not in this process's queue (paused before a restart, or never fed to it)
+    _start_pump(batch_id)
+    b.touch_all()
+    return JSONResponse({"ok": True, "state": b.state, "resumed": len(recs)})
+
+@router.post("/batch/{batch_id}/concurrency")
+async def batch_concurrency(batch_id: str, limit: int = Form(...)):
+    """Cap the rows of this batch running at once in this process (0: no cap beyond the worker pool)."""
+    b = await _load_batch(batch_id)
+    if b is None:
+        raise HTTPException(status_code=404, detail="batch not found")
+    if limit < 0:
+        raise HTTPException(status_code=400, detail="limit must be >= 0")
+    b.limit = limit or None
+    job_queue.set_limit(batch_id, b.limit)
+    b.touch_all()
+    return JSONResponse({"ok": True, "limit": b.limit, "workers": job_queue.workers})
+
+@router.post("/batch/{batch_id}/priority")
+async def batch_priority(batch_id: str, priority: str = Form(...)):
+    """Weight of the batch in the fair share of the batch workers among running batches."""
+    b = await _load_batch(batch_id)
+    if b is None:
+        raise HTTPException(status_code=404, detail="batch not found")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    b.priority = priority
+    job_queue.set_priority(batch_id, priority)
+    b.touch_all()
+    return JSONResponse({"ok": True, "priority": priority})
+
+@router.get("/api/queue")
+async def queue_status():
+    """Lanes (queued, running, recent wait times) and the batches sharing the workers."""
+    groups = {str(k): v for k, v in job_queue.groups().items() if k is not None}
+    return JSONResponse({"lanes": job_queue.lanes(), "groups": groups})
+
+def _compact(job_id: str, job) -> dict:
+    """Per-row state sent on the batch stream (short keys; only changed ones go out)."""
+    if job is None:
+        return {"s": "unknown"}
+    msgs = job.get("messages") or []
+    snap = {"s": job.get("status"), "p": int(job.get("progress") or 0), "m": msgs[-1]["msg"] if msgs else None,
+            "d": job.get("detail")}
+    if snap["s"] == "queued":
+        snap["q"] = job_queue.position(job_id)
+    result = job.get("result")
+    if snap["s"] in FINISHED and isinstance(result, dict):
+        snap["o"] = result.get("overall")
+        # Positional: c[0] is competitor1 even when it was blank or failed
+        snap["c"] = [c.get("overall") if isinstance(c, dict) else None for c in (result.get("comparisons") or [])[:2]]
+        if result.get("retries"):
+            snap["r"] = sum(result["retries"].values())
+        if snap["s"] == "failed":
+            snap["f"] = result.get("failure") or "error"
+    return snap
+
+def _batch_stats(b, sent: dict) -> dict:
+    counts = {"queued": 0, "running": 0, "paused": 0, "done": 0, "failed": 0, "cancelled": 0}
+    retries = 0
+    failures: dict = {}
+    for snap in sent.values():
+        if snap["s"] in counts:
+            counts[snap["s"]] += 1
+        retries += snap.get("r", 0)
+        if "f" in snap:
+            failures[snap["f"]] = failures.get(snap["f"], 0) + 1
+    finished = counts["done"] + counts["failed"] + counts["cancelled"]
+    elapsed = max(1e-6, time.time() - b.created)
+    rate = finished / elapsed
+    left = len(b.job_ids) - finished
+    if b.state != "running":
+        rate = 0.0
+    return {**counts, "total": len(b.job_ids), "state": b.state, "limit": b.limit,
+            "priority": b.priority, "wait_p50_s": job_queue.lanes()["batch"]["wait_p50_s"], "retries": retries,
+            "failures": failures, "rows_per_min": round(rate * 60, 1),
+            "eta_s": round(left / rate) if rate > 0 and left else (0 if not left else None)}
+
+@router.get("/batch/{batch_id}/events")
+async def batch_events(batch_id: str):
+    """One SSE stream for a whole batch: `jobs` frames carry per-row deltas keyed
+    by row index, `stats` frames the aggregate counters, `end` closes it."""
+    b = await _load_batch(batch_id)
+    if b is None:
+        raise HTTPException(status_code=404, detail="batch not found")
+
+    async def event_stream():
+        w = batches.watch(b)
+        sent: dict = {}
+        last_stats = None
+        dirty = set(b.job_ids)
+        try:
+            while True:
+                updates = []
+                for job_id in sorted(dirty, key=b.index.__getitem__):
+                    snap = _compact(job_id, await _job_view(job_id))
+                    # Also learns of rows finished by other processes
+                    b.mark(job_id, snap["s"])
+                    prev = sent.get(job_id, {})
+                    delta = {k: v for k, v in snap.items() if prev.get(k) != v}
+                    if delta:
+                        sent[job_id] = snap
+                        updates.append({"i": b.index[job_id], **delta})
+                # Places in line move as the queue drains, without the rows themselves changing
+                for job_id, snap in sent.items():
+                    if snap["s"] == "queued" and job_id not in dirty:
+                        q = job_queue.position(job_id)
+                        if q != snap.get("q"):
+                            snap["q"] = q
+                            updates.append({"i": b.index[job_id], "q": q})
+                if updates:
+                    yield "event: jobs\ndata: " + json.dumps(updates, default=str) + "\n\n"
+                stats = _batch_stats(b, sent)
+                if stats != last_stats:
+                    last_stats = stats
+                    yield "event: stats\ndata: " + json.dumps(stats) + "\n\n"
+                if stats["done"] + stats["failed"] + stats["cancelled"] == stats["total"]:
+                    yield "event: end\ndata: {}\n\n"
+                    return
+                dirty = await w.wait(BATCH_RESYNC)
+                if dirty:
+                    await asyncio.sleep(BATCH_STREAM_INTERVAL)
+                    dirty |= w.drain()
+                elif backend_shared():
+                    dirty = {jid for jid in b.job_ids if sent.get(jid, {}).get("s") not in FINISHED}
+        finally:
+            batches.unwatch(b, w)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
+async def _job_view(job_id: str):
+    """The live job, or one rebuilt from its persisted record (e.g. after a restart)."""
     job = await get_job(job_id)
+    if job is not None:
+        return job
+    try:
+        rec = await jobstore.get(job_id)
+    except Exception:
+        return None
+    if rec is None:
+        return None
+    finished = rec.status not in jobstore.UNFINISHED
+    return {"status": rec.status, "progress": 100 if finished else 0, "messages": [], "detail": None,
+            "result": rec.result, "error": rec.error, "batch_id": rec.batch_id, "attempts": rec.attempts}
+
+# /result waits this long for an unfinished job
+RESULT_WAIT = 25.0
+
+@router.get("/result/{job_id}", response_class=HTMLResponse)
+async def batch_result(request: Request, job_id: str, session: AsyncSession = Depends(get_session)):
+    job = await _job_view(job_id)
+    if job and job.get("status") not in FINISHED:
+        # Wait for a job about to finish rather than show the progress page
+        job = await wait_for_job(job_id, timeout=RESULT_WAIT) or job
     if not job or not job.get("result"):
         return templates.TemplateResponse("progress.html", {"request": request, "job_id": job_id, "error": job and job.get("error")})
     result = job["result"]
-    try:
-        await record_run(session, result)
-    except Exception:
-        pass
+    if not result.get("run_id"):
+        # Durable batch rows are recorded by their worker; anything else is saved on first view
+        try:
+            with trace_job(job_id, "save result"):
+                await record_run(session, result)
+        except Exception:
+            pass
     return templates.TemplateResponse("result.html", {"request": request, **result})
 
 @router.get("/api/job/{job_id}")
 async def api_job(job_id: str):
-    from app.services.progress import get_job
-    job = await get_job(job_id)
+    job = await _job_view(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="job not found")
-    return JSONResponse(job)
+    return JSONResponse({**job, "position": job_queue.position(job_id)})
+
+@router.get("/api/job/{job_id}/trace")
+async def api_job_trace(request: Request, job_id: str, format: str = "html"):
+    trace = get_trace(job_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="no trace for job")
+    if format in ("otlp", "json"):
+        return JSONResponse(to_otlp(trace))
+    rows = waterfall(trace)
+    total_ms = max((r["offset_ms"] + r["duration_ms"] for r in rows), default=0)
+    return templates.TemplateResponse("trace.html", {"request": request, "job_id": job_id, "trace_id": trace.trace_id,
+                                                     "rows": rows, "total_ms": round(total_ms, 1)})
+
+def _export_response(fmt: str, records, name: str) -> StreamingResponse:
+    if fmt not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(export.FORMATS)}")
+    filename = f"{name}.{export.EXTENSIONS[fmt]}"
+    return StreamingResponse(export.encode(fmt, records), media_type=export.MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@router.get("/batch/export")
+async def batch_export(format: str = "ndjson", batch_id: Optional[str] = None, status: Optional[str] = None,
+                       min_score: Optional[float] = None, max_score: Optional[float] = None):
+    """Stream batch results: NDJSON, CSV, or a zip of .jsonld files (format=jsonld)."""
+    records = export.iter_jobs(batch_id=batch_id, status=status, min_score=min_score, max_score=max_score)
+    return _export_response(format, records, f"batch-{batch_id[:8]}" if batch_id else "batches")
+
+@router.get("/history/export")
+async def history_export(format: str = "ndjson", q: Optional[str] = None, min_score: Optional[float] = None,
+                         max_score: Optional[float] = None):
+    return _export_response(format, export.iter_runs(q=q, min_score=min_score, max_score=max_score), "history")
 
 @router.post("/batch/export_jobs")
-async def export_jobs():
-    # Minimal JSON export of finished jobs
-    try:
-        from app.services.progress import list_jobs
-        jobs = await list_jobs()
-    except Exception:
-        return JSONResponse({"ok": False, "error": "export not implemented in this build"}, status_code=200)
-
-    out = []
-    for job_id, job in jobs.items():
-        if job.get("result"):
-            out.append({"job_id": job_id, "result": job["result"]})
-    return JSONResponse({"ok": True, "count": len(out), "items": out})
+async def export_jobs(batch_id: Optional[str] = Form(None), job_ids: Optional[str] = Form(None),
+                      format: str = Form("csv"), status: Optional[str] = Form(None)):
+    """The run page's download button: the whole batch, or the listed jobs."""
+    ids = [] if batch_id else export.split_ids(job_ids)
+    if not batch_id and not ids:
+        raise HTTPException(status_code=400, detail="batch_id or job_ids is required")
+    records = export.iter_jobs(batch_id=batch_id, status=status, job_ids=ids)
+    return _export_response(format, records, f"batch-{batch_id[:8]}" if batch_id else "jobs")
@@ -0,0 +1,75 @@
+# benchmarks/bench_progress.py
+"""Throughput of the in-memory job store under many concurrent jobs.
+
+    python benchmarks/bench_progress.py --jobs 10000 --updates 20 --reads 20
+
+Each job is its own task logging `--updates` progress messages (pipeline
+stage names, so they repeat across jobs) with a get_job after each one, the
+way SSE streams and the batch stream read jobs while they run. Reports
+update_job and get_job calls per second and the job store's traced memory.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import progress  # noqa: E402
+
+STEPS = ["Fetching page", "Extracting content", "Generating JSON-LD", "Validating", "Scoring", "Comparing competitors"]
+
+
+async def run(jobs: int, updates: int, reads: int) -> dict:
+    progress.use_backend(progress.MemoryBackend(max_jobs=jobs * 2))
+    ids = [f"job-{i}" for i in range(jobs)]
+    for jid in ids:
+        await progress.create_job(jid)
+    start = asyncio.Event()
+    timings = {"update": 0.0, "get": 0.0}
+
+    async def job(jid: str) -> None:
+        await start.wait()
+        for n in range(updates):
+            t = time.perf_counter()
+            await progress.update_job(jid, int(100 * n / updates), STEPS[n % len(STEPS)], {"step": n})
+            timings["update"] += time.perf_counter() - t
+            for _ in range(reads // updates or 1):
+                t = time.perf_counter()
+                await progress.get_job(jid)
+                timings["get"] += time.perf_counter() - t
+        await progress.finish_job(jid, {"overall": 80, "jsonld": {"@type": "WebPage", "url": jid}})
+
+    tasks = [asyncio.create_task(job(jid)) for jid in ids]
+    t0 = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - t0
+    n_get = jobs * updates * (reads // updates or 1)
+    return {
+        "jobs": jobs,
+        "wall_s": round(wall, 3),
+        "update_job_per_s": round(jobs * updates / timings["update"]),
+        "get_job_per_s": round(n_get / timings["get"]),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--jobs", type=int, default=10_000)
+    ap.add_argument("--updates", type=int, default=20)
+    ap.add_argument("--reads", type=int, default=20)
+    args = ap.parse_args()
+    tracemalloc.start()
+    res = asyncio.run(run(args.jobs, args.updates, args.reads))
+    current, peak = tracemalloc.get_traced_memory()
+    res["store_mb"] = round(current / 2**20, 1)
+    res["peak_mb"] = round(peak / 2**20, 1)
+    print(" ".join(f"{k}={v}" for k, v in res.items()))
+
+
+if __name__ == "__main__":
+    main()
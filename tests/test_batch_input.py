@@ -0,0 +1,69 @@
+# tests/test_batch_input.py
+import asyncio
+import gzip
+import io
+import json
+
+import pytest
+
+from app.services import batch_input
+from app.services.batch_input import BatchInput, read_rows
+from app.services.csv_ingest import parse_csv3
+
+
+def _chunks(data: bytes, size: int = 5):
+    async def gen():
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+    return gen()
+
+
+def _read(data: bytes):
+    return asyncio.run(read_rows(_chunks(data)))
+
+
+def test_gzip_csv_matches_plain_csv():
+    text = "URL,Telephone\nhttps://a.example,1\n,2\nhttps://b.example,3\n"
+    assert _read(gzip.compress(text.encode())) == parse_csv3(text)
+
+
+def test_jsonl_uses_csv_aliases_and_url_checks():
+    lines = [{"URL": "https://a.example", "telephone": 5, "topic": None},
+             {"url": "", "topic": "x"}, "not json", {"url": "https://b.example", "extra": {"k": 1}}]
+    data = gzip.compress("\n".join(l if isinstance(l, str) else json.dumps(l) for l in lines).encode())
+    source = BatchInput()
+
+    async def main():
+        return [r async for r in source.rows(_chunks(data, 7))]
+
+    rows = asyncio.run(main())
+    assert (source.compression, source.format) == ("gzip", "jsonl")
+    assert rows == [{"url": "https://a.example", "phone": "5", "topic": ""},
+                    {"url": "https://b.example", "extra": '{"k": 1}'}]
+    assert source.warnings == ["Row 2 missing 'url' value; row skipped.", "Row 3 is not valid JSON; row skipped."]
+
+    rows, errors, _ = _read(b'{"link": "https://a.example"}\n')
+    assert rows == [] and "url" in errors[0]
+
+
+def test_parquet_without_pyarrow_is_a_clear_error(monkeypatch):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        rows, errors, _ = _read(b"PAR1" + b"\0" * 32)
+        assert rows == [] and "pyarrow" in errors[0]
+        # Past the in-memory limit the spool is written from a worker thread
+        monkeypatch.setattr(batch_input, "SPOOL_MAX_BYTES", 8)
+        rows, errors, _ = _read(b"PAR1" + b"\0" * 32)
+        assert rows == [] and "pyarrow" in errors[0]
+
+
+def test_parquet_is_read_with_column_projection():
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    buf = io.BytesIO()
+    pq.write_table(pa.table({"URL": ["https://a.example", None], "Telephone": ["1", "2"], "html_dump": ["<html>", "x"]}), buf)
+    rows, errors, warnings = _read(buf.getvalue())
+    assert rows == [{"url": "https://a.example", "phone": "1"}] and not errors
+    assert warnings == ["Row 2 missing 'url' value; row skipped."]
@@ -0,0 +1,310 @@
+# tests/test_batches.py
+import asyncio
+import json
+
+from app.services import batches, progress
+from app.web.routers import batch as batch_router
+
+
+def _frames(chunks):
+    out = []
+    for chunk in chunks:
+        event, data = chunk.strip().split("\n")
+        out.append((event.split(": ", 1)[1], json.loads(data.split(": ", 1)[1])))
+    return out
+
+
+def test_one_stream_carries_deltas_and_stats_for_the_whole_batch(monkeypatch):
+    monkeypatch.setattr(progress, "_backend", progress.MemoryBackend())
+    monkeypatch.setattr(batch_router, "BATCH_STREAM_INTERVAL", 0.01)
+    ids = [f"bj{i}" for i in range(3)]
+
+    async def main():
+        for jid in ids:
+            await progress.create_job(jid)
+        batches.register("batch-1", ids)
+        resp = await batch_router.batch_events("batch-1")
+        chunks = []
+
+        async def consume():
+            async for chunk in resp.body_iterator:
+                chunks.append(chunk)
+
+        reader = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        await progress.set_job_status("bj1", "running")
+        await progress.update_job("bj1", 40, "Generating")
+        await asyncio.sleep(0.05)
+        await progress.finish_job("bj0", {"overall": 80, "comparisons": [{"overall": 70}]})
+        await progress.finish_job("bj1", {"error": "boom"}, status="failed")
+        await progress.finish_job("bj2", {"overall": 90})
+        await asyncio.wait_for(reader, 2)
+        return _frames(chunks)
+
+    frames = asyncio.run(main())
+    kinds = [k for k, _ in frames]
+    assert kinds[:2] == ["jobs", "stats"] and kinds[-1] == "end"
+    first = frames[0][1]
+    assert [u["i"] for u in first] == [0, 1, 2] and all(u["s"] == "queued" for u in first)
+    running = [u for k, d in frames[2:] if k == "jobs" for u in d if u["i"] == 1 and u.get("s") == "running"]
+    assert running and running[0]["m"] == "Generating" and running[0]["p"] == 40
+    # Deltas only carry what changed
+    assert all("m" not in u for k, d in frames if k == "jobs" for u in d if u.get("s") == "done")
+    final = [d for k, d in frames if k == "stats"][-1]
+    assert (final["done"], final["failed"], final["total"], final["eta_s"]) == (2, 1, 3, 0)
+    done0 = [u for k, d in frames if k == "jobs" for u in d if u["i"] == 0 and u.get("s") == "done"][0]
+    assert (done0["o"], done0["c"]) == (80, [70])
+
+
+def test_ingest_past_the_queue_capacity_keeps_every_row(tmp_path, monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlmodel import SQLModel
+
+    from app.services import jobstore
+    from app.services.batch_input import BatchInput
+    from app.services.jobqueue import JobQueue
+
+    engine = create_async_engine("sqlite+aiosqlite:///" + str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(jobstore, "AsyncSessionLocal", sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(progress, "_backend", progress.MemoryBackend())
+    queue = JobQueue(workers=1, maxsize=3, reserved=0)
+    monkeypatch.setattr(batch_router, "job_queue", queue)
+    monkeypatch.setattr(batch_router, "INGEST_STEP", 4)
+    ran = []
+
+    async def fake_run(job_id, row, cache, requeue):
+        await jobstore.claim(job_id)
+        await asyncio.sleep(0.01)
+        ran.append(row["url"])
+        await jobstore.complete(job_id, "done", {"overall": 90})
+
+    monkeypatch.setattr(batch_router, "run_durable", fake_run)
+    urls = [f"https://site{i}.example/" for i in range(10)]
+
+    async def chunks():
+        yield ("url,topic\n" + "".join(f"{u},t\n" for u in urls)).encode()
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        jobs, warnings = [], []
+        error = await batch_router._ingest("big", BatchInput(), chunks(), jobs, warnings)
+        assert error is None and len(jobs) == 10 > queue.maxsize
+        assert [j["url"] for j in jobs] == urls
+        # Every row is in the job table, the overflow waiting for the queue to drain
+        assert [r.row_no for r in await jobstore.batch_jobs("big")] == list(range(1, 11))
+        await asyncio.wait_for(batch_router._pumps["big"], 5)
+        await asyncio.wait_for(queue.join(), 5)
+        return [r.status for r in await jobstore.batch_jobs("big")]
+
+    statuses = asyncio.run(main())
+    assert statuses == ["done"] * 10
+    assert ran == urls
+
+
+def test_interactive_submit_overtakes_queued_batch_rows(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.services.jobqueue import JobQueue
+
+    monkeypatch.setattr(progress, "_backend", progress.MemoryBackend())
+    queue = JobQueue(workers=1, maxsize=10, reserved=0)
+    monkeypatch.setattr(batch_router, "job_queue", queue)
+    ran = []
+
+    async def fake_row(row, job_id, cache, can_defer=False):
+        ran.append(row["url"])
+        return "done", {"url": row["url"], "overall": 90}
+
+    monkeypatch.setattr(batch_router, "run_row", fake_row)
+    app = FastAPI()
+    app.include_router(batch_router.router)
+    gate = asyncio.Event()
+
+    async def batch_row(name):
+        if name == "b0":
+            await gate.wait()
+        ran.append(name)
+
+    async def queue_batch():
+        for i in range(3):
+            queue.submit(f"b{i}", lambda i=i: batch_row(f"b{i}"), group="batch-1")
+        await asyncio.sleep(0.01)  # b0 holds the only worker
+
+    with TestClient(app) as client:
+        client.portal.call(queue_batch)
+        resp = client.post("/submit_async", data={"url": "https://one.example/"})
+        assert resp.status_code == 200 and resp.json()["position"] == 1
+        client.portal.call(gate.set)
+        client.portal.call(queue.join)
+        job = client.get(f"/api/job/{resp.json()['job_id']}").json()
+
+    assert ran == ["b0", "https://one.example/", "b1", "b2"]
+    assert job["status"] == "done" and job["result"]["overall"] == 90
+
+
+def test_batch_stream_updates_queue_positions_as_the_queue_drains(monkeypatch):
+    from app.services.jobqueue import JobQueue
+
+    monkeypatch.setattr(progress, "_backend", progress.MemoryBackend())
+    monkeypatch.setattr(batch_router, "BATCH_STREAM_INTERVAL", 0.01)
+    queue = JobQueue(workers=1, maxsize=10, reserved=0)
+    monkeypatch.setattr(batch_router, "job_queue", queue)
+    ids = [f"qj{i}" for i in range(3)]
+
+    async def main():
+        gates = {jid: asyncio.Event() for jid in ids}
+
+        async def run(jid):
+            await progress.set_job_status(jid, "running")
+            await gates[jid].wait()
+            await progress.finish_job(jid, {"overall": 1})
+
+        for jid in ids:
+            await progress.create_job(jid)
+        batches.register("batch-q", ids)
+        for jid in ids:
+            queue.submit(jid, lambda jid=jid: run(jid), group="batch-q")
+        await asyncio.sleep(0.01)  # qj0 running, qj1 and qj2 waiting
+        resp = await batch_router.batch_events("batch-q")
+        chunks = []
+
+        async def consume():
+            async for chunk in resp.body_iterator:
+                chunks.append(chunk)
+
+        reader = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        for jid in ids:
+            gates[jid].set()
+            await asyncio.sleep(0.05)
+        await asyncio.wait_for(reader, 2)
+        return _frames(chunks)
+
+    frames = asyncio.run(main())
+    first = {u["i"]: u for u in frames[0][1]}
+    assert (first[1]["q"], first[2]["q"]) == (1, 2) and "q" not in first[0]
+    # qj2 moves up once qj0 is done, though nothing about qj2 itself changed
+    assert any(u == {"i": 2, "q": 1} for k, d in frames if k == "jobs" for u in d)
+
+
+def test_rows_of_a_batch_share_one_competitor_cache(monkeypatch):
+    from app.services.jobqueue import JobQueue
+
+    queue = JobQueue(workers=1, maxsize=10, reserved=0)
+    monkeypatch.setattr(batch_router, "job_queue", queue)
+    caches = []
+
+    async def fake_run(job_id, row, cache, requeue):
+        caches.append(cache)
+
+    monkeypatch.setattr(batch_router, "run_durable", fake_run)
+    b = batches.register("batch-cache", ["cj0", "cj1"])
+
+    async def main():
+        batch_router._submit("cj0", {"url": "https://a.example/"}, "batch-cache")
+        # ...and rows resubmitted after a pause reuse it too
+        batch_router._submit_later("cj1", {"url": "https://b.example/"}, "batch-cache")
+        await queue.join()
+
+    asyncio.run(main())
+    assert caches == [b.competitors, b.competitors]
+
+
+def test_restart_loads_the_batch_before_resuming_its_rows(tmp_path, monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlmodel import SQLModel
+
+    from app.services import jobstore
+    from app.services.jobqueue import JobQueue
+
+    engine = create_async_engine("sqlite+aiosqlite:///" + str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(jobstore, "AsyncSessionLocal", sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(progress, "_backend", progress.MemoryBackend())
+    queue = JobQueue(workers=1, maxsize=10, reserved=0)
+    monkeypatch.setattr(batch_router, "job_queue", queue)
+    caches = []
+
+    async def fake_run(job_id, row, cache, requeue):
+        caches.append(cache)
+
+    monkeypatch.setattr(batch_router, "run_durable", fake_run)
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        await jobstore.enqueue("batch-restart", [(f"rj{i}", i, {"url": f"https://r{i}.example/"}) for i in range(1, 4)])
+        await jobstore.claim("rj1")
+        await jobstore.complete("rj1", "done", {"overall": 1})
+        await batch_router.resume_batches()
+        await queue.join()
+
+    asyncio.run(main())
+    b = batches.get_batch("batch-restart")
+    assert b.job_ids == ["rj1", "rj2", "rj3"] and b.finished == {"rj1"}
+    assert caches == [b.competitors, b.competitors]
+
+
+def test_only_finished_unwatched_batches_are_evicted(monkeypatch):
+    monkeypatch.setattr(batches, "_batches", batches.OrderedDict())
+    monkeypatch.setattr(batches, "_job_batch", {})
+    monkeypatch.setattr(batches, "BATCH_KEEP", 2)
+    running = batches.register("ev-running", ["e1"])
+    watched = batches.register("ev-watched", ["e2"])
+    watched.mark("e2", "done")
+    w = batches.watch(watched)
+    finished = batches.register("ev-finished", ["e3"])
+    finished.mark("e3", "failed")
+    batches.register("ev-new", ["e4"])
+    # Over the cap, but the running and the streamed batch stay
+    assert list(batches._batches) == ["ev-running", "ev-watched", "ev-new"]
+    assert "e3" not in batches._job_batch
+
+    batches.unwatch(watched, w)
+    batches._on_job_change("e1", {"type": "finished", "status": "done"})
+    batches.register("ev-newer", ["e5"])
+    assert list(batches._batches) == ["ev-new", "ev-newer"] and running.done()
+
+
+def test_idle_stream_rereads_rows_only_with_a_shared_backend(monkeypatch):
+    monkeypatch.setattr(batch_router, "BATCH_RESYNC", 0.02)
+    reads = []
+    real_view = batch_router._job_view
+
+    async def counting_view(job_id):
+        reads.append(job_id)
+        return await real_view(job_id)
+
+    monkeypatch.setattr(batch_router, "_job_view", counting_view)
+
+    def idle_reads(backend, batch_id):
+        monkeypatch.setattr(progress, "_backend", backend)
+        ids = [f"{batch_id}-{i}" for i in range(3)]
+
+        async def main():
+            for jid in ids:
+                await progress.create_job(jid)
+            batches.register(batch_id, ids)
+            resp = await batch_router.batch_events(batch_id)
+
+            async def consume():
+                async for _ in resp.body_iterator:
+                    pass
+
+            reader = asyncio.create_task(consume())
+            await asyncio.sleep(0.01)  # the first frame reads every row once
+            reads.clear()
+            await asyncio.sleep(0.15)
+            reader.cancel()
+            return len(reads)
+
+        return asyncio.run(main())
+
+    # In memory the Watch sees every change: an idle stream reads nothing
+    assert idle_reads(progress.MemoryBackend(), "idle-mem") == 0
+    shared = progress.RedisBackend(progress.LocalRedis())
+    monkeypatch.setattr(type(shared), "shared", True)
+    assert idle_reads(shared, "idle-shared") >= 3
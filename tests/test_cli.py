@@ -0,0 +1,178 @@
+# tests/test_cli.py
+import asyncio
+import io
+import json
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import cli, db, main_part2
+
+
+def _use_db(tmp_path, monkeypatch):
+    # app.db is imported long before this test, so SCHEMAGEN_DB_URL would come too late
+    engine = create_async_engine("sqlite+aiosqlite:///" + str(tmp_path / "cli.db"))
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(db, "AsyncSessionLocal", sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+
+
+def test_batch_writes_ndjson_and_resumes(tmp_path, monkeypatch):
+    _use_db(tmp_path, monkeypatch)
+    seen = []
+
+    async def fake_process(url, *args, **kwargs):
+        seen.append(url)
+        if url.endswith("/bad"):
+            raise RuntimeError("fetch failed")
+        return {"url": url, "overall": 75, "valid": True, "jsonld": {"@type": "WebPage"}}
+
+    async def no_browser():
+        return None
+
+    monkeypatch.setattr(main_part2, "_process_shared", fake_process)
+    monkeypatch.setattr("app.services.fetch.close_browser", no_browser)
+    src = tmp_path / "in.csv"
+    src.write_text("url,topic\nhttps://a.example/,x\nhttps://a.example/bad,y\nhttps://c.example/,z\n")
+    out = tmp_path / "out.ndjson"
+
+    assert cli.main(["batch", str(src), "-o", str(out), "-w", "2"]) == 1
+    recs = [json.loads(line) for line in out.read_text().splitlines()]
+    assert sorted(r["row"] for r in recs) == [1, 2, 3]
+    assert [r["error"] for r in recs if r["row"] == 2] == ["RuntimeError: fetch failed"]
+    assert cli.completed_rows(str(out), "ndjson") == {1, 3}
+
+    seen.clear()
+    cli.main(["batch", str(src), "-o", str(out), "--resume"])
+    assert seen == ["https://a.example/bad"]
+    assert len(out.read_text().splitlines()) == 4
+
+
+@pytest.mark.parametrize("name,torn", [("out.ndjson", '{"row": 3, "url": "https://c.exa'),
+                                        ("out.csv", '3,https://c.example/,"Web')])
+def test_resume_twice_after_a_kill_mid_write(tmp_path, monkeypatch, name, torn):
+    _use_db(tmp_path, monkeypatch)
+    seen = []
+
+    async def fake_process(url, *args, **kwargs):
+        seen.append(url)
+        return {"url": url, "overall": 75, "valid": True, "jsonld": {"@type": "WebPage"}}
+
+    async def no_browser():
+        return None
+
+    monkeypatch.setattr(main_part2, "_process_shared", fake_process)
+    monkeypatch.setattr("app.services.fetch.close_browser", no_browser)
+    urls = [f"https://{c}.example/" for c in "abcde"]
+    src = tmp_path / "in.csv"
+    src.write_text("url,topic\n" + "".join(f"{u},x\n" for u in urls[:2]))
+    out = tmp_path / name
+    assert cli.main(["batch", str(src), "-o", str(out), "-w", "1"]) == 0
+    # Killed while writing row 3
+    with open(out, "a", newline="", encoding="utf-8") as f:
+        f.write(torn)
+    src.write_text("url,topic\n" + "".join(f"{u},x\n" for u in urls))
+
+    seen.clear()
+    assert cli.main(["batch", str(src), "-o", str(out), "-w", "1", "--resume"]) == 0
+    assert sorted(seen) == urls[2:]
+    seen.clear()
+    assert cli.main(["batch", str(src), "-o", str(out), "-w", "1", "--resume"]) == 0
+    assert seen == []
+    assert cli.completed_rows(str(out), "csv" if name.endswith(".csv") else "ndjson") == {1, 2, 3, 4, 5}
+
+
+def test_completed_rows_skips_lines_that_do_not_parse(tmp_path):
+    out = tmp_path / "out.ndjson"
+    out.write_text('{"row": 1}\n{"row": 2, "url": "x{"row": 3}\n{"row": 4}\n')
+    assert cli.completed_rows(str(out), "ndjson") == {1, 4}
+
+
+def test_rows_are_read_as_workers_free_up(tmp_path, monkeypatch):
+    _use_db(tmp_path, monkeypatch)
+    read, started = [], []
+
+    async def fake_process(url, *args, **kwargs):
+        started.append((url, len(read)))
+        await asyncio.sleep(0.01)
+        return {"url": url, "overall": 1}
+
+    async def no_browser():
+        return None
+
+    async def rows():
+        for i in range(1, 21):
+            read.append(i)
+            yield {"url": f"https://r.example/{i}"}
+
+    monkeypatch.setattr(main_part2, "_process_shared", fake_process)
+    monkeypatch.setattr("app.services.fetch.close_browser", no_browser)
+    out = io.StringIO()
+    summary = asyncio.run(cli.run_batch(rows(), cli._Writer(out, "ndjson", True), workers=1, skip={2}))
+    assert summary["total"] == 20 and summary["skipped"] == 1 and summary["done"] == 19
+    # With one worker the queue holds two rows: the first row starts long before the input is read
+    assert started[0][1] <= 4
+    assert sorted(json.loads(line)["row"] for line in out.getvalue().splitlines()) == [i for i in range(1, 21) if i != 2]
+
+
+def test_progress_has_a_total_and_eta_from_the_first_row(tmp_path, monkeypatch, capsys):
+    _use_db(tmp_path, monkeypatch)
+
+    async def fake_process(url, *args, **kwargs):
+        return {"url": url, "overall": 75}
+
+    async def no_browser():
+        return None
+
+    monkeypatch.setattr(main_part2, "_process_shared", fake_process)
+    monkeypatch.setattr("app.services.fetch.close_browser", no_browser)
+    # More rows than the queue holds, so the input is still being read at the first report
+    src = tmp_path / "in.csv"
+    src.write_text("url,topic\n" + "".join(f"https://r.example/{i},x\n" for i in range(1, 31)))
+    out = tmp_path / "out.ndjson"
+    assert cli.main(["batch", str(src), "-o", str(out), "-w", "1", "--progress-every", "0"]) == 0
+    lines = [line for line in capsys.readouterr().err.splitlines() if " done (" in line]
+    assert lines[0].startswith("[batch] 1/30 done") and "ETA --:--:--" not in lines[0]
+
+    out.write_text("".join(json.dumps({"row": i}) + "\n" for i in range(1, 11)))
+    assert cli.main(["batch", str(src), "-o", str(out), "-w", "1", "--progress-every", "0", "--resume"]) == 0
+    assert [line for line in capsys.readouterr().err.splitlines() if " done (" in line][0].startswith("[batch] 1/20 done")
+
+
+def test_cli_rows_wait_behind_interactive_requests(tmp_path, monkeypatch):
+    from app.services.jobqueue import BATCH, INTERACTIVE, Slots, set_lane
+
+    _use_db(tmp_path, monkeypatch)
+    slots, order = Slots(1), []
+
+    async def fake_process(url, *args, **kwargs):
+        async with slots:
+            order.append(url)
+        return {"url": url, "overall": 1}
+
+    async def no_browser():
+        return None
+
+    async def interactive():
+        set_lane(INTERACTIVE)
+        async with slots:
+            order.append("interactive")
+
+    monkeypatch.setattr(main_part2, "_process_shared", fake_process)
+    monkeypatch.setattr("app.services.fetch.close_browser", no_browser)
+
+    async def main():
+        async with slots:
+            batch = asyncio.create_task(cli.run_batch([{"url": "https://cli.example/"}],
+                                                      cli._Writer(io.StringIO(), "ndjson", True), workers=1))
+            for _ in range(200):
+                if slots._waiters[BATCH]:
+                    break
+                await asyncio.sleep(0.01)
+            assert slots._waiters[BATCH], "the CLI row should queue for the slot as batch work"
+            first = asyncio.create_task(interactive())
+            await asyncio.sleep(0.01)
+        await asyncio.gather(batch, first)
+
+    asyncio.run(main())
+    assert order == ["interactive", "https://cli.example/"]
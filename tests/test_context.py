@@ -0,0 +1,38 @@
+# tests/test_context.py
+from app.services.context import chunk_sections, estimate_tokens, select_context, split_passages
+
+PAGE = "\n".join(
+    ["We use cookies to improve your experience. Accept all cookies or manage privacy policy settings."] * 6
+    + ["Lorem ipsum filler paragraph about nothing in particular, repeated for length." for _ in range(10)]
+    + [
+        "Cardiology Services",
+        "Our cardiology team treats heart failure and arrhythmia.",
+        "Visit us at 111 East 210th Street, Bronx, NY 10467 or call (718) 555-1212.",
+    ]
+)
+
+
+def test_split_passages_tracks_headings():
+    passages = split_passages("Intro line that is long enough to be a sentence.\nCardiology Services\nWe treat hearts.")
+    assert passages[-1]["heading"] == "Cardiology Services"
+    assert passages[-1]["text"].startswith("Cardiology Services")
+
+
+def test_short_text_returned_unchanged():
+    assert select_context("Short page.", budget_tokens=50) == "Short page."
+
+
+def test_selects_dense_passage_within_budget():
+    signals = {"telephone": ["(718) 555-1212"]}
+    out = select_context(PAGE, signals=signals, topic="cardiology", subject="Heart Center", budget_tokens=60)
+    assert "111 East 210th Street" in out
+    assert "cookies" not in out
+    assert estimate_tokens(out) <= 60
+
+
+def test_chunk_sections_cuts_at_sections_and_covers_text():
+    text = "\n".join(f"Section {i}\n" + ("Body sentence for this section. " * 20) for i in range(8))
+    chunks = chunk_sections(text, max_chunks=4, min_chunk_tokens=50)
+    assert 1 < len(chunks) <= 4
+    assert all(c.startswith("Section") for c in chunks)
+    assert sum(c.count("Section ") for c in chunks) == 8
@@ -0,0 +1,54 @@
+# tests/test_csv_stream.py
+import asyncio
+
+from app.services.csv_ingest import CsvRowParser, parse_csv3, stream_csv_rows
+
+CSV = ("URL,Telephone,Subject\n"
+       "https://a.example,1,\"Multi\nline, quoted\"\n"
+       ",2,no url\n"
+       "https://b.example,3,5\" screen\n"
+       "https://c.example,4,\"say \"\"hi\"\"\"\n")
+
+
+def test_chunked_feed_matches_whole_text_parse():
+    expected = parse_csv3(CSV)
+    assert [r["url"] for r in expected[0]] == ["https://a.example", "https://b.example", "https://c.example"]
+    for size in (1, 3, 17, len(CSV)):
+        p = CsvRowParser()
+        rows = []
+        for i in range(0, len(CSV), size):
+            rows += p.feed(CSV[i:i + size])
+        rows += p.close()
+        assert (rows, p.errors, p.warnings) == expected
+
+
+def test_rows_stream_out_before_the_input_ends():
+    seen_before_end = []
+
+    async def chunks():
+        yield b"\xef\xbb\xbfurl,topic\n"
+        for i in range(2000):
+            yield f"https://{i}.example,t\n".encode()
+        seen_before_end.append(len(got))
+
+    async def main():
+        async for row in stream_csv_rows(chunks()):
+            got.append(row)
+
+    got = []
+    asyncio.run(main())
+    assert len(got) == 2000 and got[0] == {"url": "https://0.example", "topic": "t"}
+    assert seen_before_end[0] > 1000
+
+
+def test_header_errors_are_reported_by_the_stream():
+    p = CsvRowParser()
+
+    async def chunks():
+        yield b"link,topic\nhttps://a.example,t\n"
+
+    async def main():
+        return [r async for r in stream_csv_rows(chunks(), p)]
+
+    assert asyncio.run(main()) == []
+    assert p.errors and "url" in p.errors[0]
@@ -0,0 +1,66 @@
+# tests/test_export.py
+import asyncio
+import csv
+import io
+import json
+import zipfile
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
+
+from app.models import Run
+from app.services import export, jobstore
+
+
+def _use_db(tmp_path, monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///" + str(tmp_path / "export.db"))
+    maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    monkeypatch.setattr(jobstore, "AsyncSessionLocal", maker)
+    monkeypatch.setattr(export, "AsyncSessionLocal", maker)
+    return engine, maker
+
+
+async def _collect(chunks) -> bytes:
+    return b"".join([c async for c in chunks])
+
+
+def test_batch_export_filters_and_streams_every_format(tmp_path, monkeypatch):
+    engine, maker = _use_db(tmp_path, monkeypatch)
+    monkeypatch.setattr(export, "EXPORT_CHUNK", 2)
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        rows = [(f"j{i}", i, {"url": f"https://ex.com/p{i}"}) for i in range(1, 6)]
+        await jobstore.enqueue("b1", rows)
+        await jobstore.enqueue("b2", [("other", 1, {"url": "https://other.example"})])
+        for job_id, i, row in rows:
+            await jobstore.claim(job_id)
+            if i == 5:
+                await jobstore.complete(job_id, "failed", error="timeout")
+            else:
+                await jobstore.complete(job_id, "done", {"url": row["url"], "overall": i * 20, "jsonld": {"@id": job_id},
+                                                         "comparisons": [{"overall": 50}]})
+        jobs = [r async for r in export.iter_jobs(batch_id="b1", status="done", min_score=40, max_score=80)]
+        listed = [r async for r in export.iter_jobs(job_ids=["j5", "other"])]
+        out = {fmt: await _collect(export.encode(fmt, export.iter_jobs(batch_id="b1"))) for fmt in export.FORMATS}
+        async with maker() as session:
+            # record_run stores JSON fields as encoded strings
+            session.add(Run(url="https://ex.com/h", score_overall=70, jsonld=json.dumps({"@id": "h"})))
+            await session.commit()
+        runs = [r async for r in export.iter_runs(min_score=60)]
+        return jobs, listed, out, runs
+
+    jobs, listed, out, runs = asyncio.run(main())
+    assert [(r["job_id"], r["overall"]) for r in jobs] == [("j2", 40), ("j3", 60), ("j4", 80)]
+    assert sorted((r["job_id"], r["status"], r["error"]) for r in listed) == [("j5", "failed", "timeout"),
+                                                                              ("other", "queued", None)]
+    assert [json.loads(line)["row"] for line in out["ndjson"].splitlines()] == [1, 2, 3, 4, 5]
+    table = list(csv.DictReader(io.StringIO(out["csv"].decode())))
+    assert [r["status"] for r in table] == ["done"] * 4 + ["failed"]
+    assert table[0]["overall"] == "20" and table[0]["competitor1_overall"] == "50"
+    zf = zipfile.ZipFile(io.BytesIO(out["jsonld"]))
+    assert zf.namelist() == [f"0000{i}-ex.com_p{i}.jsonld" for i in range(1, 5)]
+    assert json.loads(zf.read("00001-ex.com_p1.jsonld")) == {"@id": "j1"}
+    assert [(r["url"], r["jsonld"]) for r in runs] == [("https://ex.com/h", {"@id": "h"})]
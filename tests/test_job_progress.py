@@ -0,0 +1,62 @@
+# tests/test_job_progress.py
+import asyncio
+import time
+from types import SimpleNamespace
+
+from app import main_part2
+from app.main_part2 import PIPELINE_STAGES, _job_reporter
+from app.services import progress
+from app.services.pipeline import Stage, StageWeights
+
+
+def test_stage_events_drive_job_progress(monkeypatch):
+    monkeypatch.setattr(main_part2, "_weights", StageWeights({s.name: 100 for s in PIPELINE_STAGES}))
+
+    async def main():
+        await progress.create_job("rep1")
+        on_event, report = _job_reporter("rep1", PIPELINE_STAGES)
+        seen = []
+        for st in PIPELINE_STAGES:
+            await on_event(st.name, "start", {"timings": {}})
+            await on_event(st.name, "done", {"timings": {st.name: 100.0}})
+            seen.append((await progress.get_job("rep1"))["progress"])
+        report({"tokens": 12})
+        report({"tokens": 13})  # throttled
+        await asyncio.sleep(0.01)
+        return seen, await progress.get_job("rep1")
+
+    seen, job = asyncio.run(main())
+    n = len(PIPELINE_STAGES)
+    assert seen == [5 + int(90 * (i + 1) / n) for i in range(n)]
+    assert job["messages"][-1]["msg"] == "Scoring competitors done (100 ms)"
+    assert job["detail"] == {"tokens": 12}
+    assert not main_part2._detail_writes
+
+
+def test_stage_weights_follow_observed_durations():
+    stages = [Stage("fetch", lambda: None), Stage("generate", lambda: None)]
+    w = StageWeights({"fetch": 1000, "generate": 1000}, alpha=0.5)
+    assert w.fraction(["fetch"], stages) == 0.5
+    w.observe({"fetch": 3000})
+    w.observe({"fetch": 3000})
+    assert w.ms == {"fetch": 2500, "generate": 1000}
+    assert abs(w.fraction(["fetch"], stages) - 2500 / 3500) < 1e-9
+
+
+def test_validate_and_score_see_the_enhanced_node(monkeypatch):
+    def slow_enhance(jsonld, secondary_types, html, url, topic, subject):
+        time.sleep(0.05)
+        jsonld["description"] = "Added by enhancement"
+        return {"@context": "https://schema.org", "@graph": [jsonld]}
+
+    monkeypatch.setattr(main_part2, "enhance_jsonld", slow_enhance)
+    stages = [s for s in PIPELINE_STAGES if s.name in ("assemble", "enhance", "validate", "score")]
+    node = {"@context": "https://schema.org", "@type": "MedicalOrganization", "name": "Clinic", "url": "https://x.test/"}
+    ctx = asyncio.run(main_part2.run_stages(stages, {
+        "primary_node": node, "secondary_types": [], "url": "https://x.test/", "inputs": {},
+        "raw_html": "", "topic": "", "subject": "", "primary_type": "MedicalOrganization",
+        "settings": SimpleNamespace(required_fields=["name"], recommended_fields=["description"]),
+    }))
+    assert ctx["root_node"]["description"] == "Added by enhancement"
+    assert ctx["details"]["subscores"]["Schema Validity & Correctness"]["Recommended Fields"] == 100
+    assert "Consider adding: description" not in ctx["advice"]
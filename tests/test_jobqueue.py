@@ -0,0 +1,149 @@
+# tests/test_jobqueue.py
+import asyncio
+
+import pytest
+
+from app.services import progress
+from app.services.jobqueue import BATCH, INTERACTIVE, JobQueue, QueueFull, Slots, set_lane
+
+
+def test_workers_bound_concurrency_and_report_positions():
+    async def main():
+        q = JobQueue(workers=2, maxsize=10)
+        active, peak = [0], [0]
+
+        async def job(job_id):
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.02)
+            active[0] -= 1
+            await progress.finish_job(job_id, {"ok": True})
+
+        ids = [f"q{i}" for i in range(6)]
+        positions = []
+        for jid in ids:
+            await progress.create_job(jid)
+            positions.append(q.submit(jid, lambda jid=jid: job(jid)))
+        await asyncio.sleep(0)  # let the workers take the first two
+        waiting = [q.position(jid) for jid in ids]
+        await q.join()
+        await q.stop()
+        statuses = [(await progress.get_job(jid))["status"] for jid in ids]
+        return positions, waiting, peak[0], statuses
+
+    positions, waiting, peak, statuses = asyncio.run(main())
+    assert positions == [1, 2, 3, 4, 5, 6]
+    assert waiting == [None, None, 1, 2, 3, 4]
+    assert peak == 2
+    assert statuses == ["done"] * 6
+
+
+def test_full_queue_refuses_and_crashed_job_fails():
+    async def main():
+        q = JobQueue(workers=1, maxsize=1)
+        await progress.create_job("crash")
+
+        async def boom():
+            raise RuntimeError("no browser")
+
+        q.submit("crash", boom)
+        with pytest.raises(QueueFull):
+            q.submit("extra", boom)
+        await q.join()
+        await q.stop()
+        return await progress.get_job("crash")
+
+    job = asyncio.run(main())
+    assert job["status"] == "failed" and job["result"] == {"error": "no browser"}
+
+
+def test_groups_take_turns_and_can_be_paused_capped_and_cancelled():
+    async def main():
+        q = JobQueue(workers=2, maxsize=20)
+        order, gate = [], asyncio.Event()
+
+        async def job(job_id, wait=False):
+            order.append(job_id)
+            if wait:
+                await gate.wait()
+            await progress.finish_job(job_id, {})
+
+        for jid in ("a1", "a2", "a3", "b1", "c1", "c2"):
+            await progress.create_job(jid)
+        q.pause("c")
+        for jid in ("a1", "a2", "a3"):
+            q.submit(jid, lambda jid=jid: job(jid, wait=True), group="a")
+        q.set_limit("a", 1)
+        q.submit("b1", lambda: job("b1"), group="b")
+        q.submit("c1", lambda: job("c1"), group="c")
+        q.submit("c2", lambda: job("c2", wait=True), group="c")
+        await asyncio.sleep(0.01)
+        started = list(order)  # a capped at one, c paused
+        q.resume("c")
+        await asyncio.sleep(0.01)
+        dropped = q.cancel("a")
+        gate.set()
+        await q.join()
+        await q.stop()
+        return started, order, sorted(dropped), (await progress.get_job("a1"))["status"]
+
+    started, order, dropped, a1 = asyncio.run(main())
+    assert started == ["a1", "b1"]
+    assert order == ["a1", "b1", "c1", "c2"]
+    assert dropped == ["a1", "a2", "a3"]
+    assert a1 == "running"  # a cancelled job is finished by whoever cancelled it
+
+
+def test_interactive_lane_goes_first_and_batches_share_by_weight():
+    async def main():
+        q = JobQueue(workers=1, maxsize=50, reserved=1)
+        order, gate = [], asyncio.Event()
+
+        async def job(job_id, wait=False):
+            order.append(job_id)
+            if wait:
+                await gate.wait()
+
+        q.submit("block", lambda: job("block", wait=True), group="a")
+        await asyncio.sleep(0.01)  # the only batch worker is now busy
+        q.submit("i1", lambda: job("i1"), group=INTERACTIVE)
+        await asyncio.sleep(0.01)
+        reserved_ran = list(order)
+        q.set_priority("b", "high")
+        for n in range(6):
+            q.submit(f"a{n}", lambda n=n: job(f"a{n}"), group="a")
+            q.submit(f"b{n}", lambda n=n: job(f"b{n}"), group="b")
+        gate.set()
+        await q.join()
+        lanes = q.lanes()
+        await q.stop()
+        return reserved_ran, order[2:], lanes
+
+    reserved_ran, served, lanes = asyncio.run(main())
+    assert reserved_ran == ["block", "i1"]
+    # b (high, weight 4) gets twice a's (normal, weight 2) share while both wait;
+    # "block" used half of a's first turn
+    assert served[:9] == ["a0", "b0", "b1", "b2", "b3", "a1", "a2", "b4", "b5"]
+    assert lanes["interactive"]["queued"] == lanes["batch"]["queued"] == 0
+    assert lanes["batch"]["wait_max_s"] is not None
+
+
+def test_slots_serve_interactive_waiters_first():
+    async def main():
+        slots, order = Slots(1), []
+
+        async def use(name, lane):
+            set_lane(lane)
+            async with slots:
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async with slots:
+            tasks = [asyncio.create_task(use("b1", BATCH)), asyncio.create_task(use("b2", BATCH)),
+                     asyncio.create_task(use("i1", INTERACTIVE))]
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        return order, slots.free
+
+    order, free = asyncio.run(main())
+    assert order == ["i1", "b1", "b2"] and free == 1
@@ -0,0 +1,95 @@
+# tests/test_jobstore.py
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
+
+from app.services import jobstore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///" + str(tmp_path / "jobs.db"))
+
+    async def init():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+    asyncio.run(init())
+    monkeypatch.setattr(jobstore, "AsyncSessionLocal", sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+    return jobstore
+
+
+def test_finished_jobs_are_never_claimed_again(store):
+    async def main():
+        await store.enqueue("b1", [("j1", 1, {"url": "https://a.example"}), ("j2", 2, {"url": "https://b.example"})])
+        rec = await store.claim("j1", owner="w1")
+        assert rec.payload == {"url": "https://a.example"} and rec.attempts == 1
+        assert await store.claim("j1", owner="w2") is None  # live lease
+        assert await store.complete("j1", "done", {"overall": 90}, run_id=7, owner="w1")
+        assert await store.claim("j1", owner="w2") is None  # finished
+        left = await store.unfinished()
+        done = await store.get("j1")
+        return [r.id for r in left], done
+
+    left, done = asyncio.run(main())
+    assert left == ["j2"]
+    assert (done.status, done.run_id, done.result, done.lease_owner) == ("done", 7, {"overall": 90}, None)
+
+
+def test_expired_lease_is_reclaimed_until_attempts_run_out(store, monkeypatch):
+    monkeypatch.setattr(store, "LEASE_SECONDS", -1)  # every lease is already expired
+    monkeypatch.setattr(store, "MAX_ATTEMPTS", 2)
+
+    async def main():
+        await store.enqueue("b2", [("j3", 1, {"url": "https://c.example"})])
+        assert (await store.claim("j3", owner="dead")).attempts == 1
+        assert (await store.claim("j3", owner="w2")).attempts == 2
+        stale = await store.complete("j3", "done", {}, owner="dead")
+        gave_up = await store.claim("j3", owner="w3")
+        return stale, gave_up, await store.get("j3")
+
+    stale, gave_up, rec = asyncio.run(main())
+    assert stale is False
+    assert gave_up is None
+    assert rec.status == "failed" and rec.error == "gave up after 2 attempts"
+
+
+def test_deferred_job_is_not_claimed_before_its_delay(store):
+    async def main():
+        await store.enqueue("b1", [("j1", 1, {"url": "https://down.example"})])
+        rec = await store.claim("j1", owner="w1")
+        assert await store.defer("j1", 60, owner="w1")
+        held = await store.claim_next(owner="w2")
+        left = store.lease_remaining(await store.get("j1"))
+        assert await store.defer("j1", 0, owner="w2") is False  # not its lease
+        async with store.AsyncSessionLocal() as session:
+            (await session.get(store.JobRecord, "j1")).lease_expires = store._now()
+            await session.commit()
+        again = await store.claim_next(owner="w2")
+        return rec, held, left, again
+
+    rec, held, left, again = asyncio.run(main())
+    assert rec.attempts == 1 and held is None and 55 < left <= 60
+    assert (again.id, again.status, again.attempts) == ("j1", "running", 2)
+
+
+def test_pause_resume_and_cancel_a_batch(store):
+    async def main():
+        await store.enqueue("b3", [(f"p{i}", i, {"url": f"https://p{i}.example"}) for i in range(3)])
+        await store.claim("p0", owner="w1")
+        paused = await store.pause_batch("b3")
+        held = await store.claim_next(owner="w2")
+        resumed = await store.resume_batch("b3")
+        cancelled = await store.cancel_batch("b3")
+        left = await store.unfinished()
+        stale = await store.renew("p0", owner="w1")
+        return paused, held, resumed, cancelled, left, stale
+
+    paused, held, resumed, cancelled, left, stale = asyncio.run(main())
+    assert sorted(paused) == ["p1", "p2"] and held is None
+    assert sorted(r.id for r in resumed) == ["p1", "p2"] and {r.status for r in resumed} == {"queued"}
+    assert sorted(cancelled) == ["p0", "p1", "p2"] and left == []
+    assert stale is False  # the running row's worker loses its lease
@@ -0,0 +1,20 @@
+# tests/test_merge.py
+from app.services.merge import merge_partial_nodes
+
+
+def test_first_seen_scalars_and_list_union():
+    merged = merge_partial_nodes([
+        {"@type": "Hospital", "name": "First", "telephone": "", "sameAs": ["https://fb.com/a"], "medicalSpecialty": "Cardiology"},
+        {"@type": "Hospital", "name": "Second", "telephone": "718-555-1212", "sameAs": ["https://fb.com/a", "https://x.com/a"]},
+        {"@graph": [{"@type": "Hospital", "medicalSpecialty": ["cardiology", "Oncology"], "availableService": [{"@type": "MedicalProcedure", "name": "MRI"}]}]},
+    ])
+    assert merged["name"] == "First"
+    assert merged["telephone"] == "718-555-1212"
+    assert merged["sameAs"] == ["https://fb.com/a", "https://x.com/a"]
+    assert merged["medicalSpecialty"] == ["Cardiology", "Oncology"]
+    assert merged["availableService"][0]["name"] == "MRI"
+
+
+def test_single_scalar_stays_scalar():
+    merged = merge_partial_nodes([{"medicalSpecialty": "Cardiology"}, {"medicalSpecialty": "cardiology"}])
+    assert merged["medicalSpecialty"] == "Cardiology"
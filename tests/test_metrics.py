@@ -0,0 +1,35 @@
+# tests/test_metrics.py
+import asyncio
+
+from app.services import metrics
+from app.services.pipeline import Stage, run_stages
+
+
+def test_histogram_buckets_are_cumulative(monkeypatch):
+    # Registered into a throwaway registry, so /metrics never shows it
+    monkeypatch.setattr(metrics, "_REGISTRY", [])
+    h = metrics.Histogram("test_latency_seconds", "test", ["stage"], buckets=(0.1, 1))
+    h.observe(0.05, stage="a")
+    h.observe(0.5, stage="a")
+    h.observe(3, stage="a")
+    text = h.render()
+    assert 'test_latency_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{stage="a"} 3' in text
+    assert metrics._REGISTRY == [h]
+
+
+def test_pipeline_records_stage_latency_and_errors():
+    def boom():
+        raise ValueError("nope")
+
+    before = metrics.STAGE_ERRORS.value(stage="metrics_boom")
+    stages = [
+        Stage("metrics_ok", lambda: 1, outputs=("a",)),
+        Stage("metrics_boom", boom, outputs=("b",), fallback=0),
+    ]
+    asyncio.run(run_stages(stages, {}))
+    assert metrics.STAGE_SECONDS.count(stage="metrics_ok") >= 1
+    assert metrics.STAGE_ERRORS.value(stage="metrics_boom") == before + 1
+    assert "# TYPE schemagen_stage_seconds histogram" in metrics.render()
@@ -0,0 +1,73 @@
+# tests/test_pipeline.py
+import asyncio
+import time
+
+import pytest
+
+from app.services.pipeline import PipelineError, Stage, replace_stage, run_stages
+
+
+async def _slow(value, delay=0.1):
+    await asyncio.sleep(delay)
+    return value
+
+
+def test_independent_stages_overlap():
+    async def a(x):
+        return await _slow(x + 1)
+
+    async def b(x):
+        return await _slow(x * 2)
+
+    stages = [
+        Stage("a", a, inputs=("x",), outputs=("a",)),
+        Stage("b", b, inputs=("x",), outputs=("b",)),
+        Stage("sum", lambda a, b: a + b, inputs=("a", "b"), outputs=("total",)),
+    ]
+    t0 = time.perf_counter()
+    ctx = asyncio.run(run_stages(stages, {"x": 3}))
+    assert ctx["total"] == 10
+    assert time.perf_counter() - t0 < 0.18
+    assert set(ctx["timings"]) == {"a", "b", "sum"}
+
+
+def test_timeout_uses_fallback_and_missing_fallback_raises():
+    async def hang(x):
+        await asyncio.sleep(5)
+
+    def boom(x):
+        raise ValueError("bad")
+
+    ctx = asyncio.run(run_stages([Stage("hang", hang, inputs=("x",), outputs=("y",), timeout=0.05, fallback="fb")], {"x": 1}))
+    assert ctx["y"] == "fb" and ctx["stage_errors"]["hang"] == "timeout"
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_stages([Stage("boom", boom, inputs=("x",), outputs=("y",))], {"x": 1}))
+
+
+def test_graph_checks_and_replace():
+    stages = [Stage("a", lambda q: q, inputs=("q",), outputs=("a",))]
+    with pytest.raises(PipelineError):
+        asyncio.run(run_stages(stages, {}))
+    swapped = replace_stage(stages, "a", fn=lambda q: q * 10)
+    assert asyncio.run(run_stages(swapped, {"q": 2}))["a"] == 20
+    events = []
+    asyncio.run(run_stages(stages, {"q": 1}, on_event=lambda name, phase, ctx: events.append((name, phase))))
+    assert events == [("a", "start"), ("a", "done")]
+
+
+def test_deadline_is_split_by_stage_budgets():
+    async def fetch(x):
+        await asyncio.sleep(5)
+
+    async def rest(page):
+        return await _slow("ok", 0.01)
+
+    stages = [
+        Stage("fetch", fetch, inputs=("x",), outputs=("page",), budget=0.25, fallback="none"),
+        Stage("rest", rest, inputs=("page",), outputs=("y",)),
+    ]
+    t0 = time.perf_counter()
+    ctx = asyncio.run(run_stages(stages, {"x": 1}, deadline=0.4))
+    assert 0.08 < time.perf_counter() - t0 < 0.3
+    assert ctx["stage_errors"]["fetch"] == "timeout" and ctx["y"] == "ok"
@@ -0,0 +1,49 @@
+# tests/test_prewarm.py
+import asyncio
+
+import httpx
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
+
+from app.services import prewarm
+from app.services.metrics import CACHE_EVENTS
+from app.services.schemas import AVAILABLE_PAGE_TYPES, load_schema
+from app.services.validate import compile_validator, validate_against_schema
+
+
+def test_readyz_is_503_until_prewarm_completes(tmp_path, monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///" + str(tmp_path / "prewarm.db"))
+    monkeypatch.setattr(prewarm, "AsyncSessionLocal", sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(prewarm, "_state", {"ready": False, "started": None, "finished": None, "components": {}})
+    from app.main import app
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        # No lifespan: startup (and its prewarm task) does not run, the test drives it
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            before = await client.get("/readyz")
+            await prewarm.run_prewarm(db_ready=True)
+            after = await client.get("/readyz")
+        return before, after
+
+    before, after = asyncio.run(main())
+    assert before.status_code == 503 and before.json()["ready"] is False
+    assert after.status_code == 200
+    body = after.json()
+    assert body["ready"] is True and body["total_ms"] is not None
+    # A component that fails (e.g. no browser installed) is reported but does not block readiness
+    assert body["components"]["validators"]["ok"] is True
+    assert set(body["components"]) >= {"settings", "validators", "browser"}
+
+
+def test_validators_are_compiled_once_and_reused():
+    schema = load_schema(AVAILABLE_PAGE_TYPES[0])
+    first = compile_validator(schema)
+    hits = CACHE_EVENTS.value(cache="validator", result="hit")
+    assert compile_validator(schema) is first
+    validate_against_schema({"@type": "Thing"}, schema)
+    assert CACHE_EVENTS.value(cache="validator", result="hit") == hits + 2
+    # A different schema object gets its own validator
+    assert compile_validator(dict(schema)) is not first
@@ -0,0 +1,269 @@
+# tests/test_progress_backends.py
+import asyncio
+import time
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
+
+import app.models  # noqa: F401  registers the job tables on SQLModel.metadata
+from app.services import progress
+
+
+def _sqlite_backend(tmp_path):
+    engine = create_async_engine("sqlite+aiosqlite:///" + str(tmp_path / "state.db"))
+
+    async def init():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+    asyncio.run(init())
+    return progress.SQLiteBackend(sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+
+
+@pytest.fixture(params=["memory", "local-redis", "sqlite"])
+def backend(request, tmp_path, monkeypatch):
+    b = _sqlite_backend(tmp_path) if request.param == "sqlite" else progress.make_backend(request.param)
+    monkeypatch.setattr(progress, "_backend", b)
+    return b
+
+
+def test_job_lifecycle_and_followers_on_every_backend(backend):
+    async def main():
+        await progress.create_job("lead")
+        await progress.create_job("dup")
+        await progress.update_job("lead", 20, "Fetching", {"bytes": 10})
+        await progress.link_job("dup", "lead")
+        await progress.update_job("lead", 60, "Generating")
+        await progress.unlink_job("dup", "lead")
+        await progress.update_job("lead", 90, "Scoring")
+        await progress.finish_job("lead", {"overall": 88, "jsonld": {"@type": "WebPage"}})
+        return await progress.get_job("lead"), await progress.get_job("dup"), await progress.get_job("nope")
+
+    lead, dup, missing = asyncio.run(main())
+    assert missing is None
+    assert (lead["status"], lead["progress"], lead["result"]["overall"]) == ("done", 100, 88)
+    assert [m["msg"] for m in lead["messages"]] == ["Fetching", "Generating", "Scoring"]
+    assert dup["coalesced_with"] == "lead" and dup["status"] == "queued"
+    assert [m["msg"] for m in dup["messages"]] == ["Fetching", "Duplicate of a running job; sharing its result", "Generating"]
+    assert dup["detail"] == {"bytes": 10} and dup["progress"] == 60
+
+
+def test_every_backend_reports_its_size_to_the_gauges(backend, monkeypatch):
+    from app.services import metrics
+    monkeypatch.setattr(progress, "_stats_at", [0.0])
+
+    async def main():
+        for jid in ("s1", "s2", "s3"):
+            await progress.create_job(jid)
+        await progress.update_job("s1", 10, "Fetching")
+        await progress.refresh_store_stats()
+
+    asyncio.run(main())
+    assert backend.size() == 3 and backend.stats()["jobs"] == 3
+    text = metrics.render()
+    assert "schemagen_jobs_tracked 3" in text
+    has_bytes = any(line.startswith("schemagen_job_store_bytes ") for line in text.splitlines())
+    assert has_bytes == isinstance(backend, progress.MemoryBackend)
+
+
+def test_claim_next_hands_each_row_to_one_worker(tmp_path, monkeypatch):
+    from app.services import jobstore
+
+    engine = create_async_engine("sqlite+aiosqlite:///" + str(tmp_path / "jobs.db"))
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        monkeypatch.setattr(jobstore, "AsyncSessionLocal", sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+        await jobstore.enqueue("b1", [(f"j{i}", i, {"url": f"https://{i}.example"}) for i in range(1, 6)])
+        claimed = await asyncio.gather(*[jobstore.claim_next(owner=f"w{n}") for n in range(8)])
+        return [r.id for r in claimed if r is not None]
+
+    ids = asyncio.run(main())
+    assert sorted(ids) == ["j1", "j2", "j3", "j4", "j5"]
+
+
+def test_subscribers_get_replay_then_live_events_without_polling(monkeypatch):
+    monkeypatch.setattr(progress, "_backend", progress.MemoryBackend())
+    monkeypatch.setattr(progress, "EVENT_RESYNC", 60)  # anything seen must have been pushed
+
+    async def main():
+        await progress.create_job("j")
+        await progress.update_job("j", 10, "Fetching")
+        got = []
+
+        async def listen():
+            async with progress.subscribe("j") as sub:
+                async for ev in sub:
+                    got.append((ev["type"], ev.get("msg") or ev.get("status"), ev["progress"]))
+
+        task = asyncio.create_task(listen())
+        await asyncio.sleep(0)
+        await progress.set_job_status("j", "running")
+        await progress.update_job("j", 50, "Generating")
+        await progress.set_job_detail("j", {"tokens": 12})
+        t0 = asyncio.get_running_loop().time()
+        waiter = asyncio.create_task(progress.wait_for_job("j", timeout=5))
+        await asyncio.sleep(0)
+        await progress.finish_job("j", {"overall": 1})
+        job = await waiter
+        await asyncio.wait_for(task, 1)
+        return got, job, asyncio.get_running_loop().time() - t0
+
+    got, job, waited = asyncio.run(main())
+    assert got == [("message", "Fetching", 10), ("status", "queued", 10), ("status", "running", 10),
+                   ("message", "Generating", 50), ("detail", "Generating", 50), ("finished", "Generating", 100)]
+    assert job["result"] == {"overall": 1} and waited < 0.5
+
+
+def test_messages_with_the_same_timestamp_all_reach_subscribers(backend, monkeypatch):
+    monkeypatch.setattr(progress, "_msg", lambda text: {"ts": 1.0, "msg": text})
+    monkeypatch.setattr(progress, "EVENT_RESYNC", 60)
+
+    async def main():
+        await progress.create_job("j")
+        await progress.update_job("j", 10, "Fetching")
+        got = []
+
+        async def listen():
+            async with progress.subscribe("j") as sub:
+                async for ev in sub:
+                    if ev["type"] == "message":
+                        got.append(ev["msg"])
+
+        task = asyncio.create_task(listen())
+        await asyncio.sleep(0.05)
+        await progress.update_job("j", 50, "Generating")
+        await progress.update_job("j", 90, "Scoring")
+        await progress.finish_job("j", {"overall": 1})
+        await asyncio.wait_for(task, 1)
+        return got, await progress.get_job("j")
+
+    got, job = asyncio.run(main())
+    assert got == ["Fetching", "Generating", "Scoring"]
+    seqs = [m["seq"] for m in job["messages"]]
+    assert seqs == sorted(set(seqs))
+
+
+def test_sqlite_backend_prunes_finished_jobs_past_the_ttl(tmp_path):
+    b = _sqlite_backend(tmp_path)
+    b.ttl = 60
+    old = time.time() - 120
+
+    async def main():
+        for jid, started in (("old", old), ("busy", old), ("new", time.time())):
+            await b.create(jid, {"status": "queued", "progress": 0, "started": started})
+            await b.log(jid, {"ts": started, "msg": "Fetching"}, status="running")
+        await b.add_follower("old", "dup")
+        await b.add_follower("busy", "old")
+        await b.set("old", status="done", progress=100)
+        await b.set("new", status="done", progress=100)
+        await b.refresh_stats()
+        return (await b.get("old"), await b.get("busy"), await b.get("new"),
+                await b.followers("old"), await b.followers("busy"))
+
+    gone, busy, new, old_followers, busy_followers = asyncio.run(main())
+    assert gone is None and old_followers == [] and busy_followers == []
+    assert busy["status"] == "running" and new["status"] == "done"  # running or recent jobs stay
+    assert b.size() == 2
+
+
+def test_local_redis_expires_job_keys_after_the_ttl(monkeypatch):
+    r = progress.LocalRedis()
+    b = progress.RedisBackend(r)
+    monkeypatch.setattr(progress, "JOB_TTL", 0.05)
+
+    async def main():
+        await b.create("j", {"status": "queued", "progress": 0, "started": time.time()})
+        await b.log("j", {"ts": time.time(), "msg": "Fetching"}, status="running")
+        await b.add_follower("j", "dup")
+        before = await b.get("j"), await b.followers("j")
+        await asyncio.sleep(0.1)
+        await b.refresh_stats()
+        return before, await b.get("j"), await b.followers("j")
+
+    (job, followers), after, after_followers = asyncio.run(main())
+    assert job["status"] == "running" and followers == ["dup"]
+    assert after is None and after_followers == [] and b.size() == 0
+    assert not r._data
+
+
+def test_redis_backend_caps_the_message_list_and_keeps_seqs_rising():
+    r = progress.LocalRedis()
+    b = progress.RedisBackend(r, max_messages=3)
+
+    async def main():
+        await b.create("j", {"status": "queued", "progress": 0, "started": time.time()})
+        seqs = [await b.log("j", {"ts": time.time(), "msg": f"step {n}"}, progress=n * 10) for n in range(1, 6)]
+        return seqs, await b.get("j")
+
+    seqs, job = asyncio.run(main())
+    assert seqs == [1, 2, 3, 4, 5]
+    assert [(m["msg"], m["seq"]) for m in job["messages"]] == [("step 3", 3), ("step 4", 4), ("step 5", 5)]
+    assert job["dropped_messages"] == 2 and len(r._data[b._k("j", ":msgs")]) == 3
+
+
+def test_memory_store_spills_large_results_and_evicts_finished_jobs(tmp_path):
+    b = progress.MemoryBackend(max_jobs=3, max_bytes=10**9, ttl=3600, spill_bytes=1000, spill_dir=str(tmp_path))
+
+    async def main():
+        for jid in ("a", "b", "c"):
+            await b.create(jid, {"status": "queued", "progress": 0, "messages": [], "result": None, "detail": None,
+                                 "started": 0.0})
+        await b.set("a", status="done", progress=100, result={"jsonld": "x" * 5000})
+        spilled_bytes = b.bytes
+        big = await b.get("a")
+        await b.set("b", status="done", progress=100, result={"overall": 1})
+        await b.get("a")  # a is now more recently read than b
+        await b.create("d", {"status": "queued", "progress": 0, "messages": [], "result": None, "detail": None,
+                             "started": 0.0})
+        return spilled_bytes, big, await b.get("a"), await b.get("b"), b.stats()
+
+    spilled_bytes, big, a, evicted, stats = asyncio.run(main())
+    assert big["result"] == {"jsonld": "x" * 5000} and spilled_bytes < 5000
+    assert a["result"]["jsonld"] == "x" * 5000
+    assert evicted is None  # least recently read finished job went first; running c and d stay
+    assert stats == {"jobs": 3, "finished": 1, "bytes": stats["bytes"], "spilled": 1}
+    assert list(tmp_path.iterdir())[0].name == "a.json.gz"
+
+
+def test_memory_store_applies_writes_in_order_while_a_result_spills(tmp_path, monkeypatch):
+    b = progress.MemoryBackend(spill_bytes=1000, spill_dir=str(tmp_path))
+    monkeypatch.setattr(progress, "_backend", b)
+
+    async def main():
+        await b.create("a", {"status": "running", "progress": 50, "messages": [], "result": None, "detail": None,
+                             "started": 0.0})
+        spill = asyncio.create_task(b.set("a", status="done", progress=100, result={"jsonld": "x" * 5000}))
+        await asyncio.sleep(0)  # the result is now being written to disk
+        await progress.update_job("a", 60, "late step")
+        await b.extend("a", [{"ts": 2.0, "msg": "late note"}])
+        await b.set("a", status="cancelled")
+        await spill
+        return await b.get("a")
+
+    job = asyncio.run(main())
+    assert job["status"] == "cancelled" and job["result"] == {"jsonld": "x" * 5000}
+    # The update made during the spill lands after it rather than being overwritten by it
+    assert job["progress"] == 60 and [m["msg"] for m in job["messages"]] == ["late step", "late note"]
+
+
+def test_memory_store_keeps_a_bounded_log_and_stable_snapshots(monkeypatch):
+    monkeypatch.setattr(progress, "_backend", progress.MemoryBackend(max_messages=3))
+
+    async def main():
+        await progress.create_job("j")
+        await progress.update_job("j", 10, "step 1")
+        before = await progress.get_job("j")
+        same = await progress.get_job("j")
+        for n in range(2, 6):
+            await progress.update_job("j", n * 10, f"step {n}")
+        return before, same, await progress.get_job("j")
+
+    before, same, after = asyncio.run(main())
+    assert same is before  # unchanged job: the cached snapshot is handed out again
+    assert [m["msg"] for m in before["messages"]] == ["step 1"] and before["progress"] == 10
+    assert [m["msg"] for m in after["messages"]] == ["step 3", "step 4", "step 5"]
+    assert after["dropped_messages"] == 2 and after["progress"] == 50
@@ -0,0 +1,186 @@
+# tests/test_providers.py
+import asyncio
+import json
+
+import httpx
+
+from app.services import providers, resilience
+from app.services.ai import GenerationInputs
+from app.services.providers import OllamaLLM, _parse_json_text, generation_stats
+
+
+CHAT_TEMPLATE = ("{{ if .System }}<|system|>\n{{ .System }}<|end|>\n{{ end }}"
+                 "{{ if .Prompt }}<|user|>\n{{ .Prompt }}<|end|>\n{{ end }}<|assistant|>\n{{ .Response }}<|end|>")
+
+
+def _patch_client(monkeypatch, response_text, seen, template=CHAT_TEMPLATE):
+    monkeypatch.setattr(providers, "_turn_templates", {})
+
+    def handler(request):
+        body = json.loads(request.content)
+        if request.url.path == "/api/show":
+            return httpx.Response(200, json={"template": template})
+        seen.append(body)
+        if body["options"].get("num_predict") == 1:
+            # The context ends with the one token generated while priming
+            return httpx.Response(200, json={"response": "{", "context": [1, 2, 3, 9], "eval_count": 1})
+        return httpx.Response(200, json={"response": response_text, "eval_count": 42, "prompt_eval_count": 100, "prompt_eval_duration": 5_000_000})
+
+    real = httpx.AsyncClient
+    monkeypatch.setattr(providers.httpx, "AsyncClient", lambda **kw: real(transport=httpx.MockTransport(handler)))
+
+
+def test_parse_json_text_slices_braces():
+    assert _parse_json_text('Sure! {"@type": "Hospital"} done') == {"@type": "Hospital"}
+    assert _parse_json_text("not json") is None
+
+
+def test_structured_mode_sends_schema_format(monkeypatch):
+    seen = []
+    _patch_client(monkeypatch, '{"@type": "Hospital", "name": "X", "url": "https://x"}', seen)
+    inputs = GenerationInputs(url="https://x", cleaned_text="text", page_type="Hospital")
+    out = asyncio.run(OllamaLLM(model="m").generate_jsonld(inputs))
+    assert out["name"] == "X"
+    assert seen[-1]["format"]["properties"]["@type"] == {"const": "Hospital"}
+    assert generation_stats()["structured"]["avg_eval_tokens"] > 0
+
+
+def test_freeform_parse_failure_counted(monkeypatch):
+    seen = []
+    _patch_client(monkeypatch, "I cannot help with that", seen)
+    before = generation_stats().get("freeform", {}).get("parse_failures", 0)
+    inputs = GenerationInputs(url="https://x", cleaned_text="text", page_type="Physician", subject="Dr. Y")
+    out = asyncio.run(OllamaLLM(model="m", structured=False).generate_jsonld(inputs))
+    assert "format" not in seen[-1]
+    assert out["name"] == "Dr. Y"
+    # Each unparsed response counts, including the retry
+    assert generation_stats()["freeform"]["parse_failures"] == before + 1 + resilience.POLICIES["llm_parse"].attempts
+
+
+def test_site_prefix_evaluated_once_per_host(monkeypatch, capsys):
+    monkeypatch.delenv("SCHEMAGEN_DEBUG", raising=False)
+    seen = []
+    reused = generation_stats().get("structured", {}).get("prefix_reused", 0)
+    _patch_client(monkeypatch, '{"@type": "Hospital", "name": "X", "url": "https://h.example/a"}', seen)
+    llm = OllamaLLM(model="m")
+
+    async def run():
+        for path in ("a", "b", "c"):
+            await llm.generate_jsonld(GenerationInputs(url=f"https://h.example/{path}", cleaned_text="text", page_type="Hospital"))
+
+    asyncio.run(run())
+    primes = [b for b in seen if b["options"].get("num_predict") == 1]
+    pages = [b for b in seen if b["options"].get("num_predict") != 1]
+    assert len(primes) == 1 and len(pages) == 3
+    assert all(b["context"] == [1, 2, 3] and "schema.org assistant" not in b["prompt"] for b in pages)
+    # Raw on both calls, with the chat template's user turn written around them:
+    # primed prefix + page is exactly what the template renders for the whole prompt
+    assert all(b.get("raw") is True for b in seen)
+    last = GenerationInputs(url="https://h.example/c", cleaned_text="text", page_type="Hospital")
+    prompt = llm._prefix_prompt(last) + llm._page_prompt(last, "text")
+    assert primes[0]["prompt"] + pages[-1]["prompt"] == f"<|user|>\n{prompt}<|end|>\n<|assistant|>\n"
+    assert all(b["keep_alive"] for b in seen)
+    assert llm.last_call["prefix_reused"] and llm.last_call["prompt_eval_ms"] == 5
+    # Per-call timings go to generation_stats, not stderr
+    assert generation_stats()["structured"]["prefix_reused"] == reused + 3
+    assert "[ollama]" not in capsys.readouterr().err
+
+
+def test_cancelled_priming_releases_waiters(monkeypatch):
+    llm = OllamaLLM(model="m")
+    started = asyncio.Event()
+
+    async def post(payload, on_tokens=None):
+        started.set()
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(llm, "_post", post)
+    inputs = GenerationInputs(url="https://slow.example/a", cleaned_text="text", page_type="Hospital")
+
+    async def run():
+        leader = asyncio.create_task(llm._prefix_context(inputs, "prefix"))
+        await started.wait()
+        follower = asyncio.create_task(llm._prefix_context(inputs, "prefix"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await asyncio.wait_for(follower, 1)
+
+    assert asyncio.run(run()) is None
+
+
+def _long_page():
+    sections = [f"Section {i}\n" + " ".join(f"word{i}x{j} clinic care" for j in range(40)) for i in range(30)]
+    return "\n".join(sections) + "\nTAILMARKER contact and opening hours"
+
+
+def test_long_page_reaches_the_model_in_full(monkeypatch):
+    seen = []
+    _patch_client(monkeypatch, '{"@type": "Hospital", "name": "X"}', seen)
+    text = _long_page()
+    inputs = GenerationInputs(url="https://long.example/", cleaned_text=text, page_type="Hospital", long_document=True)
+    asyncio.run(OllamaLLM(model="m", reuse_prefix=False).generate_jsonld(inputs))
+    prompts = [b["prompt"] for b in seen]
+    assert len(prompts) > providers.LONG_DOC_CHUNKS - 1
+    assert any("TAILMARKER" in p for p in prompts)
+    assert all(any(f"word{i}x39 " in p for p in prompts) for i in range(30))
+
+
+def test_long_page_chunks_run_concurrently_within_the_ollama_slots(monkeypatch):
+    from app.services.jobqueue import Slots
+
+    monkeypatch.setattr(providers, "_ollama_sem", Slots(2))
+    live, peak = [0], [0]
+
+    async def handler(request):
+        live[0] += 1
+        peak[0] = max(peak[0], live[0])
+        await asyncio.sleep(0.05)
+        live[0] -= 1
+        return httpx.Response(200, json={"response": '{"@type": "Hospital", "name": "X"}'})
+
+    real = httpx.AsyncClient
+    monkeypatch.setattr(providers.httpx, "AsyncClient", lambda **kw: real(transport=httpx.MockTransport(handler)))
+    inputs = GenerationInputs(url="https://long.example/", cleaned_text=_long_page(), page_type="Hospital",
+                              long_document=True)
+    asyncio.run(OllamaLLM(model="m", reuse_prefix=False).generate_jsonld(inputs))
+    assert peak[0] == 2
+
+
+def test_template_turns_and_unsupported_templates_skip_raw_mode(monkeypatch):
+    assert providers._template_turn(CHAT_TEMPLATE) == ("<|user|>\n", "<|end|>\n<|assistant|>\n")
+    assert providers._template_turn("{{ .Prompt }}") == ("", "")
+    loop = "{{- range .Messages }}<|{{ .Role }}|>{{ .Content }}{{ end }}<|assistant|>"
+    assert providers._template_turn(loop) is None
+
+    seen = []
+    _patch_client(monkeypatch, '{"@type": "Hospital", "name": "X"}', seen, template=loop)
+    llm = OllamaLLM(model="m")
+    asyncio.run(llm.generate_jsonld(GenerationInputs(url="https://t.example/a", cleaned_text="text", page_type="Hospital")))
+    # One templated call with the whole prompt: no priming, no raw, no context
+    assert len(seen) == 1 and "raw" not in seen[0] and "context" not in seen[0]
+    assert "schema.org assistant" in seen[0]["prompt"] and not llm.last_call["prefix_reused"]
+
+
+def test_long_chunks_fit_the_context_window_they_are_sent_with(monkeypatch):
+    monkeypatch.setattr(providers, "OLLAMA_NUM_CTX", 2560)
+    seen = []
+    _patch_client(monkeypatch, '{"@type": "Hospital", "name": "X"}', seen)
+    llm = OllamaLLM(model="m", reuse_prefix=False)
+    inputs = GenerationInputs(url="https://long.example/", cleaned_text=_long_page(), page_type="Hospital", long_document=True)
+    asyncio.run(llm.generate_jsonld(inputs))
+    schema = providers.estimate_tokens(json.dumps(llm._format_for("Hospital")))
+    assert len(seen) > providers.LONG_DOC_CHUNKS
+    for body in seen:
+        assert body["options"]["num_ctx"] == 2560
+        used = providers.estimate_tokens(body["prompt"]) + schema + providers.OUTPUT_RESERVE_TOKENS
+        assert used <= 2560
+
+
+def test_ordinary_pages_take_one_call(monkeypatch):
+    seen = []
+    _patch_client(monkeypatch, '{"@type": "Hospital", "name": "X"}', seen)
+    text = " ".join(f"clinic care word{i}" for i in range(500))  # a few thousand tokens, under LONG_DOC_TOKENS
+    assert providers.DEFAULT_CONTEXT_TOKENS * 3 < providers.estimate_tokens(text) < providers.LONG_DOC_TOKENS
+    asyncio.run(OllamaLLM(model="m", reuse_prefix=False).generate_jsonld(
+        GenerationInputs(url="https://short.example/", cleaned_text=text, page_type="Hospital")))
+    assert len(seen) == 1 and seen[0]["options"]["num_ctx"] == providers.OLLAMA_NUM_CTX
@@ -0,0 +1,75 @@
+# tests/test_resilience.py
+import asyncio
+
+import pytest
+
+from app.services import resilience
+from app.services.resilience import CircuitOpen, RetryPolicy, ServerError
+
+
+@pytest.fixture(autouse=True)
+def fast(monkeypatch):
+    monkeypatch.setattr(resilience, "POLICIES", {k: RetryPolicy(p.attempts, 0.001, 0.001)
+                                                 for k, p in resilience.POLICIES.items()})
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "BREAKER_FAILURES", 3)
+    monkeypatch.setattr(resilience, "BREAKER_COOLDOWN", 0.05)
+
+
+def test_transient_failures_are_retried_per_class_and_counted():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ServerError("https://a.example/", 503)
+        return "ok"
+
+    async def not_found():
+        raise ServerError("https://a.example/missing", 404)
+
+    async def main():
+        with resilience.tracking() as retries:
+            out = await resilience.call(flaky, host="a.example")
+        with pytest.raises(ServerError):
+            await resilience.call(not_found, host="a.example")
+        return out, retries
+
+    out, retries = asyncio.run(main())
+    assert out == "ok" and retries == {"server_error": 2}
+    assert resilience.classify(asyncio.TimeoutError()) == "timeout"
+    assert resilience.classify(RuntimeError("net::ERR_CONNECTION_REFUSED at https://x")) == "connection"
+    assert resilience.classify(ValueError("bad")) is None
+
+
+def test_breaker_opens_fails_fast_and_a_probe_closes_it(monkeypatch):
+    monkeypatch.setattr(resilience, "POLICIES", {})  # no retries: one failure per call
+    down = [True]
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        if down[0]:
+            raise TimeoutError("navigation timed out")
+        return "page"
+
+    async def main():
+        for _ in range(3):
+            with pytest.raises(TimeoutError):
+                await resilience.call(fetch, host="down.example")
+        with pytest.raises(CircuitOpen) as info:
+            await resilience.call(fetch, host="down.example")
+        tripped = (len(calls), info.value.retry_after > 0, resilience.breakers()["down.example"]["state"])
+        await asyncio.sleep(0.06)
+        with pytest.raises(TimeoutError):  # the probe fails: open again, for twice as long
+            await resilience.call(fetch, host="down.example")
+        reopened = resilience.breaker("down.example").trips
+        await asyncio.sleep(0.11)
+        down[0] = False
+        page = await resilience.call(fetch, host="down.example")
+        return tripped, reopened, page, resilience.breakers()
+
+    tripped, reopened, page, left = asyncio.run(main())
+    assert tripped == (3, True, "open")
+    assert reopened == 2
+    assert page == "page" and left == {}
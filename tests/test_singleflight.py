@@ -0,0 +1,234 @@
+# tests/test_singleflight.py
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import main_part2
+from app.services.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"overall": 70}
+
+    async def main():
+        sf = SingleFlight("test")
+        first = await asyncio.gather(*(sf.do("k", compute) for _ in range(5)))
+        again = await sf.do("k", compute)
+        return sf, first, again
+
+    sf, first, again = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(r == {"overall": 70} for r in first) and again == {"overall": 70}
+    assert (sf.misses, sf.shared, sf.hits) == (1, 4, 1)
+
+
+def test_failures_are_not_memoized():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("down")
+        return 1
+
+    async def main():
+        sf = SingleFlight("test")
+        with pytest.raises(RuntimeError):
+            await sf.do("k", flaky)
+        return await sf.do("k", flaky)
+
+    assert asyncio.run(main()) == 1
+    assert len(attempts) == 2
+
+
+def test_competitors_scored_concurrently_once_per_batch(monkeypatch):
+    scored = []
+
+    async def fake_score(url, primary_type, settings):
+        scored.append(url)
+        await asyncio.sleep(0.1)
+        if "broken" in url:
+            raise RuntimeError("fetch failed")
+        return {"url": url, "overall": 50, "valid": True}
+
+    monkeypatch.setattr(main_part2, "_score_competitor", fake_score)
+    settings = SimpleNamespace(provider="dummy", provider_model=None)
+
+    async def main():
+        cache = SingleFlight("competitor")
+        rows = [["https://a.example", "https://b.example"]] * 10 + [["https://broken.example", " "]]
+        return await asyncio.gather(*(
+            main_part2._stage_competitors(r, "MedicalClinic", settings, cache) for r in rows
+        ))
+
+    t0 = time.perf_counter()
+    results = asyncio.run(main())
+    assert time.perf_counter() - t0 < 0.3
+    assert sorted(scored) == ["https://a.example", "https://b.example", "https://broken.example"]
+    comparisons, notes = results[0]
+    assert [c["url"] for c in comparisons] == ["https://a.example", "https://b.example"] and notes == []
+    assert results[-1] == ([{"url": "https://broken.example", "error": "fetch failed"}], ["Competitor1 failed: fetch failed"])
+
+
+def test_comparisons_stay_positional_when_competitor1_fails(monkeypatch):
+    from app.services import export
+    from app.web.routers.batch import _compact
+
+    async def fake_score(url, primary_type, settings):
+        if "broken" in url:
+            raise RuntimeError("fetch failed")
+        return {"url": url, "overall": 80, "valid": True}
+
+    monkeypatch.setattr(main_part2, "_score_competitor", fake_score)
+    settings = SimpleNamespace(provider="dummy", provider_model=None)
+
+    async def main():
+        cache = SingleFlight("competitor")
+        return [await main_part2._stage_competitors(r, "MedicalClinic", settings, cache)
+                for r in (["https://broken.example", "https://good.example"], ["", "https://good.example"])]
+
+    (failed, _), (blank, _) = asyncio.run(main())
+    assert failed == [{"url": "https://broken.example", "error": "fetch failed"},
+                      {"url": "https://good.example", "overall": 80, "valid": True}]
+    assert blank[0] is None and blank[1]["overall"] == 80
+    for comparisons in (failed, blank):
+        flat = export.flatten({"comparisons": comparisons})
+        assert flat["competitor1_overall"] in ("", None) and flat["competitor2_overall"] == 80
+        assert _compact("j", {"status": "done", "result": {"comparisons": comparisons}})["c"] == [None, 80]
+
+
+def test_normalize_url_ignores_cosmetic_differences():
+    from app.services.coalesce import normalize_url
+    assert normalize_url("HTTPS://Example.org:443/Care/?b=2&a=1&utm_source=x#top") == "https://example.org/Care?a=1&b=2"
+    assert normalize_url("example.org") == "https://example.org/"
+
+
+def test_duplicate_jobs_attach_to_inflight_run(monkeypatch):
+    from app.services import progress
+    runs = []
+
+    async def fake_process(url, *args, job_id=None, **kwargs):
+        runs.append(job_id)
+        await progress.update_job(job_id, 50, "Generating JSON-LD")
+        await asyncio.sleep(0.05)
+        await progress.update_job(job_id, 90, "Scoring")
+        return {"url": url, "overall": 80}
+
+    monkeypatch.setattr(main_part2, "_process_single", fake_process)
+
+    async def main():
+        for jid in ("lead", "dup1", "dup2"):
+            await progress.create_job(jid)
+        args = ("cardiology", None, None, None, None, None, None, None, "Hospital", None)
+
+        async def submit(jid, url, delay):
+            await asyncio.sleep(delay)
+            return await main_part2._process_shared(url, *args, job_id=jid)
+
+        results = await asyncio.gather(
+            submit("lead", "https://example.org/heart", 0),
+            submit("dup1", "https://EXAMPLE.org/heart/", 0.01),
+            submit("dup2", "https://example.org/heart#x", 0.02),
+        )
+        return results, await progress.get_job("dup2")
+
+    results, dup = asyncio.run(main())
+    assert len(runs) == 1 and runs[0].startswith("flight-")
+    assert [r["overall"] for r in results] == [80, 80, 80]
+    assert results[1]["coalesced_with"] == "lead"
+    msgs = [m["msg"] for m in dup["messages"]]
+    assert msgs[0] == "Generating JSON-LD" and msgs[-1] == "Scoring"
+    assert dup["progress"] == 90
+
+
+def test_duplicate_attached_while_leader_finishes_gets_its_own_copy(monkeypatch):
+    from app.services import progress
+    runs = []
+
+    async def fake_process(url, *args, job_id=None, **kwargs):
+        runs.append(job_id)
+        await asyncio.sleep(0.02)
+        return {"url": url, "jsonld": {"@type": "Hospital"}, "comparisons": [{"overall": 50}]}
+
+    real_link = progress.link_job
+
+    async def slow_link(job_id, leader_id, **kwargs):
+        await real_link(job_id, leader_id, **kwargs)
+        await asyncio.sleep(0.05)  # the leader finishes meanwhile
+
+    monkeypatch.setattr(main_part2, "_process_single", fake_process)
+    monkeypatch.setattr(main_part2, "link_job", slow_link)
+
+    async def main():
+        for jid in ("lead2", "late"):
+            await progress.create_job(jid)
+        args = ("cardiology", None, None, None, None, None, None, None, "Hospital", None)
+
+        async def submit(jid, delay):
+            await asyncio.sleep(delay)
+            return await main_part2._process_shared("https://example.org/lungs", *args, job_id=jid)
+
+        return await asyncio.gather(submit("lead2", 0), submit("late", 0.01))
+
+    lead, late = asyncio.run(main())
+    assert len(runs) == 1
+    assert late["coalesced_with"] == "lead2" and late["jsonld"] == lead["jsonld"]
+    assert late["jsonld"] is not lead["jsonld"] and late["comparisons"][0] is not lead["comparisons"][0]
+
+
+def test_cancelling_the_leader_leaves_the_flight_running(monkeypatch):
+    from app import db
+    from app.services import progress
+    runs, sessions = [], []
+
+    class FakeSession:
+        async def __aenter__(self):
+            sessions.append("open")
+            return self
+
+        async def __aexit__(self, *exc):
+            sessions.append("closed")
+
+    async def fake_process(url, *args, job_id=None, **kwargs):
+        runs.append((job_id, args[-1]))
+        await progress.update_job(job_id, 40, "Fetching page")
+        await asyncio.sleep(0.1)
+        await progress.update_job(job_id, 90, "Scoring")
+        return {"url": url, "overall": 70}
+
+    monkeypatch.setattr(main_part2, "_process_single", fake_process)
+    monkeypatch.setattr(db, "AsyncSessionLocal", FakeSession)
+
+    async def main():
+        for jid in ("lead3", "dup3", "dup4"):
+            await progress.create_job(jid)
+        args = ("cardiology", None, None, None, None, None, None, None, "Hospital", "request-session")
+        url = "https://example.org/kidney"
+        leader = asyncio.ensure_future(main_part2._process_shared(url, *args, job_id="lead3"))
+        await asyncio.sleep(0.02)
+        follower = asyncio.ensure_future(main_part2._process_shared(url, *args, job_id="dup3"))
+        await asyncio.sleep(0.02)
+        leader.cancel()
+        await asyncio.sleep(0.02)
+        # Still registered: a later duplicate attaches to the same flight
+        late = await main_part2._process_shared(url, *args, job_id="dup4")
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, late, await progress.get_job("dup3"), await progress.get_job("lead3")
+
+    result, late, dup, lead = asyncio.run(main())
+    assert len(runs) == 1 and runs[0][0].startswith("flight-") and runs[0][0] != "lead3"
+    assert isinstance(runs[0][1], FakeSession) and sessions == ["open", "closed"]
+    assert result["overall"] == 70 and result["coalesced_with"] == "lead3"
+    assert late["overall"] == 70 and late["coalesced_with"] == "lead3"
+    assert dup["progress"] == 90 and dup["messages"][-1]["msg"] == "Scoring"
+    # The cancelled leader stopped mirroring the flight
+    assert lead["progress"] == 40
+    assert not main_part2._leaders
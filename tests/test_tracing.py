@@ -0,0 +1,98 @@
+# tests/test_tracing.py
+import asyncio
+import json
+
+from app.services import tracing
+from app.services.pipeline import Stage, run_stages
+
+
+def test_stage_spans_nest_under_job_trace():
+    def work(x):
+        with tracing.span("inner", size=x):
+            return x + 1
+
+    stages = [Stage("work", work, inputs=("x",), outputs=("y",), thread=True)]
+
+    async def main():
+        with tracing.trace_job("trace-job-1"):
+            await run_stages(stages, {"x": 1})
+
+    asyncio.run(main())
+    trace = tracing.get_trace("trace-job-1")
+    names = {sp.name: sp for sp in trace.spans}
+    assert names["stage work"].parent_id == names["job"].span_id
+    assert names["inner"].parent_id == names["stage work"].span_id
+    assert names["inner"].attrs == {"size": 1}
+    assert [r["depth"] for r in tracing.waterfall(trace)] == [0, 1, 2]
+
+
+def test_span_outside_job_is_noop():
+    with tracing.span("orphan") as sp:
+        sp.set(bytes=10)
+    assert tracing.current_trace_id() is None
+
+
+def test_trace_file_export(tmp_path, monkeypatch):
+    out = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(out))
+    try:
+        with tracing.trace_job("trace-job-2"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    body = json.loads(out.read_text().splitlines()[-1])
+    span = body["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert span["status"] == {"code": 2, "message": "ValueError: boom"}
+    assert {"key": "job.id", "value": {"stringValue": "trace-job-2"}} in span["attributes"]
+
+
+def test_trace_file_written_off_the_event_loop(tmp_path, monkeypatch):
+    out = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(out))
+
+    async def main():
+        for n in range(3):
+            with tracing.trace_job(f"trace-async-{n}"):
+                pass
+        # Queued behind the three writes on the single writer thread
+        await asyncio.get_running_loop().run_in_executor(tracing._file_writer, lambda: None)
+
+    asyncio.run(main())
+    jobs = [json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["attributes"][0]["value"]["stringValue"]
+            for line in out.read_text().splitlines()]
+    assert jobs == ["trace-async-0", "trace-async-1", "trace-async-2"]
+
+
+def test_reentered_trace_exports_only_new_spans(tmp_path, monkeypatch):
+    out = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(out))
+    with tracing.trace_job("trace-reenter"):
+        with tracing.span("fetch"):
+            pass
+    with tracing.trace_job("trace-reenter", "save result"):
+        pass
+    batches = [[sp["name"] for sp in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+               for line in out.read_text().splitlines()]
+    assert batches == [["job", "fetch"], ["save result"]]
+    assert len(tracing.get_trace("trace-reenter").spans) == 3
+
+
+def test_collector_posts_are_held_until_done(monkeypatch):
+    monkeypatch.setattr(tracing, "OTLP_ENDPOINT", "http://collector.invalid")
+    posted = []
+
+    async def fake_post(body):
+        await asyncio.sleep(0.01)
+        posted.append(body)
+
+    monkeypatch.setattr(tracing, "_post", fake_post)
+
+    async def main():
+        with tracing.trace_job("trace-post"):
+            pass
+        held = len(tracing._posts)
+        await asyncio.sleep(0.05)
+        return held
+
+    assert asyncio.run(main()) == 1
+    assert len(posted) == 1 and not tracing._posts